@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Identifiants de l'application OAuth (téléchargés depuis Google Cloud Console)
+CLIENT_CONFIG_PATH = os.getenv("GOOGLE_CLIENT_CONFIG", "config.json")
+# Jeton d'actualisation enregistré après la première connexion (lisible par le seul utilisateur)
+TOKEN_PATH = os.getenv("GOOGLE_TOKEN_PATH", "token.json")
+TOKEN_FILE_MODE = 0o600
+# Point d'accès d'actualisation (google-auth impose celui de Google au chargement ; tests et proxys)
+TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI")
+
+# Une seule autorisation pour Gmail et Sheets : emails.py et sheet.py partagent le même jeton
+SCOPES = [
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/spreadsheets",
+]
+
+_lock = threading.Lock()
+_credentials = None
+# Clients build() déjà construits, par (api, version)
+_services = {}
+
+# -------------------------------------------------------------
+# STOCKAGE DU JETON
+# -------------------------------------------------------------
+def load_token(path=TOKEN_PATH, scopes=SCOPES):
+    """Charge les identifiants enregistrés, ou None s'ils sont absents,
+    illisibles ou n'accordent pas tous les scopes demandés."""
+    try:
+        creds = Credentials.from_authorized_user_file(path, scopes)
+    except FileNotFoundError:
+        return None
+    except (ValueError, json.JSONDecodeError) as e:
+        print(f"Jeton '{path}' illisible, nouvelle connexion requise : {e}")
+        return None
+    # from_authorized_user_file reprend les scopes demandés : on vérifie ceux réellement accordés
+    with open(path, encoding="utf-8") as f:
+        granted = json.load(f).get("scopes") or []
+    if granted and not set(scopes) <= set(granted):
+        print("Le jeton enregistré ne couvre pas tous les scopes requis, nouvelle connexion requise.")
+        return None
+    if TOKEN_URI:
+        expiry = creds.expiry
+        creds = creds.with_token_uri(TOKEN_URI)
+        # with_token_uri ne recopie pas l'échéance du jeton d'accès
+        creds.expiry = expiry
+    return creds
+
+
+def save_token(creds, path=TOKEN_PATH):
+    """Enregistre les identifiants (jeton d'actualisation compris) en mode 0600."""
+    tmp_path = path + ".tmp"
+    # Créé directement avec les droits restreints : le jeton n'est jamais lisible par les autres
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, TOKEN_FILE_MODE)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(creds.to_json())
+    os.chmod(tmp_path, TOKEN_FILE_MODE)
+    os.replace(tmp_path, path)
+
+# -------------------------------------------------------------
+# OBTENTION DES IDENTIFIANTS
+# -------------------------------------------------------------
+def _interactive_login(scopes, config_path):
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        print(f"Erreur: Le fichier '{config_path}' est introuvable.")
+        print("Veuillez le télécharger depuis Google Cloud Console.")
+        raise
+    flow = InstalledAppFlow.from_client_config(config, scopes)
+    return flow.run_local_server(port=0)
+
+
+def get_credentials(scopes=SCOPES, token_path=TOKEN_PATH, config_path=CLIENT_CONFIG_PATH):
+    """Identifiants Google valides pour le processus.
+
+    Dans l'ordre : identifiants déjà chargés, jeton enregistré (actualisé
+    silencieusement s'il a expiré), puis connexion dans le navigateur en
+    dernier recours. Le jeton est réenregistré après chaque actualisation.
+    """
+    global _credentials
+    with _lock:
+        creds = _credentials or load_token(token_path, scopes)
+        if creds is not None and not creds.valid:
+            if creds.expired and creds.refresh_token:
+                try:
+                    creds.refresh(Request())
+                    save_token(creds, token_path)
+                except RefreshError as e:
+                    # Jeton révoqué ou expiré côté Google
+                    print(f"Actualisation du jeton refusée, nouvelle connexion requise : {e}")
+                    creds = None
+            else:
+                creds = None
+        if creds is None:
+            creds = _interactive_login(scopes, config_path)
+            save_token(creds, token_path)
+        _credentials = creds
+        return creds
+
+
+def get_service(api, version, token_path=TOKEN_PATH):
+    """Client build() de l'API, construit une seule fois par processus.
+
+    Les clients googleapiclient ne sont pas thread-safe : les appels
+    concurrents doivent passer par des requêtes batch, comme dans gmail_fetch.
+    `token_path` : jeton d'une autre boîte (appeler reset() avant de changer de boîte).
+    """
+    key = (api, version)
+    service = _services.get(key)
+    if service is None:
+        creds = get_credentials(token_path=token_path)
+        with _lock:
+            service = _services.get(key)
+            if service is None:
+                service = _services[key] = build(api, version, credentials=creds, cache_discovery=False)
+    return service
+
+
+def reset():
+    """Oublie les identifiants et clients du processus (le jeton enregistré est conservé)."""
+    global _credentials
+    with _lock:
+        _credentials = None
+        _services.clear()
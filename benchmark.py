@@ -0,0 +1,1536 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import urllib.request
+
+import pandas as pd
+
+import emails
+import evaluation
+from cascade import ModelCascade, ModelSpec
+from fake_google import FakeGmailService, FakeSheetsService, start_fake_token_server
+from gmail_fetch import FetchStats
+from fake_llm import start_fake_server
+from rate_limit import TokenBucket
+
+# -------------------------------------------------------------
+# OUTILS
+# -------------------------------------------------------------
+def make_emails(n):
+    """Génère `n` emails synthétiques."""
+    return [
+        {"id": str(i), "subject": f"Email de test {i}", "body": f"Contenu du message numéro {i}."}
+        for i in range(n)
+    ]
+
+
+@contextlib.contextmanager
+def isolated_run():
+    """Exécute le pipeline dans un répertoire temporaire.
+
+    Les fichiers produits (JSON, cache, état de synchronisation) n'écrasent
+    ainsi pas ceux du dépôt.
+    """
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            yield tmp_dir
+        finally:
+            os.chdir(previous_dir)
+
+
+def use_fake_llm(**options):
+    """Démarre le faux serveur LLM et y redirige emails.classify_email."""
+    server, url = start_fake_server(**options)
+    emails.MISTRAL_URL = url
+    emails.MISTRAL_KEY = "fake-key"
+    emails.rate_limiter = TokenBucket(rate=0)
+    # Un seul modèle : les scénarios ne mesurent pas la cascade (voir bench_cascade)
+    emails.MODEL_CASCADE = ModelCascade.single(emails.MISTRAL_MODEL)
+    return server
+
+# -------------------------------------------------------------
+# BENCHMARK : CLASSIFICATION CONCURRENTE
+# -------------------------------------------------------------
+def bench_concurrency(n=200, latency=0.05, workers=(1, 4, 8, 16), throttle_rate=0.0):
+    """Mesure le débit de classification selon le nombre d'appels simultanés."""
+    server = use_fake_llm(latency=latency, throttle_rate=throttle_rate)
+
+    print(f"{n} emails, latence simulée {latency * 1000:.0f} ms, taux de 429 {throttle_rate:.0%}")
+    baseline = None
+    try:
+        for max_in_flight in workers:
+            batch = make_emails(n)
+            start = time.perf_counter()
+            results = list(emails.classify_emails_concurrently(batch, max_in_flight=max_in_flight))
+            elapsed = time.perf_counter() - start
+
+            assert [mail["subject"] for mail, _ in results] == [mail["subject"] for mail in batch]
+            throughput = n / elapsed
+            baseline = baseline or throughput
+            print(f"max_in_flight={max_in_flight:<3} {elapsed:6.2f}s  "
+                  f"{throughput:7.1f} emails/s  x{throughput / baseline:.1f}")
+    finally:
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : SYNCHRONISATION INCRÉMENTALE
+# -------------------------------------------------------------
+def bench_incremental(n=500, new=10, latency=0.01):
+    """Compare les appels Gmail/LLM d'une synchronisation complète et des passages incrémentaux."""
+    server = use_fake_llm(latency=latency)
+    gmail = FakeGmailService()
+    for i in range(n):
+        gmail.add_message(f"Email de test {i}", f"Contenu du message numéro {i}.")
+
+    def run(label):
+        gmail.calls.clear()
+        llm_before = server.request_count
+        start = time.perf_counter()
+        # Sans déduplication : chaque email doit coûter son appel LLM (voir bench_dedup)
+        with contextlib.redirect_stdout(io.StringIO()):
+            emails.process_all_emails(incremental=True, gmail_service=gmail, dedup=False)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<30} {elapsed:6.2f}s  messages.get={gmail.calls['messages.get']:<4} "
+              f"history.list={gmail.calls['history.list']:<2} appels LLM={server.request_count - llm_before}")
+
+    try:
+        with isolated_run():
+            run("1er passage (complet)")
+            run("2e passage, aucun nouveau")
+            assert gmail.calls["messages.get"] == 0, \
+                f"{gmail.calls['messages.get']} messages.get sans nouvel email"
+            for i in range(new):
+                gmail.add_message(f"Nouvel email {i}", f"Nouveau contenu {i}.")
+            run(f"3e passage, {new} nouveaux")
+            gmail.expire_history()
+            run("4e passage, historique expiré")
+    finally:
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : RÉCUPÉRATION GMAIL PAR BATCHS
+# -------------------------------------------------------------
+def legacy_get_emails(service, max_results):
+    """Chemin d'origine : un list puis un get(format="full") sans masque par message."""
+    results = service.users().messages().list(userId="me", maxResults=min(max_results, 500)).execute()
+    return [
+        emails.parse_message(service.users().messages().get(userId="me", id=msg["id"], format="full").execute())
+        for msg in results.get("messages", [])
+    ]
+
+
+def bench_fetch(n=1200):
+    """Compare requêtes HTTP et octets reçus : chemin d'origine vs batchs + masques."""
+    gmail = FakeGmailService()
+    for i in range(n):
+        # Un email sur 50 transféré plusieurs fois : corps à 4 niveaux de parties et plus
+        gmail.add_message(f"Email de test {i}", f"Contenu du message numéro {i}.\n" * 5,
+                          forwards=i % 5 + 2 if i % 50 == 0 else 0)
+
+    def run(label, fetch):
+        gmail.http_requests = gmail.bytes_sent = 0
+        start = time.perf_counter()
+        fetched = fetch()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<26} {len(fetched):>5} emails  {gmail.http_requests:>5} requêtes HTTP  "
+              f"{gmail.bytes_sent / 1024:9.1f} Kio ({gmail.bytes_sent / max(1, len(fetched)):6.0f} o/email)  "
+              f"{elapsed:5.2f}s")
+        return fetched
+
+    print(f"Boîte simulée de {n} messages (réponses enregistrées avec pièce jointe et en-têtes de transport)")
+    legacy = run("Origine (N+1, full)", lambda: legacy_get_emails(gmail, n))
+    stats = FetchStats()
+    batched = run("Batch 100 + fields", lambda: emails.get_emails(gmail, max_results=n, stats=stats))
+    assert [mail["body"] for mail in batched[:len(legacy)]] == [mail["body"] for mail in legacy]
+    assert all(mail["body"] for mail in batched), "corps tronqué par le masque fields"
+    print(f"Compteurs client : {stats}")
+
+# -------------------------------------------------------------
+# BENCHMARK : PROMPTS PAR LOTS
+# -------------------------------------------------------------
+def load_ground_truth_emails(filename="ground_truth.csv"):
+    """Emails de référence (le CSV ne contient que les sujets) et leurs étiquettes."""
+    gt = pd.read_csv(filename)
+    mails = [
+        {"id": row.ids, "subject": row.subjects, "body": ""}
+        for row in gt.itertuples(index=False)
+    ]
+    return mails, gt
+
+
+def score(gt, results):
+    """Exactitude et F1 macro (voir evaluation.py) sur l'urgence et la catégorie."""
+    predictions = [dict(classification, id=mail["id"], subject=mail["subject"]) for mail, classification in results]
+    _, scores = evaluation.evaluate(gt.to_dict("records"), predictions, samples=0)
+    return {name: (field["accuracy"], field["macro_f1"]) for name, field in scores.items()}
+
+
+def bench_batching(batch_sizes=(1, 5, 10, 20), latency=0.05, truncate_rate=0.0, live=False):
+    """Compare requêtes, tokens de prompt et exactitude selon la taille des lots.
+
+    Avec `live=True`, le point d'accès configuré (MISTRAL_API_URL / MISTRAL_API_KEY)
+    est utilisé à la place du faux serveur : c'est ce mode qui valide l'exactitude.
+    Le faux serveur répond à chaque email selon son sujet (réponses enregistrées de
+    ground_truth.csv) : une réponse attribuée au mauvais email d'un lot fait baisser
+    l'exactitude par rapport aux lots de 1.
+    """
+    from fake_llm import load_canned_answers
+
+    server = None if live else use_fake_llm(latency=latency, truncate_rate=truncate_rate,
+                                            answers=load_canned_answers())
+    mails, gt = load_ground_truth_emails()
+    print(f"{len(mails)} emails de ground_truth.csv ({'API réelle' if live else 'faux serveur'})")
+    baseline = None
+    try:
+        for batch_size in batch_sizes:
+            requests_before = server.request_count if server else 0
+            tokens_before = server.prompt_tokens if server else 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = list(emails.classify_emails_concurrently(mails, batch_size=batch_size))
+            elapsed = time.perf_counter() - start
+            scores = score(gt, results)
+            counters = ""
+            if server:
+                counters = (f"{server.request_count - requests_before:>4} requêtes  "
+                            f"{server.prompt_tokens - tokens_before:>7} tokens de prompt  ")
+            print(f"lot={batch_size:<3} {elapsed:6.2f}s  {counters}"
+                  f"urgence acc={scores['urgence'][0]:.3f} F1={scores['urgence'][1]:.3f}  "
+                  f"catégorie acc={scores['categorie'][0]:.3f} F1={scores['categorie'][1]:.3f}")
+            accuracy = (scores["urgence"][0], scores["categorie"][0])
+            baseline = baseline or accuracy
+            if server and not truncate_rate:
+                assert accuracy == baseline, f"lot={batch_size} : réponses attribuées aux mauvais emails"
+    finally:
+        if server:
+            server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : ANALYSE DES RÉPONSES DU MODÈLE
+# -------------------------------------------------------------
+def legacy_classify_email(subject, body):
+    """classify_email avant responses.py : json.loads sur le texte brut, libellés tels quels."""
+    result, error = emails.call_mistral(emails.SINGLE_PROMPT_TEMPLATE.format(subject=subject, body=body))
+    if error is not None:
+        return error
+    try:
+        return json.loads(result)
+    except json.JSONDecodeError:
+        return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": result}
+
+
+def bench_parsing(noise_rate=0.2, latency=0.01, batch_size=10):
+    """Taux d'échec (email envoyé dans la feuille d'erreurs ou urgence hors liste)
+    avec un modèle qui déforme `noise_rate` de ses réponses, avant et après
+    la normalisation des réponses (responses.py)."""
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    import sheet
+    from fake_llm import load_canned_answers, normalize_subject
+    from responses import CATEGORIES, URGENCY_LEVELS
+
+    answers = load_canned_answers()
+    server = use_fake_llm(latency=latency, answers=answers, noise_rate=noise_rate)
+    mails, gt = load_ground_truth_emails()
+    json_mode = emails.MISTRAL_JSON_MODE
+    # Réponses enregistrées hors liste (étiquettes de ground_truth.csv) : échecs irréductibles
+    off_list = sum(answers[normalize_subject(mail["subject"])]["categorie"] not in CATEGORIES for mail in mails)
+
+    def legacy(mails):
+        with ThreadPoolExecutor(max_workers=emails.MAX_IN_FLIGHT) as executor:
+            return list(zip(mails, executor.map(lambda mail: legacy_classify_email(mail["subject"], mail["body"]),
+                                                mails)))
+
+    def current(mode, size):
+        def run(mails):
+            emails.MISTRAL_JSON_MODE = mode
+            return list(emails.classify_emails_concurrently(mails, batch_size=size))
+        return run
+
+    configurations = (
+        ("avant : json.loads", legacy),
+        ("après, sans mode JSON", current(False, 1)),
+        ("après, mode JSON", current(True, 1)),
+        (f"après, lots de {batch_size}", current(True, batch_size)),
+    )
+    print(f"{len(mails)} emails de ground_truth.csv, {noise_rate:.0%} de réponses déformées par le faux modèle")
+    print(f"{'analyse':<24} {'échecs':>8} {'Non classifié':>14} {'hors liste':>11} {'requêtes':>9} "
+          f"{'urgence acc':>12} {'catégorie acc':>14}")
+    try:
+        for label, run in configurations:
+            random.seed(0)
+            requests_before = server.request_count
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = run(mails)
+            unclassified = sum(classification.get("categorie") in emails.ERROR_CATEGORIES
+                               for _, classification in results)
+            failures = sum(
+                sheet.CATEGORY_SHEET_MAP.get(classification.get("categorie"), sheet.FALLBACK_SHEET_NAME)
+                == sheet.FALLBACK_SHEET_NAME or classification.get("urgence") not in URGENCY_LEVELS
+                for _, classification in results
+            )
+            scores = score(gt, results)
+            print(f"{label:<24} {failures / len(results):8.1%} {unclassified:>14} {failures - unclassified:>11} "
+                  f"{server.request_count - requests_before:>9} {scores['urgence'][0]:12.3f} "
+                  f"{scores['categorie'][0]:14.3f}")
+    finally:
+        emails.MISTRAL_JSON_MODE = json_mode
+        server.shutdown()
+    print(f"({off_list} emails ont une réponse enregistrée hors des cinq catégories : échec attendu.)")
+
+# -------------------------------------------------------------
+# BENCHMARK : CASCADE DE MODÈLES
+# -------------------------------------------------------------
+def bench_cascade(small_accuracy=0.8, large_accuracy=0.97, small_latency=0.05, large_latency=0.4,
+                  min_confidence=0.7):
+    """Coût, latence et exactitude sur ground_truth.csv : petit modèle seul, grand
+    modèle seul et cascades (escalade sur confiance, puis aussi sur urgence critique).
+
+    Le faux serveur simule deux modèles : le petit se trompe plus souvent et
+    déclare alors, le plus souvent, une confiance plus faible.
+    """
+    import statistics
+    from collections import Counter
+
+    from fake_llm import load_canned_answers
+    from metrics import metrics
+
+    small = ModelSpec("mistral-small-latest", prompt_cost=0.1, completion_cost=0.3)
+    large = ModelSpec("mistral-large-latest", prompt_cost=2.0, completion_cost=6.0)
+    profiles = {
+        small.name: {"latency": small_latency, "accuracy": small_accuracy},
+        large.name: {"latency": large_latency, "accuracy": large_accuracy},
+    }
+    server = use_fake_llm(answers=load_canned_answers(), model_profiles=profiles)
+    mails, gt = load_ground_truth_emails()
+    configurations = (
+        ("petit modèle seul", ModelCascade([small])),
+        ("grand modèle seul", ModelCascade([large])),
+        ("cascade : confiance", ModelCascade([small, large], min_confidence, ())),
+        ("cascade : + critique", ModelCascade([small, large], min_confidence, ("Critique",))),
+    )
+    print(f"{len(mails)} emails de ground_truth.csv ; faux modèles : {small.name} "
+          f"({small_accuracy:.0%} juste, {small_latency * 1000:.0f} ms), {large.name} "
+          f"({large_accuracy:.0%} juste, {large_latency * 1000:.0f} ms) ; escalade si confiance < {min_confidence:g}")
+    print(f"{'configuration':<22} {'$/1000 emails':>13} {'latence p50':>12} {'p95':>7} {'run':>7} "
+          f"{'escaladés':>10} {'urgence acc':>12} {'catégorie acc':>14}")
+    decided = None
+    try:
+        for label, cascade in configurations:
+            emails.MODEL_CASCADE = cascade
+            server.model_requests.clear()
+            metrics.enable()
+            batch = [dict(mail) for mail in mails]
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                # Résultats dès qu'ils sont prêts, comme process_all_emails : une escalade ne retient pas les autres
+                results = list(emails.classify_emails_concurrently(batch, ordered=False))
+            elapsed = time.perf_counter() - start
+            cost = cascade.cost(metrics.report()["tokens"]) * 1000 / len(mails)
+            latencies = sorted(mail["latency_ms"] for mail in batch)
+            p95 = statistics.quantiles(latencies, n=20, method="inclusive")[18]
+            escalated = server.model_requests.get(large.name, 0) / len(mails) if len(cascade.models) > 1 else 0.0
+            scores = score(gt, results)
+            print(f"{label:<22} {cost:13.4f} {statistics.median(latencies):10.0f}ms {p95:5.0f}ms {elapsed:6.2f}s "
+                  f"{escalated:10.1%} {scores['urgence'][0]:12.3f} {scores['categorie'][0]:14.3f}")
+            decided = (label, results)
+    finally:
+        metrics.enabled = False
+        server.shutdown()
+
+    label, results = decided
+    predictions = [dict(classification, id=mail["id"], subject=mail["subject"]) for mail, classification in results]
+    ground_truth = gt.to_dict("records")
+    pairs = evaluation.join(ground_truth, predictions)
+    print(f"\nModèle décideur ({label}) : {dict(Counter(p['modele'] for p in predictions))}")
+    for model, entry in evaluation.accuracy_by_model(ground_truth, predictions, pairs).items():
+        print(f"  {model:<22} {entry['count']:5d} emails  urgence {entry['urgence']:.3f}  "
+              f"catégorie {entry['categorie']:.3f}")
+
+# -------------------------------------------------------------
+# BENCHMARK : CLIENT HTTP (KEEP-ALIVE, NOUVELLES TENTATIVES, DISJONCTEUR)
+# -------------------------------------------------------------
+def bench_http_client(n=200):
+    """Rejoue le même lot d'emails contre un faux serveur qui injecte latence et pannes."""
+    import http_client
+    import requests
+
+    scenarios = [
+        ("nominal", {}),
+        ("20% de 503", {"error_rate": 0.2}),
+        ("5% bloquées 3s", {"stall_rate": 0.05, "stall_seconds": 3.0}),
+        ("clé API refusée", {"auth_fail": True}),
+        # Débit illimité (TokenBucket(rate=0)) : la pause Retry-After doit tout de même s'appliquer
+        ("5% de 429 (0.5s)", {"throttle_rate": 0.05, "retry_after": 0.5}),
+    ]
+    # Délais courts pour que les scénarios de panne restent rapides
+    previous = http_client.READ_TIMEOUT, http_client.BACKOFF_BASE
+    http_client.READ_TIMEOUT, http_client.BACKOFF_BASE = 0.5, 0.05
+    try:
+        # Sans Session (ancien code) vs avec pool de connexions, en séquentiel
+        server = use_fake_llm(latency=0.0)
+        try:
+            payload = {"model": "fake", "messages": [{"role": "user", "content": "x"}]}
+            start = time.perf_counter()
+            for _ in range(n):
+                requests.post(emails.MISTRAL_URL, json=payload, headers={"Authorization": "Bearer x"})
+            without_pool = time.perf_counter() - start
+            client = http_client.MistralClient(emails.MISTRAL_URL, "x")
+            start = time.perf_counter()
+            for _ in range(n):
+                client.chat(payload)
+            with_pool = time.perf_counter() - start
+            print(f"{n} appels séquentiels : requests.post {without_pool * 1000 / n:.2f} ms/appel, "
+                  f"Session keep-alive {with_pool * 1000 / n:.2f} ms/appel")
+        finally:
+            server.shutdown()
+
+        print(f"{'scénario':<18} {'durée':>7} {'requêtes':>9} {'reprises':>9} {'erreurs finales':>16}")
+        for label, options in scenarios:
+            server = use_fake_llm(latency=0.01, **options)
+            try:
+                batch = make_emails(n)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results = list(emails.classify_emails_concurrently(batch, batch_size=1))
+                elapsed = time.perf_counter() - start
+                failed = sum(1 for _, result in results if result.get("categorie") == "ERREUR API")
+                print(f"{label:<18} {elapsed:6.2f}s {server.request_count:>9} "
+                      f"{emails.mistral_client.retries:>9} {failed:>16}")
+                if server.throttled_count:
+                    # Chaque 429 suspend tous les appels : au plus MAX_IN_FLIGHT 429 par pause
+                    pauses = -(-server.throttled_count // emails.MAX_IN_FLIGHT)
+                    assert elapsed >= pauses * server.retry_after, "Retry-After ignoré après un 429"
+            finally:
+                server.shutdown()
+    finally:
+        http_client.READ_TIMEOUT, http_client.BACKOFF_BASE = previous
+    check_circuit_probe()
+    print("Appels d'essai du disjoncteur : OK")
+
+
+def check_circuit_probe():
+    """L'appel d'essai se conclut toujours : erreur requests non retentée, exception
+    imprévue, ou panne de l'API après une clé refusée."""
+    import http_client
+    import requests
+
+    def failing_post(error):
+        def post(*args, **kwargs):
+            raise error
+        return post
+
+    breaker = http_client.CircuitBreaker(failure_threshold=1, reset_timeout=0, fatal_reset_timeout=0)
+    client = http_client.MistralClient("http://127.0.0.1:9/", "x", max_retries=1, breaker=breaker)
+    # Disjoncteur ouvert, réouverture immédiate : chaque appel est un appel d'essai
+    breaker.record_failure()
+    for error in (requests.exceptions.TooManyRedirects("boucle"), requests.exceptions.TooManyRedirects("boucle"),
+                  RuntimeError("imprévu"), RuntimeError("imprévu")):
+        client.session.post = failing_post(error)
+        try:
+            client.chat({})
+        except type(error):
+            pass
+        assert not breaker.probing, "appel d'essai jamais conclu : disjoncteur ouvert pour toujours"
+
+    # Clé refusée, puis essai en échec sans refus (panne) : ouverture ordinaire et datée
+    breaker.reset_timeout = 3600
+    breaker.record_failure(fatal_reason="clé API refusée (HTTP 401)")
+    client.session.post = failing_post(requests.exceptions.ChunkedEncodingError("réponse tronquée"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            client.chat({})
+        except requests.exceptions.ChunkedEncodingError:
+            pass
+    assert breaker.fatal_reason is None and breaker.opened_at is not None, vars(breaker)
+    try:
+        client.chat({})
+    except http_client.CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("essai relancé sans délai après une panne consécutive à une clé refusée")
+    client.close()
+
+# -------------------------------------------------------------
+# BENCHMARK : INSTRUMENTATION
+# -------------------------------------------------------------
+def bench_metrics(n=300, calls=200000):
+    """Surcoût de l'instrumentation, désactivée puis activée, et rapport d'un run simulé."""
+    from metrics import Metrics, metrics
+
+    for enabled in (False, True):
+        probe = Metrics(enabled=enabled)
+        start = time.perf_counter()
+        for _ in range(calls):
+            with probe.timer("stage"):
+                pass
+            probe.inc("counter")
+        per_call = (time.perf_counter() - start) / calls * 1e9
+        print(f"métriques {'activées' if enabled else 'désactivées'} : {per_call:6.0f} ns par timer + compteur")
+
+    server = use_fake_llm(latency=0.02, error_rate=0.05)
+    gmail = FakeGmailService()
+    for i in range(n):
+        gmail.add_message(f"Email de test {i}", f"Contenu du message numéro {i}.")
+    try:
+        with isolated_run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                emails.process_all_emails(gmail_service=gmail, metrics_format="json", dedup=False)
+            report = metrics.report()
+    finally:
+        server.shutdown()
+        metrics.enabled = False
+
+    print(f"Run simulé de {n} emails ({report['wall_seconds']:.2f}s) :")
+    for stage, summary in sorted(report["stages"].items()):
+        print(f"  {stage:<12} n={summary['count']:<5} p50={summary['p50'] * 1000:7.2f} ms  "
+              f"p95={summary['p95'] * 1000:7.2f} ms  p99={summary['p99'] * 1000:7.2f} ms")
+    print(f"  compteurs : {report['counters']}")
+    print(f"  tokens : {report['tokens']}")
+
+# -------------------------------------------------------------
+# BENCHMARK : EXPORT GOOGLE SHEETS
+# -------------------------------------------------------------
+def make_classified_emails(n):
+    """Génère `n` emails classifiés répartis sur les catégories de sheet.py."""
+    import sheet
+
+    categories = list(sheet.CATEGORY_SHEET_MAP)
+    return [
+        {"id": f"msg{i:06d}", "categorie": categories[i % len(categories)], "subject": f"Email de test {i}",
+         "urgence": "Modérée", "synthese": f"Synthèse du message numéro {i}."}
+        for i in range(n)
+    ]
+
+
+def save_results(records, path=None):
+    """Enregistre `records` comme un run complet du magasin de résultats (lu par sheet.py)."""
+    from results_store import RESULTS_DB_PATH, ResultsStore
+
+    store = ResultsStore(path or RESULTS_DB_PATH)
+    try:
+        store.start_run(full=True)
+        for record in records:
+            store.append(record, model="bench")
+    finally:
+        store.close()
+
+
+def bench_sheets(n=1000, new=10, changed=5, latency=0.05):
+    """Premier export (classeur vide) puis nouvel export après l'arrivée de `new`
+    emails et la reclassification de `changed` emails, pour chaque mode
+    d'écriture. `latency` simule la durée d'un aller-retour vers l'API Sheets."""
+    import sheet
+
+    records = make_classified_emails(n)
+    updated = [dict(record) for record in records] + make_classified_emails(n + new)[n:]
+    categories = list(sheet.CATEGORY_SHEET_MAP)
+    for record in updated[:changed]:
+        # Changement de catégorie : la ligne quitte une feuille pour une autre
+        record["categorie"] = categories[(categories.index(record["categorie"]) + 1) % len(categories)]
+        record["urgence"] = "Critique"
+
+    modes = (
+        ("réécriture complète", {}),
+        ("incrémental", {"incremental": True}),
+        ("batchUpdate unique", {"one_shot": True}),
+    )
+    with isolated_run():
+        for label, options in modes:
+            service = FakeSheetsService(latency=latency)
+            for run, data in (("premier export", records), ("nouvel export", updated)):
+                save_results(data)
+                service.calls.clear()
+                service.http_requests = service.cells_written = 0
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    sheet.write_results_to_sheets(sheets_service=service, **options)
+                elapsed = time.perf_counter() - start
+
+                expected = sheet.group_rows_by_sheet(data)
+                # L'ordre des lignes peut différer (ajouts en fin de feuille), pas leur contenu ;
+                # les cellules vides de fin (colonne Boîte hors multi-boîtes) ne sont pas renvoyées
+                consistent = all(
+                    sorted(sheet._pad(row) for row in service.rows(name)[1:] if row) == sorted(map(sheet._pad, rows))
+                    for name, rows in expected.items()
+                )
+                print(f"{label:<20} {run:<15} {service.http_requests:3d} allers-retours, "
+                      f"{service.cells_written:6d} cellules écrites, {elapsed * 1000:7.1f} ms, "
+                      f"contenu {'identique' if consistent else 'DIFFÉRENT'}  {dict(service.calls)}")
+
+        # Échec en cours d'export : l'état laissé dans le classeur
+        for label, options in modes[::2]:
+            service = FakeSheetsService()
+            save_results(records)
+            with contextlib.redirect_stdout(io.StringIO()):
+                sheet.write_results_to_sheets(sheets_service=service, **options)
+            before = {name: service.rows(name) for name in service.sheets}
+            save_results(updated)
+            # Panne à la 3e écriture : pendant la 2e feuille en mode complet, dans le lot en mode unique
+            service.mutations, service.fail_at = 0, 3
+            with contextlib.redirect_stdout(io.StringIO()):
+                sheet.write_results_to_sheets(sheets_service=service, **options)
+            modified = [name for name in service.sheets if service.rows(name) != before[name]]
+            print(f"{label:<20} échec en cours d'export : {len(modified)} feuille(s) modifiée(s) sur {len(before)}")
+
+        # Valeurs qu'une saisie réinterpréterait (id numérique long, formule, signe en tête) :
+        # une synchronisation incrémentale sans changement n'écrit rien
+        tricky = [dict(record, id=f"1{i:019d}", subject=subject)
+                  for i, (record, subject) in enumerate(zip(make_classified_emails(3),
+                                                            ("=SOMME(A1:A3)", "+33 6 12 34 56 78", "-- relance --")))]
+        save_results(tricky)
+        service = FakeSheetsService()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sheet.write_results_to_sheets(sheets_service=service, incremental=True)
+            service.cells_written = 0
+            sheet.write_results_to_sheets(sheets_service=service, incremental=True)
+        assert service.cells_written == 0, f"{service.cells_written} cellules réécrites sans changement"
+
+        # Catégorie de plus de 1000 lignes (grille par défaut d'une feuille) : feuilles créées
+        # par l'export, puis feuilles existantes à la grille par défaut
+        large = [dict(record, categorie=categories[0]) for record in make_classified_emails(2500)]
+        save_results(large)
+        expected = sheet.group_rows_by_sheet(large)
+        for label, service in (("feuilles créées", FakeSheetsService()),
+                               ("feuilles existantes", FakeSheetsService(sheet.required_sheet_names()))):
+            for options in ({"one_shot": True}, {"incremental": True}):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    sheet.write_results_to_sheets(sheets_service=service, **options)
+                assert all(
+                    name in service.sheets
+                    and sorted(sheet._pad(row) for row in service.rows(name)[1:] if row) == sorted(map(sheet._pad, rows))
+                    for name, rows in expected.items()
+                ), f"{len(large)} lignes dans une catégorie, {label}, {options} : export incomplet"
+        print(f"{len(large)} lignes dans une seule catégorie : exports complets (feuilles créées ou existantes)")
+
+# -------------------------------------------------------------
+# BENCHMARK : MAGASIN DE RÉSULTATS (SQLITE) / FICHIER JSON
+# -------------------------------------------------------------
+def bench_store(base=500, factors=(1, 10, 100)):
+    """Écriture, chargement, requête par catégorie/urgence et export CSV : fichier
+    emails_classified.json (indent=4) face au magasin SQLite, à `factors` fois
+    la taille d'un run (`base` emails)."""
+    import csv
+    import tracemalloc
+
+    import results_store
+    import sheet
+
+    urgencies = ("Critique", "Élevée", "Modérée", "Faible", "Anodine")
+    category = "Problème technique informatique"
+
+    def measure(func, trace_memory):
+        # Durée mesurée sans tracemalloc (qui ralentit chaque allocation), pic mémoire sur un second appel
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if not trace_memory:
+            return result, elapsed, None
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    def legacy_query():
+        with open("emails_classified.json", encoding="utf-8") as f:
+            data = json.load(f)
+        return sum(1 for record in data if record["categorie"] == category and record["urgence"] == "Critique")
+
+    def legacy_csv():
+        # Ancien jsontocsv.py
+        with open("emails_classified.json", encoding="utf-8") as f:
+            data = json.load(f)
+        with open("legacy.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "categorie", "subject", "urgence", "synthese"])
+            for i, item in enumerate(data, start=1):
+                writer.writerow([i, item.get("categorie", ""), item.get("subject", ""),
+                                 item.get("urgence", ""), item.get("synthese", "")])
+        return len(data)
+
+    def store_query():
+        store = results_store.ResultsStore()
+        try:
+            return sum(1 for _ in store.iter_rows(categorie=category, urgence="Critique"))
+        finally:
+            store.close()
+
+    print(f"{'emails':>7}  {'opération':<28} {'JSON (durée, pic)':>22} {'SQLite (durée, pic)':>22}")
+    for factor in factors:
+        n = base * factor
+        records = make_classified_emails(n)
+        for i, record in enumerate(records):
+            record["urgence"] = urgencies[i % len(urgencies)]
+            record["synthese"] = f"Synthèse du message numéro {i}. " * 6
+        with isolated_run():
+            def legacy_load():
+                with open("emails_classified.json", encoding="utf-8") as f:
+                    return json.load(f)
+
+            rows = (
+                ("écriture du run", lambda: emails.save_to_json("emails_classified.json", records),
+                 lambda: save_results(records)),
+                ("requête catégorie+urgence", legacy_query, store_query),
+                ("export CSV", legacy_csv, lambda: results_store.export_csv("emails_classified.csv")),
+                ("lignes Sheets groupées", lambda: sheet.group_rows_by_sheet(legacy_load()),
+                 lambda: sheet.group_rows_by_sheet(sheet.load_classified_emails())),
+            )
+            for label, legacy, stored in rows:
+                # Écriture : un seul appel (un second ajouterait un run au magasin)
+                trace_memory = label != "écriture du run"
+                legacy_result, legacy_elapsed, legacy_peak = measure(legacy, trace_memory)
+                stored_result, elapsed, peak = measure(stored, trace_memory)
+                if label == "requête catégorie+urgence":
+                    assert legacy_result == stored_result, (legacy_result, stored_result)
+                memory = (f"{legacy_peak / 2**20:5.1f} Mio", f"{peak / 2**20:5.1f} Mio") if trace_memory else ("", "")
+                print(f"{n:7d}  {label:<28} {legacy_elapsed * 1000:8.1f} ms {memory[0]:>9}"
+                      f" {elapsed * 1000:8.1f} ms {memory[1]:>9}")
+            sizes = (os.path.getsize("emails_classified.json"), os.path.getsize(results_store.RESULTS_DB_PATH))
+            print(f"{n:7d}  {'taille sur disque':<28} {sizes[0] / 2**20:18.1f} Mio {sizes[1] / 2**20:18.1f} Mio")
+
+# -------------------------------------------------------------
+# BENCHMARK : IDENTIFIANTS OAUTH EN CACHE
+# -------------------------------------------------------------
+def bench_auth():
+    """Démarrage avec jeton enregistré : actualisation silencieuse, droits du fichier,
+    réutilisation des clients build(), et repli sur la connexion si le jeton est révoqué."""
+    import stat
+
+    import auth
+    from google.oauth2.credentials import Credentials
+
+    server, token_uri = start_fake_token_server(revoked={"refresh-revoked"})
+    logins = []
+
+    def fake_login(scopes, config_path):
+        # Remplace la connexion dans le navigateur (plusieurs dizaines de secondes en pratique)
+        logins.append(time.perf_counter())
+        return Credentials("login-access", refresh_token="refresh-ok", token_uri=token_uri,
+                           client_id="client", client_secret="secret", scopes=scopes)
+
+    def write_token(refresh_token):
+        with open(auth.TOKEN_PATH, "w", encoding="utf-8") as f:
+            json.dump({"token": "expired-access", "refresh_token": refresh_token, "token_uri": token_uri,
+                       "client_id": "client", "client_secret": "secret", "scopes": auth.SCOPES,
+                       "expiry": "2000-01-01T00:00:00Z"}, f)
+
+    def timed(label, func):
+        start = time.perf_counter()
+        result = func()
+        print(f"{label:<45} {(time.perf_counter() - start) * 1000:8.2f} ms  "
+              f"actualisations={server.refresh_count}  connexions={len(logins)}")
+        return result
+
+    original_login, original_uri = auth._interactive_login, auth.TOKEN_URI
+    auth._interactive_login, auth.TOKEN_URI = fake_login, token_uri
+    try:
+        with isolated_run():
+            auth.reset()
+            write_token("refresh-ok")
+            timed("1er démarrage, jeton expiré (actualisation)", auth.get_credentials)
+            mode = stat.S_IMODE(os.stat(auth.TOKEN_PATH).st_mode)
+            print(f"  token.json enregistré en mode {oct(mode)}")
+            timed("appel suivant, même processus", auth.get_credentials)
+            gmail = timed("build('gmail', 'v1')", lambda: auth.get_service("gmail", "v1"))
+            again = timed("get_service('gmail', 'v1') suivant", lambda: auth.get_service("gmail", "v1"))
+            print(f"  client réutilisé : {gmail is again}")
+            auth.reset()
+            timed("nouveau processus, jeton encore valide", auth.get_credentials)
+            auth.reset()
+            write_token("refresh-revoked")
+            with contextlib.redirect_stdout(io.StringIO()):
+                timed("jeton révoqué (repli sur la connexion)", auth.get_credentials)
+            print(f"jeton révoqué : {len(logins)} connexion interactive, actualisations={server.refresh_count}")
+    finally:
+        auth._interactive_login, auth.TOKEN_URI = original_login, original_uri
+        auth.reset()
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : REJEU HORS LIGNE D'UN CORPUS LOCAL
+# -------------------------------------------------------------
+def bench_replay(repeat=4, latency=0.02, error_rate=0.0, max_in_flight=16):
+    """Débit (emails/s) de chaque étape sur un corpus construit à partir de
+    ground_truth.csv : lecture (fetch), classification (faux LLM aux réponses
+    enregistrées), écriture (sink), puis pipeline complet."""
+    from fake_llm import load_canned_answers, normalize_subject
+    from replay import build_corpus, iter_corpus
+    from sinks import JsonLinesSink
+
+    answers = load_canned_answers()
+    ground_truth = os.path.abspath("ground_truth.csv")
+    server = use_fake_llm(latency=latency, error_rate=error_rate, answers=answers)
+
+    def rate(label, count, elapsed):
+        print(f"  {label:<34} {count:6d} emails  {elapsed:6.2f}s  {count / elapsed:9.1f} emails/s")
+
+    try:
+        with isolated_run():
+            corpora = ("corpus.mbox", "corpus.jsonl", "corpus_eml")
+            for path in corpora:
+                build_corpus(path, filename=ground_truth, repeat=repeat)
+            print(f"Corpus : {repeat} x ground_truth.csv, faux LLM {latency * 1000:.0f} ms, "
+                  f"{error_rate:.0%} de 503, {max_in_flight} appels simultanés")
+
+            print("fetch (lecture du corpus)")
+            for path in corpora:
+                start = time.perf_counter()
+                mails = list(iter_corpus(path))
+                rate(path, len(mails), time.perf_counter() - start)
+
+            print("classification")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = list(emails.classify_emails_concurrently(mails, max_in_flight=max_in_flight))
+            rate("classify_emails_concurrently", len(results), time.perf_counter() - start)
+            correct = sum(
+                classification.get("urgence") == answers.get(normalize_subject(mail["subject"]), {}).get("urgence")
+                for mail, classification in results
+            )
+            print(f"  réponses conformes aux réponses enregistrées : {correct}/{len(results)}")
+
+            print("sink")
+            start = time.perf_counter()
+            sink = JsonLinesSink("sink_bench.jsonl")
+            for mail, classification in results:
+                sink.write(dict(classification, id=mail["id"], subject=mail["subject"]))
+            sink.close()
+            rate("JsonLinesSink", len(results), time.perf_counter() - start)
+
+            print("pipeline complet (process_all_emails)")
+            for path in corpora:
+                # Cache vidé : chaque run appelle réellement le faux LLM
+                if os.path.exists("classification_cache.sqlite3"):
+                    os.remove("classification_cache.sqlite3")
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    emails.process_all_emails(prefilter=False, source=iter_corpus(path))
+                rate(path, sum(1 for _ in emails.iter_jsonl(emails.RESULTS_JSONL_PATH)),
+                     time.perf_counter() - start)
+    finally:
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : EXTRACTION DU CORPS
+# -------------------------------------------------------------
+def legacy_extract_body(payload):
+    """Chemin d'origine : première partie text/plain décodée en UTF-8, sans HTML."""
+    import base64
+
+    def walk(part):
+        if part["mimeType"] == "text/plain":
+            data = part["body"].get("data")
+            return base64.urlsafe_b64decode(data).decode("utf-8") if data else ""
+        for sub_part in part.get("parts", []):
+            body = walk(sub_part)
+            if body:
+                return body
+        return ""
+    try:
+        return walk(payload)
+    except UnicodeDecodeError:
+        return "[Erreur de décodage du corps de l'email]"
+
+
+def make_extraction_cases():
+    """Messages Gmail représentatifs des cas difficiles pour l'extraction du corps."""
+    import base64
+    from fake_google import make_gmail_message
+
+    def part(mime_type, data, charset="utf-8"):
+        return {
+            "mimeType": mime_type,
+            "filename": "",
+            "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}],
+            "body": {"data": base64.urlsafe_b64encode(data).decode("ascii")}
+        }
+
+    request = "Bonjour,\nLe VPN refuse ma connexion depuis ce matin (erreur 809). Pouvez-vous vérifier ?\n"
+    signature = "\n-- \nJean Dupont\nService comptabilité\nTél. 01 23 45 67 89\n"
+    quoted = "".join(f"> {'> ' * level}Message précédent numéro {level}, ligne {i}.\n"
+                     for level in range(3) for i in range(15))
+    reply = (request + signature + "\nLe lun. 1 déc. 2025 à 09:00, Support <support@example.com> a écrit :\n"
+             + quoted)
+    log = request + "\nJournal :\n" + "".join(
+        f"2025-12-01 09:{i // 60:02d}:{i % 60:02d} ERROR vpn-gw tunnel negotiation failed (code 809) peer=10.0.{i % 255}.1\n"
+        for i in range(400))
+    # Alerte transférée : le corps transféré est le contenu utile, il doit être conservé
+    forward = ("Pour info, voir ci-dessous.\n\n---------- Forwarded message ---------\n"
+               "De : Supervision <alertes@example.com>\nDate: lun. 1 déc. 2025 à 08:55\nObjet: [CRITIQUE] db-prod-01\n\n"
+               "Le serveur db-prod-01 ne répond plus depuis 08:52 (ping, ssh, port 5432).\n")
+    newsletter = ("<html><head><style>p {{ color: red; }}</style><script>track()</script></head><body>"
+                  + "".join(f"<div><p>Article {i} : nouveautés du portail RH &amp; formations.</p></div>" for i in range(40))
+                  + "</body></html>")
+    return {
+        "standard (plain + html + PDF)": make_gmail_message("std", "Sujet", request + signature, 1)["payload"],
+        "HTML seul (newsletter)": part("text/html", newsletter.encode("utf-8")),
+        "texte iso-8859-1": part("text/plain", request.encode("iso-8859-1"), "iso-8859-1"),
+        "réponse + historique cité": part("text/plain", reply.encode("utf-8")),
+        "alerte transférée": part("text/plain", forward.encode("utf-8")),
+        "journal collé (400 lignes)": part("text/plain", log.encode("utf-8")),
+    }
+
+
+def bench_extraction(token_budget=None):
+    """Octets et tokens envoyés au LLM : extraction d'origine contre extraction nettoyée,
+    sur des cas difficiles puis sur le corpus rejoué de ground_truth.csv."""
+    from extraction import BODY_TOKEN_BUDGET, clean_body, extract_body
+    from replay import build_corpus
+
+    budget = BODY_TOKEN_BUDGET if token_budget is None else token_budget
+
+    def measure(payloads):
+        totals = {"legacy_bytes": 0, "legacy_tokens": 0, "bytes": 0, "tokens": 0, "seconds": 0.0}
+        samples = []
+        for payload in payloads:
+            legacy = legacy_extract_body(payload)
+            start = time.perf_counter()
+            body = clean_body(extract_body(payload), budget)
+            totals["seconds"] += time.perf_counter() - start
+            totals["legacy_bytes"] += len(legacy.encode("utf-8"))
+            totals["legacy_tokens"] += emails.estimate_tokens(legacy)
+            totals["bytes"] += len(body.encode("utf-8"))
+            totals["tokens"] += emails.estimate_tokens(body)
+            samples.append((legacy, body))
+        return totals, samples
+
+    def show(label, totals, count=1):
+        saved = totals["legacy_tokens"] - totals["tokens"]
+        print(f"{label:<30} origine {totals['legacy_bytes']:8d} o / {totals['legacy_tokens']:7d} tokens  "
+              f"→ {totals['bytes']:7d} o / {totals['tokens']:6d} tokens  "
+              f"({saved:+d} tokens évités, {totals['seconds'] / count * 1e6:6.0f} µs/email)")
+
+    print(f"Budget du corps : {budget} tokens")
+    for label, payload in make_extraction_cases().items():
+        totals, [(legacy, body)] = measure([payload])
+        show(label, totals)
+        print(f"  origine : {legacy[:60]!r}")
+        print(f"  nettoyé : {body[:60]!r}")
+        if label == "alerte transférée":
+            assert "db-prod-01 ne répond plus" in body, "le corps du message transféré a été retiré"
+
+    with isolated_run():
+        count = build_corpus("corpus.json", filename=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   "ground_truth.csv"))
+        with open("corpus.json", encoding="utf-8") as f:
+            payloads = [msg["payload"] for msg in json.load(f)]
+    totals, _ = measure(payloads)
+    show(f"corpus ground_truth ({count})", totals, count)
+
+# -------------------------------------------------------------
+# BENCHMARK : DÉDUPLICATION DES QUASI-DOUBLONS
+# -------------------------------------------------------------
+ALERT_TEMPLATES = [
+    ("ALERTE : disque plein sur {host} ({pct}%)",
+     "Le volume /var de {host} est rempli à {pct}% ({ts}). Seuil critique : 90%. Incident {hex}."),
+    ("[CRITICAL] Service paiement indisponible - {host}",
+     "La sonde HTTP sur {host}:443 a échoué {n} fois consécutives depuis {ts}. Dernier code : 503. Réf {hex}."),
+    ("Échec de la sauvegarde nocturne sur {host}",
+     "Le job de sauvegarde #{n} s'est terminé en erreur à {ts} (code {pct}). Consultez les journaux, réf {hex}."),
+    ("[JIRA] Ticket SUP-{n} mis à jour",
+     "Le ticket SUP-{n} a été mis à jour par l'automate le {ts}. Statut : En attente du support. Réf {hex}."),
+    ("Certificat TLS expirant bientôt : {host}",
+     "Le certificat de {host} expire dans {pct} jours ({ts}). Merci de planifier son renouvellement. Réf {hex}."),
+]
+
+
+def make_storm_emails(n, storm_share=0.6, seed=0):
+    """Corpus mêlant rafales d'alertes (mêmes gabarits, valeurs variables) et emails
+    distincts ; renvoie (emails, groupe réel de chaque email)."""
+    import random
+
+    rng = random.Random(seed)
+    words = ("imprimante", "badge", "salle", "réunion", "facture", "contrat", "portail", "mot", "passe",
+             "VPN", "licence", "poste", "écran", "formation", "congés", "note", "frais", "accès", "dossier")
+    mails, groups = [], []
+    for i in range(n):
+        if rng.random() < storm_share:
+            template = rng.randrange(len(ALERT_TEMPLATES))
+            values = {"host": f"srv-{rng.choice(['web', 'db', 'app'])}-{rng.randint(1, 99):02d}",
+                      "pct": rng.randint(90, 99), "n": rng.randint(1, 9999),
+                      "ts": f"2025-12-01 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+                      "hex": f"{rng.getrandbits(40):010x}"}
+            subject_template, body_template = ALERT_TEMPLATES[template]
+            subject, body = subject_template.format(**values), body_template.format(**values)
+            # Job de sauvegarde ou ticket numéroté (#{n}, SUP-{n}) : un objet distinct par numéro
+            numbered = "#{n}" in body_template or "-{n}" in subject_template
+            groups.append(f"alerte-{template}-{values['n']}" if numbered else f"alerte-{template}")
+        else:
+            picked = rng.sample(words, 6)
+            subject = f"Question sur {picked[0]} et {picked[1]}"
+            body = f"Bonjour, j'ai un souci avec {' '.join(picked[2:])} depuis hier. Pouvez-vous m'aider ? Demande {i}."
+            groups.append(f"unique-{i}")
+        mails.append({"id": f"m{i}", "subject": subject, "body": body})
+    return mails, groups
+
+
+def bench_dedup(sizes=(5000, 10000, 20000, 40000), n=2000, latency=0.02):
+    """Coût du regroupement selon la taille du run, appels LLM évités et justesse des groupes."""
+    from collections import Counter, defaultdict
+    from dedup import NearDuplicateIndex
+
+    # Même gabarit, numéros de facture différents : deux emails à classifier
+    index = NearDuplicateIndex()
+    invoices = [{"id": f"f{number}", "subject": f"Facture FAC-2025-{number}",
+                 "body": f"Veuillez trouver ci-joint la facture n° 2025-{number} de novembre. Échéance : 30 jours."}
+                for number in ("0042", "0043")]
+    assert len({index.assign(mail) for mail in invoices}) == 2, "factures distinctes regroupées"
+
+    print("Regroupement seul (coût par email constant = temps sous-quadratique)")
+    for size in sizes:
+        mails, groups = make_storm_emails(size)
+        index = NearDuplicateIndex()
+        start = time.perf_counter()
+        cluster_ids = [index.assign(mail) for mail in mails]
+        elapsed = time.perf_counter() - start
+        members = defaultdict(list)
+        for cluster_id, group in zip(cluster_ids, groups):
+            members[cluster_id].append(group)
+        # Email rangé dans un groupe dont le représentant relève d'un autre groupe réel
+        wrong = sum(len(labels) - Counter(labels).most_common(1)[0][1] for labels in members.values())
+        print(f"  {size:6d} emails  {elapsed:6.2f}s  {elapsed / size * 1e6:6.0f} µs/email  "
+              f"{len(index.clusters):6d} groupes  {wrong} email(s) mal regroupé(s)")
+
+    server = use_fake_llm(latency=latency)
+    mails, _ = make_storm_emails(n)
+    print(f"Classification de {n} emails (faux LLM {latency * 1000:.0f} ms)")
+    try:
+        for label, enabled in (("sans déduplication", False), ("avec déduplication", True)):
+            emails.dedup_index = NearDuplicateIndex() if enabled else None
+            before = server.request_count
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = list(emails.classify_emails_concurrently([dict(mail) for mail in mails], max_in_flight=16))
+            elapsed = time.perf_counter() - start
+            calls = server.request_count - before
+            print(f"  {label:<20} {calls:5d} appels LLM  {elapsed:6.2f}s  {len(results)} résultats")
+            if enabled:
+                clusters = Counter(mail["cluster_id"] for mail, _ in results)
+                print(f"  {sum(clusters.values()) - len(clusters)} appels évités, plus grand groupe : "
+                      f"{clusters.most_common(1)[0][1]} emails")
+    finally:
+        emails.dedup_index = None
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : ORDONNANCEMENT PAR PRIORITÉ
+# -------------------------------------------------------------
+def bench_priority(repeat=2, latency=0.05):
+    """Délai avant l'enregistrement du premier email critique (et de tous les
+    critiques) sur un corpus rejoué, dans l'ordre de Gmail puis par priorité."""
+    import random
+    import sqlite3
+    import statistics
+
+    from fake_llm import load_canned_answers, normalize_subject
+    from replay import build_corpus, iter_corpus
+    from results_store import RESULTS_DB_PATH
+
+    answers = load_canned_answers()
+    ground_truth = os.path.abspath("ground_truth.csv")
+    server = use_fake_llm(latency=latency, answers=answers)
+    try:
+        with isolated_run():
+            build_corpus("corpus.jsonl", filename=ground_truth, repeat=repeat)
+            mails = list(iter_corpus("corpus.jsonl"))
+            shuffled = list(mails)
+            random.Random(0).shuffle(shuffled)
+
+            def is_critical(mail):
+                return answers.get(normalize_subject(mail["subject"]), {}).get("urgence") == "Critique"
+
+            orders = (
+                ("ordre du corpus", mails),
+                ("mélangé", shuffled),
+                ("critiques en fin de boîte", sorted(shuffled, key=is_critical)),
+            )
+            print(f"{len(mails)} emails ({sum(map(is_critical, mails))} critiques), faux LLM "
+                  f"{latency * 1000:.0f} ms, {emails.MAX_IN_FLIGHT} appels simultanés")
+            print(f"{'ordre de la boîte':<26} {'mode':<9} {'1er critique':>12} {'médiane':>9} "
+                  f"{'dernier':>9} {'run':>8}")
+            for label, order in orders:
+                for mode, priority in (("Gmail", False), ("priorité", True)):
+                    for path in (RESULTS_DB_PATH, "classification_cache.sqlite3"):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        emails.process_all_emails(prefilter=False, source=[dict(mail) for mail in order],
+                                                  priority=priority)
+                    conn = sqlite3.connect(RESULTS_DB_PATH)
+                    started = conn.execute("SELECT started_at FROM runs").fetchone()[0]
+                    critical = [row[0] - started for row in conn.execute(
+                        "SELECT classified_at FROM results WHERE urgence = 'Critique' ORDER BY seq")]
+                    last = conn.execute("SELECT MAX(classified_at) FROM results").fetchone()[0] - started
+                    conn.close()
+                    # Classification par priorité, mais export dans l'ordre de la boîte (le corpus
+                    # répète quelques ids : un seul résultat par id, à l'une de ses positions)
+                    with open("emails_classified.json", encoding="utf-8") as f:
+                        exported = [record["id"] for record in json.load(f)]
+                    remaining = iter(mail["id"] for mail in order)
+                    assert all(msg_id in remaining for msg_id in exported) \
+                        and len(exported) == len({mail["id"] for mail in order}), \
+                        f"{label}/{mode} : export hors de l'ordre Gmail"
+                    print(f"{label:<26} {mode:<9} {critical[0]:11.2f}s {statistics.median(critical):8.2f}s "
+                          f"{critical[-1]:8.2f}s {last:7.2f}s")
+    finally:
+        server.shutdown()
+
+# -------------------------------------------------------------
+# BENCHMARK : SERVICE DE TRI EN CONTINU
+# -------------------------------------------------------------
+def bench_daemon(n=40, rate=2.0, idle=15.0, latency=0.05, poll_min=1.0, poll_max=8.0, sheets_interval=5.0):
+    """Délai entre l'arrivée d'un email dans la boîte et son enregistrement puis
+    son écriture dans Sheets, par interrogation adaptative et par notifications push.
+
+    `n` emails arrivent à `rate` emails/s en moyenne (arrivées de Poisson),
+    puis la boîte reste inactive `idle` secondes.
+    """
+    import random
+    import sqlite3
+    import statistics
+
+    from daemon import TriageDaemon
+    from fake_google import send_pubsub_push
+    from fake_llm import load_canned_answers
+    from results_store import RESULTS_DB_PATH
+
+    class TimedSheets(FakeSheetsService):
+        # Instant de la première écriture de chaque id Gmail dans le classeur
+        def __init__(self, expected, **options):
+            super().__init__(**options)
+            self.expected = expected
+            self.written_at = {}
+
+        def write_range(self, a1_range, values, user_entered=False):
+            super().write_range(a1_range, values, user_entered)
+            now = time.time()
+            for row_values in values:
+                for value in row_values:
+                    if value in self.expected:
+                        self.written_at.setdefault(value, now)
+
+    def summary(values):
+        values = sorted(values)
+        p95 = statistics.quantiles(values, n=20, method="inclusive")[18]
+        return f"{statistics.median(values):6.2f}s {p95:6.2f}s {values[-1]:6.2f}s"
+
+    mails, _ = load_ground_truth_emails()
+    server = use_fake_llm(latency=latency, answers=load_canned_answers())
+    print(f"{n} emails à {rate:g}/s puis {idle:g}s sans email ; interrogation {poll_min:g}→{poll_max:g}s, "
+          f"Sheets toutes les {sheets_interval:g}s, Gmail et Sheets 20/50 ms par appel, faux LLM "
+          f"{latency * 1000:.0f} ms")
+    print(f"{'mode':<6} {'→ magasin p50/p95/max':>23} {'→ Sheets p50/p95/max':>23} "
+          f"{'history.list':>13} {'au repos':>9} {'écritures Sheets':>17}")
+    health_snapshots = {}
+    try:
+        for mode in ("poll", "push"):
+            with isolated_run(), contextlib.redirect_stdout(io.StringIO()):
+                gmail = FakeGmailService()
+                gmail.latency = 0.02
+                added = {}
+                sheets = TimedSheets(added, latency=0.05)
+                daemon = TriageDaemon(gmail, sheets, push=mode == "push", prefilter=False, poll_min=poll_min,
+                                      poll_max=poll_max, sheets_interval=sheets_interval)
+                url = daemon.start(port=0)
+                rng = random.Random(0)
+                for i in range(n):
+                    time.sleep(rng.expovariate(rate))
+                    mail = rng.choice(mails)
+                    msg_id = gmail.add_message(mail["subject"], mail["body"])
+                    added[msg_id] = time.time()
+                    if mode == "push":
+                        send_pubsub_push(f"{url}/pubsub", gmail.history_id, message_id=i)
+                    if i == n // 2:
+                        with urllib.request.urlopen(f"{url}/healthz") as response:
+                            health_snapshots[mode] = json.load(response)
+                traffic_calls = gmail.calls["history.list"]
+                time.sleep(idle)
+                idle_calls = gmail.calls["history.list"] - traffic_calls
+                daemon.stop()
+
+                conn = sqlite3.connect(RESULTS_DB_PATH)
+                stored = dict(conn.execute("SELECT message_id, MIN(classified_at) FROM results GROUP BY message_id"))
+                conn.close()
+            missing = len(added) - len(stored)
+            to_store = [stored[msg_id] - t for msg_id, t in added.items() if msg_id in stored]
+            to_sheets = [sheets.written_at[msg_id] - t for msg_id, t in added.items() if msg_id in sheets.written_at]
+            print(f"{mode:<6} {summary(to_store):>23} {summary(to_sheets):>23} {traffic_calls:>13} "
+                  f"{idle_calls:>9} {sheets.calls['values.batchUpdate']:>17}"
+                  + (f"  ({missing} emails manquants)" if missing else ""))
+        outage = check_daemon_outage(server, mails, poll_min=poll_min)
+        check_daemon_throttled(mails, poll_min=poll_min)
+        print("\nEmail rejeté (429) par Gmail puis récupéré : historyId retenu jusque-là, OK")
+    finally:
+        server.shutdown()
+    for mode, health in health_snapshots.items():
+        print(f"\nGET /healthz en cours de trafic ({mode}) :")
+        print(json.dumps(health, ensure_ascii=False, indent=2))
+    print("\nGET /healthz pendant un refus de la clé API :")
+    print(json.dumps(outage, ensure_ascii=False, indent=2))
+
+
+def check_daemon_throttled(mails, n=5, poll_min=1.0):
+    """Un email rejeté (429) par messages.get au-delà des nouvelles tentatives n'est pas
+    perdu : le historyId n'est enregistré qu'une fois l'email récupéré et classifié."""
+    import gmail_fetch
+    from daemon import TriageDaemon
+
+    previous = gmail_fetch.MAX_BATCH_RETRIES
+    gmail_fetch.MAX_BATCH_RETRIES = 0
+    try:
+        with isolated_run(), contextlib.redirect_stdout(io.StringIO()):
+            gmail = FakeGmailService()
+            daemon = TriageDaemon(gmail, None, prefilter=False, poll_min=poll_min, poll_max=poll_min)
+            start_history_id = gmail.history_id
+            daemon.start(port=None)
+            added = [gmail.add_message(mail["subject"], mail["body"]) for mail in mails[:n]]
+            gmail.throttled.add(added[0])
+            deadline = time.time() + 10
+            while daemon.classified < n - 1:
+                assert time.time() < deadline, f"{daemon.classified}/{n - 1} emails classifiés"
+                time.sleep(0.1)
+            time.sleep(2 * poll_min)
+            health = daemon.health()
+            assert health["refetch_pending"] == 1, health
+            assert int(health["checkpoint_history_id"]) == start_history_id, \
+                f"historyId enregistré au-delà d'un email jamais récupéré : {health}"
+            # Quota rétabli : l'email est redemandé en tête de la synchronisation suivante
+            gmail.throttled.clear()
+            deadline = time.time() + 10
+            while daemon.classified < n:
+                assert time.time() < deadline, f"{daemon.classified}/{n} emails classifiés après le 429"
+                time.sleep(0.1)
+            daemon.stop()
+            assert int(daemon.state.history_id) == gmail.history_id, daemon.health()
+    finally:
+        gmail_fetch.MAX_BATCH_RETRIES = previous
+
+
+def check_daemon_outage(server, mails, n=5, poll_min=1.0):
+    """Clé refusée (401) puis rétablie : aucun verdict d'erreur n'est enregistré, le
+    historyId ne dépasse pas les emails en attente et /healthz signale la panne."""
+    import sqlite3
+
+    from daemon import TriageDaemon
+    from results_store import RESULTS_DB_PATH
+
+    with isolated_run(), contextlib.redirect_stdout(io.StringIO()):
+        gmail = FakeGmailService()
+        daemon = TriageDaemon(gmail, None, prefilter=False, poll_min=poll_min, poll_max=poll_min)
+        start_history_id = gmail.history_id
+        daemon.start(port=None)
+        server.auth_fail = True
+        try:
+            added = [gmail.add_message(mail["subject"], mail["body"]) for mail in mails[:n]]
+            deadline = time.time() + 10
+            while emails.mistral_client is None or emails.mistral_client.breaker.open_reason() is None:
+                assert time.time() < deadline, "le disjoncteur ne s'est pas ouvert"
+                time.sleep(0.1)
+            time.sleep(2 * poll_min)
+            health = daemon.health()
+            assert health["status"] == "degraded" and health["llm_circuit"], health
+            assert int(health["checkpoint_history_id"]) == start_history_id, \
+                f"historyId enregistré au-delà des emails en erreur : {health}"
+            assert daemon.classified == 0, f"{daemon.classified} verdicts d'erreur enregistrés"
+        finally:
+            server.auth_fail = False
+        # Clé rétablie : l'appel d'essai suivant referme le disjoncteur
+        emails.mistral_client.breaker.fatal_reset_timeout = 0
+        deadline = time.time() + 10
+        while daemon.classified < n:
+            assert time.time() < deadline, f"{daemon.classified}/{n} emails classifiés après la panne"
+            time.sleep(0.1)
+        daemon.stop()
+        assert daemon.health()["status"] == "ok"
+        conn = sqlite3.connect(RESULTS_DB_PATH)
+        categories = dict(conn.execute("SELECT message_id, categorie FROM results"))
+        conn.close()
+    assert sorted(categories) == sorted(added), categories
+    assert not set(categories.values()) & emails.ERROR_CATEGORIES, categories
+    return health
+
+# -------------------------------------------------------------
+# BENCHMARK : ÉVALUATION PAR RAPPORT À LA VÉRITÉ TERRAIN
+# -------------------------------------------------------------
+def make_predictions(n, accuracy=0.7, typo_share=0.1, foreign_share=0.01, seed=0):
+    """`n` prédictions tirées de ground_truth.csv : copies aux ids suffixés (comme
+    replay.py --repeat), sujets parfois altérés ou sans rapport, étiquettes
+    justes avec la probabilité `accuracy`."""
+    import random
+
+    rng = random.Random(seed)
+    gt = evaluation.load_ground_truth()
+    urgencies = sorted({row["urgence"] for row in gt})
+    categories = sorted({row["categories"] for row in gt})
+    predictions = []
+    for i in range(n):
+        row = gt[i % len(gt)]
+        copy_index = i // len(gt)
+        subject = row["subjects"]
+        draw = rng.random()
+        if draw < foreign_share:
+            subject = f"Newsletter n°{i}"
+        elif draw < foreign_share + typo_share:
+            cut = rng.randrange(len(subject))
+            subject = subject[:cut] + subject[cut + 1:]
+        predictions.append({
+            "id": row["ids"] if copy_index == 0 else f"{row['ids']}_r{copy_index}",
+            "categorie": row["categories"] if rng.random() < accuracy else rng.choice(categories),
+            "subject": subject,
+            "urgence": row["urgence"] if rng.random() < accuracy else rng.choice(urgencies),
+            "synthese": ""
+        })
+    return predictions
+
+
+def legacy_comparison(predictions_path, ground_truth_path="ground_truth.csv"):
+    """Traitement de l'ancien comparison.py, sans l'affichage bloquant des figures."""
+    from sklearn.metrics import classification_report, confusion_matrix
+
+    pred = pd.read_json(predictions_path)
+    gt = pd.read_csv(ground_truth_path)
+    pred["subject_norm"] = pred["subject"].str.strip().str.lower()
+    gt["subjects_norm"] = gt["subjects"].str.strip().str.lower()
+    merged = pd.merge(gt, pred, left_on="subjects_norm", right_on="subject_norm", how="inner")
+    for truth, predicted in (("urgence_x", "urgence_y"), ("categories", "categorie")):
+        confusion_matrix(merged[truth], merged[predicted])
+        classification_report(merged[truth], merged[predicted], zero_division=0)
+    return len(merged)
+
+
+def bench_evaluation(sizes=(1000, 10000, 100000), samples=1000):
+    """Durée de l'évaluation (appariement, métriques, bootstrap, graphiques) face à l'ancien script."""
+    for n in sizes:
+        predictions = make_predictions(n)
+        with isolated_run() as tmp_dir:
+            path = os.path.join(tmp_dir, "emails_classified.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(predictions, f, ensure_ascii=False)
+            gt_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ground_truth.csv")
+
+            start = time.perf_counter()
+            legacy_rows = legacy_comparison(path, gt_path)
+            legacy_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                pairs, results = evaluation.evaluate_files(path, gt_path, plots_dir="plots", samples=samples)
+            elapsed = time.perf_counter() - start
+
+        print(f"{n} prédictions")
+        print(f"  comparison.py (pandas + sklearn)    {legacy_elapsed:6.2f}s  "
+              f"{legacy_rows} lignes fusionnées (sujets en double multipliés, autres écartés sans bilan)")
+        print(f"  evaluation.py (+ bootstrap {samples}, PNG) {elapsed:6.2f}s  {len(pairs)} paires : "
+              f"{pairs.methods['id']} par id, {pairs.methods['sujet']} par sujet, "
+              f"{pairs.methods['approché']} approchées, {len(pairs.unmatched)} sans correspondance")
+        for name, scores in results.items():
+            low, high = scores["macro_f1_ci"]
+            print(f"    {name:<10} exactitude {scores['accuracy']:.3f}  "
+                  f"F1 macro {scores['macro_f1']:.3f} [{low:.3f}-{high:.3f}]")
+
+# -------------------------------------------------------------
+# BENCHMARK : BOÎTES MULTIPLES EN PARALLÈLE
+# -------------------------------------------------------------
+def bench_coordinator(workers=(1, 2, 4, 8), repeat=1, latency=0.1, shards=4):
+    """Débit de coordinator.py selon le nombre de processus : deux boîtes (corpus
+    rejoués de ground_truth.csv) de `shards` shards chacune, faux LLM aux
+    réponses enregistrées. Puis isolation : une boîte illisible ne bloque pas
+    les autres."""
+    import multiprocessing.forkserver
+    from collections import Counter
+
+    import coordinator
+    from fake_llm import load_canned_answers
+    from replay import build_corpus
+    from results_store import ResultsStore
+
+    ground_truth = os.path.abspath("ground_truth.csv")
+    server = use_fake_llm(latency=latency, answers=load_canned_answers())
+    # Chaque email part au LLM : le débit mesuré est celui des shards, pas du cache
+    options = {"prefilter": False, "dedup": False}
+
+    def run(mailboxes, n_workers):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            summary = coordinator.run_coordinator(mailboxes, workers=n_workers, rate_limit=0, options=options,
+                                                  llm_url=emails.MISTRAL_URL, llm_key=emails.MISTRAL_KEY)
+        return summary, output.getvalue()
+
+    try:
+        with isolated_run() as tmp_dir:
+            count = build_corpus("support.jsonl", filename=ground_truth, repeat=repeat)
+            # Deuxième boîte : mêmes emails, mêmes ids (les résultats sont distingués par boîte)
+            corpus = os.path.join(tmp_dir, "support.jsonl")
+            unique_ids = len({json.loads(line)["id"] for line in open(corpus, encoding="utf-8")})
+            mailboxes = [
+                {"name": "support", "corpus": corpus, "shards": shards},
+                {"name": "facturation", "corpus": corpus, "shards": shards},
+            ]
+            print(f"2 boîtes x {count} emails, {2 * shards} shards, faux LLM {latency * 1000:.0f} ms, "
+                  f"{emails.MAX_IN_FLIGHT} appels simultanés par shard, {os.cpu_count()} CPU")
+
+            # Serveur de fork démarré (pipeline importé) avant la mesure, comme après le premier run
+            if coordinator._mp_context().get_start_method() == "forkserver":
+                multiprocessing.forkserver.ensure_running()
+            baseline = None
+            for n_workers in workers:
+                # Répertoire neuf : ni cache ni reprise d'un run précédent
+                run_dir = os.path.join(tmp_dir, f"workers-{n_workers}")
+                os.makedirs(run_dir)
+                os.chdir(run_dir)
+                summary, _ = run(mailboxes, n_workers)
+                assert summary["merged"] == 2 * unique_ids, f"{summary['merged']} résultats pour {2 * unique_ids}"
+                throughput = summary["merged"] / summary["seconds"]
+                baseline = baseline or throughput
+                failed = sum(result["status"] != "ok" for result in summary["shards"].values())
+                print(f"  {n_workers:2d} processus : {summary['merged']:5d} résultats fusionnés en "
+                      f"{summary['seconds']:6.2f}s  {throughput:7.1f} emails/s  x{throughput / baseline:4.2f} "
+                      f"(idéal x{n_workers})  shards en échec : {failed}")
+
+            # Une fusion incrémentale ne reprend que les lignes des shards postérieures à la précédente
+            again = coordinator.merge_shards(coordinator.plan_shards(mailboxes, max(workers), True, 0), full=False)
+            assert again == 0, f"{again} résultats refusionnés sans nouvel email"
+            with open("emails_classified.json", encoding="utf-8") as f:
+                by_mailbox = Counter(record.get("mailbox") for record in json.load(f))
+            assert by_mailbox == {"support": unique_ids, "facturation": unique_ids}, by_mailbox
+            print(f"  refusion incrémentale : {again} résultat ; export par boîte : {dict(by_mailbox)}")
+
+            run_dir = os.path.join(tmp_dir, "isolation")
+            os.makedirs(run_dir)
+            os.chdir(run_dir)
+            broken = mailboxes + [{"name": "illisible", "corpus": os.path.join(tmp_dir, "absente.mbox")}]
+            summary, output = run(broken, max(workers))
+            result = summary["shards"]["illisible"]
+            succeeded = sum(result["status"] == "ok" for result in summary["shards"].values())
+            store = ResultsStore()
+            full_runs = store.conn.execute("SELECT COUNT(*) FROM runs WHERE full = 1").fetchone()[0]
+            store.close()
+            print(f"  isolation : shard 'illisible' en {result['status']} après "
+                  f"{1 + coordinator.SHARD_RETRIES} tentatives ({result['error']}), "
+                  f"{succeeded} shards aboutis, {summary['merged']} résultats fusionnés "
+                  f"(run {'complet' if full_runs else 'incrémental'})")
+    finally:
+        server.shutdown()
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks du pipeline de classification.")
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="Classification concurrente")
+    concurrency.add_argument("-n", type=int, default=200)
+    concurrency.add_argument("--latency", type=float, default=0.05)
+    concurrency.add_argument("--throttle-rate", type=float, default=0.0)
+
+    incremental = subparsers.add_parser("incremental", help="Synchronisation Gmail incrémentale")
+    incremental.add_argument("-n", type=int, default=500)
+    incremental.add_argument("--new", type=int, default=10)
+
+    fetch = subparsers.add_parser("fetch", help="Récupération Gmail par batchs HTTP")
+    fetch.add_argument("-n", type=int, default=1200)
+
+    batching = subparsers.add_parser("batching", help="Plusieurs emails par requête Mistral")
+    batching.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 20])
+    batching.add_argument("--truncate-rate", type=float, default=0.0)
+    batching.add_argument("--live", action="store_true", help="Utilise l'API Mistral configurée")
+
+    parsing = subparsers.add_parser("parsing", help="Réponses mal formées du modèle : échecs avant/après")
+    parsing.add_argument("--noise-rate", type=float, default=0.2)
+    parsing.add_argument("--batch-size", type=int, default=10)
+
+    cascade_parser = subparsers.add_parser("cascade", help="Cascade de modèles : coût, latence, exactitude")
+    cascade_parser.add_argument("--small-accuracy", type=float, default=0.8)
+    cascade_parser.add_argument("--min-confidence", type=float, default=0.7)
+
+    http = subparsers.add_parser("http", help="Client HTTP : keep-alive, reprises, disjoncteur")
+    http.add_argument("-n", type=int, default=200)
+
+    metrics_parser = subparsers.add_parser("metrics", help="Surcoût et rapport de l'instrumentation")
+    metrics_parser.add_argument("-n", type=int, default=300)
+
+    sheets_parser = subparsers.add_parser("sheets", help="Export Google Sheets complet ou incrémental")
+    sheets_parser.add_argument("-n", type=int, default=1000)
+    sheets_parser.add_argument("--new", type=int, default=10)
+    sheets_parser.add_argument("--latency", type=float, default=0.05, help="Aller-retour simulé (s)")
+
+    store_parser = subparsers.add_parser("store", help="Magasin de résultats SQLite face au fichier JSON")
+    store_parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100])
+
+    subparsers.add_parser("auth", help="Identifiants OAuth enregistrés et actualisés")
+
+    extraction_parser = subparsers.add_parser("extraction", help="Octets et tokens du corps envoyé au LLM")
+    extraction_parser.add_argument("--budget", type=int, default=None, help="Budget du corps en tokens")
+
+    dedup_parser = subparsers.add_parser("dedup", help="Regroupement des quasi-doublons")
+    dedup_parser.add_argument("-n", type=int, default=2000)
+
+    priority_parser = subparsers.add_parser("priority", help="Délai avant le premier résultat critique")
+    priority_parser.add_argument("--repeat", type=int, default=2)
+    priority_parser.add_argument("--latency", type=float, default=0.05)
+
+    daemon_parser = subparsers.add_parser("daemon", help="Service de tri en continu : interrogation ou push")
+    daemon_parser.add_argument("-n", type=int, default=40)
+    daemon_parser.add_argument("--rate", type=float, default=2.0, help="Emails reçus par seconde")
+    daemon_parser.add_argument("--idle", type=float, default=15.0, help="Durée sans email après le trafic (s)")
+
+    evaluation_parser = subparsers.add_parser("evaluation", help="Évaluation par rapport à la vérité terrain")
+    evaluation_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    evaluation_parser.add_argument("--bootstrap", type=int, default=1000)
+
+    replay_parser = subparsers.add_parser("replay", help="Débit par étape sur un corpus local rejoué")
+    replay_parser.add_argument("--repeat", type=int, default=4)
+    replay_parser.add_argument("--latency", type=float, default=0.02)
+    replay_parser.add_argument("--error-rate", type=float, default=0.0)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Boîtes multiples : débit selon les processus")
+    coordinator_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    coordinator_parser.add_argument("--repeat", type=int, default=1)
+    coordinator_parser.add_argument("--latency", type=float, default=0.1)
+    coordinator_parser.add_argument("--shards", type=int, default=4, help="Shards par boîte")
+
+    args = parser.parse_args()
+    if args.scenario == "concurrency":
+        bench_concurrency(n=args.n, latency=args.latency, throttle_rate=args.throttle_rate)
+    elif args.scenario == "incremental":
+        bench_incremental(n=args.n, new=args.new)
+    elif args.scenario == "fetch":
+        bench_fetch(n=args.n)
+    elif args.scenario == "batching":
+        bench_batching(batch_sizes=args.sizes, truncate_rate=args.truncate_rate, live=args.live)
+    elif args.scenario == "parsing":
+        bench_parsing(noise_rate=args.noise_rate, batch_size=args.batch_size)
+    elif args.scenario == "cascade":
+        bench_cascade(small_accuracy=args.small_accuracy, min_confidence=args.min_confidence)
+    elif args.scenario == "http":
+        bench_http_client(n=args.n)
+    elif args.scenario == "metrics":
+        bench_metrics(n=args.n)
+    elif args.scenario == "sheets":
+        bench_sheets(n=args.n, new=args.new, latency=args.latency)
+    elif args.scenario == "store":
+        bench_store(factors=args.factors)
+    elif args.scenario == "auth":
+        bench_auth()
+    elif args.scenario == "extraction":
+        bench_extraction(token_budget=args.budget)
+    elif args.scenario == "dedup":
+        bench_dedup(n=args.n)
+    elif args.scenario == "priority":
+        bench_priority(repeat=args.repeat, latency=args.latency)
+    elif args.scenario == "daemon":
+        bench_daemon(n=args.n, rate=args.rate, idle=args.idle)
+    elif args.scenario == "evaluation":
+        bench_evaluation(sizes=args.sizes, samples=args.bootstrap)
+    elif args.scenario == "replay":
+        bench_replay(repeat=args.repeat, latency=args.latency, error_rate=args.error_rate)
+    elif args.scenario == "coordinator":
+        bench_coordinator(workers=args.workers, repeat=args.repeat, latency=args.latency, shards=args.shards)
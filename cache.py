@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite3")
+# Nombre maximal d'entrées conservées (les plus anciennement utilisées sont évincées)
+CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "50000"))
+# Âge maximal d'une entrée, en jours
+CACHE_MAX_AGE_DAYS = float(os.getenv("CLASSIFICATION_CACHE_MAX_AGE_DAYS", "30"))
+
+# -------------------------------------------------------------
+# CACHE DE CLASSIFICATION ADRESSÉ PAR CONTENU
+# -------------------------------------------------------------
+def cache_key(model, prompt_version, subject, body):
+    """Empreinte SHA-256 de (modèle, version du prompt, sujet, corps)."""
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, subject, body):
+        data = (part or "").encode("utf-8")
+        # Préfixe de longueur : ("ab", "c") et ("a", "bc") donnent des clés différentes
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ClassificationCache:
+    """Cache SQLite des classifications, partagé entre les threads.
+
+    Seules les classifications réussies y sont stockées : une erreur API
+    doit pouvoir être retentée au prochain passage.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS classifications (
+                   key TEXT PRIMARY KEY,
+                   result TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used_at REAL NOT NULL
+               )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON classifications (last_used_at)"
+        )
+        self.conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """Renvoie la classification en cache, ou None."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result, created_at FROM classifications WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                metrics.inc("cache_misses")
+                return None
+            self.conn.execute(
+                "UPDATE classifications SET last_used_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.hits += 1
+        metrics.inc("cache_hits")
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """Enregistre une classification réussie."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO classifications (key, result, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de la taille maximale."""
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM classifications WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,)
+            )
+            self.conn.execute(
+                """DELETE FROM classifications WHERE key IN (
+                       SELECT key FROM classifications
+                       ORDER BY last_used_at DESC
+                       LIMIT -1 OFFSET ?
+                   )""",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        """Résumé des accès au cache pour la fin de run."""
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f"Cache de classification : {self.hits} hits, {self.misses} miss ({ratio:.0%} de hits)"
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.conn.close()
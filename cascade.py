@@ -0,0 +1,104 @@
+import json
+import os
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Cascade de modèles : du plus économique au plus précis (voir models.json)
+MODEL_CASCADE_PATH = os.getenv("MODEL_CASCADE_CONFIG", "models.json")
+# Seuils par défaut, si models.json ne les précise pas
+DEFAULT_MIN_CONFIDENCE = 0.7
+DEFAULT_ESCALATE_URGENCES = ("Critique",)
+
+# -------------------------------------------------------------
+# CASCADE DE MODÈLES
+# -------------------------------------------------------------
+class ModelSpec:
+    """Modèle de la cascade et son prix, en dollars par million de tokens."""
+
+    def __init__(self, name, prompt_cost=0.0, completion_cost=0.0):
+        self.name = name
+        self.prompt_cost = prompt_cost
+        self.completion_cost = completion_cost
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return (prompt_tokens * self.prompt_cost + completion_tokens * self.completion_cost) / 1_000_000
+
+
+class ModelCascade:
+    """Modèles appelés l'un après l'autre : chaque email est classé par le premier ;
+    le suivant n'est sollicité que si le verdict est peu sûr, en échec ou urgent.
+
+    Règles d'escalade :
+    - `min_confidence` : confiance déclarée par le modèle (0 à 1) en dessous de
+      laquelle le verdict est confirmé par le modèle suivant ; une confiance
+      absente compte comme insuffisante ;
+    - `escalate_urgences` : urgences toujours confirmées (une erreur y coûte cher).
+    """
+
+    def __init__(self, models, min_confidence=DEFAULT_MIN_CONFIDENCE, escalate_urgences=DEFAULT_ESCALATE_URGENCES):
+        if not models:
+            raise ValueError("La cascade doit contenir au moins un modèle.")
+        self.models = list(models)
+        self.min_confidence = min_confidence
+        self.escalate_urgences = set(escalate_urgences)
+
+    @classmethod
+    def single(cls, name):
+        """Un seul modèle : aucune escalade (comportement sans models.json)."""
+        return cls([ModelSpec(name)])
+
+    @classmethod
+    def from_config(cls, config):
+        models = [
+            ModelSpec(model["name"], model.get("prompt_cost", 0.0), model.get("completion_cost", 0.0))
+            for model in config["models"]
+        ]
+        escalation = config.get("escalation", {})
+        return cls(models, escalation.get("min_confidence", DEFAULT_MIN_CONFIDENCE),
+                   escalation.get("urgences", DEFAULT_ESCALATE_URGENCES))
+
+    @classmethod
+    def load(cls, path=MODEL_CASCADE_PATH, default_model=None):
+        """Cascade décrite dans `path` ; à défaut (fichier absent ou invalide), le seul
+        modèle `default_model`. Ne lève pas d'exception : la cascade est chargée à
+        l'import de emails.py, dont dépendent tous les points d'entrée."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            return cls.from_config(config)
+        except FileNotFoundError:
+            return cls.single(default_model)
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"Erreur: '{path}' n'est pas une configuration de cascade valide "
+                  f"({type(e).__name__}: {e}). Modèle unique : {default_model}.")
+            return cls.single(default_model)
+
+    @property
+    def names(self):
+        return [model.name for model in self.models]
+
+    def escalation_reason(self, classification, error_categories=()):
+        """Motif d'escalade du verdict ("échec", "urgence", "confiance"), ou None s'il est retenu."""
+        if classification.get("categorie") in error_categories:
+            return "échec"
+        if classification.get("urgence") in self.escalate_urgences:
+            return "urgence"
+        confidence = classification.get("confiance")
+        if confidence is None or confidence < self.min_confidence:
+            return "confiance"
+        return None
+
+    def cost(self, tokens):
+        """Coût en dollars des tokens consommés (compteurs `prompt_tokens:<modèle>` de metrics)."""
+        return sum(
+            model.cost(tokens.get(f"prompt_tokens:{model.name}", 0), tokens.get(f"completion_tokens:{model.name}", 0))
+            for model in self.models
+        )
+
+    def __str__(self):
+        if len(self.models) == 1:
+            return f"Modèle unique : {self.models[0].name}"
+        return (f"Cascade : {' → '.join(self.names)} (escalade si confiance < {self.min_confidence:g}"
+                f"{', urgence ' + '/'.join(sorted(self.escalate_urgences)) if self.escalate_urgences else ''}"
+                f" ou échec)")
@@ -0,0 +1,357 @@
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import auth
+import emails
+import prefilter
+import sheet
+from rate_limit import TokenBucket
+from replay import iter_corpus
+from results_store import RESULTS_DB_PATH, ResultsStore, export_json
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Boîtes à traiter (voir mailboxes.example.json)
+MAILBOXES_PATH = os.getenv("MAILBOXES_CONFIG", "mailboxes.json")
+# Processus de travail : chaque shard attend surtout Gmail et Mistral, pas le processeur
+COORDINATOR_WORKERS = int(os.getenv("COORDINATOR_WORKERS", "4"))
+# Un répertoire par shard : résultats, reprise, cache et journal isolés
+SHARDS_DIR = os.getenv("SHARDS_DIR", "shards")
+SHARD_LOG = "shard.log"
+# Nouvelles tentatives d'un shard en échec (reprise là où il s'était arrêté)
+SHARD_RETRIES = 1
+# Intervalle d'affichage de la progression
+PROGRESS_SECONDS = float(os.getenv("COORDINATOR_PROGRESS", "5"))
+
+# File de progression du processus de travail (voir _init_worker)
+_progress = None
+
+# -------------------------------------------------------------
+# DÉCOUPAGE EN SHARDS
+# -------------------------------------------------------------
+def load_mailboxes(path=MAILBOXES_PATH):
+    """Boîtes décrites dans `path` ({"mailboxes": [...]})."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["mailboxes"]
+
+
+def _epoch(day):
+    """Date "AAAA-MM-JJ" (UTC) en secondes depuis l'epoch, format des recherches Gmail."""
+    return int(datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def date_ranges(after, before, count):
+    """Découpe [after, before[ (secondes) en `count` plages de même durée."""
+    step = (before - after) / count
+    bounds = [after + round(step * index) for index in range(count)] + [before]
+    return list(zip(bounds, bounds[1:]))
+
+
+def date_query(start, end, query=None):
+    """Recherche Gmail des messages de [start, end[ ; une seconde de recouvrement au
+    plus entre deux plages, sans effet après fusion (un résultat par email)."""
+    parts = [query] if query else []
+    parts += [f"after:{start - 1}", f"before:{end}"]
+    return " ".join(parts)
+
+
+def plan_shards(mailboxes, workers=COORDINATOR_WORKERS, incremental=False, rate_limit=None):
+    """Shards à traiter, dans l'ordre des boîtes.
+
+    Une boîte Gmail dont `after` est renseigné est découpée en `shards` plages
+    de dates ; un corpus local (`corpus`, voir replay.py) en `shards` parts,
+    un email sur `shards`. En mode incrémental, l'historique Gmail est suivi
+    par boîte : un seul shard par boîte.
+
+    Débit Mistral de chaque shard : `rate_limit` de la boîte réparti entre ses
+    shards, sinon `rate_limit` (MISTRAL_RATE_LIMIT par défaut, clé partagée)
+    réparti entre les shards traités simultanément.
+    """
+    shards = []
+    for mailbox in mailboxes:
+        name = mailbox["name"]
+        count = max(1, int(mailbox.get("shards", 1)))
+        base = {
+            "mailbox": name,
+            "max_results": mailbox.get("max_results", emails.GMAIL_MAX_EMAILS),
+            "incremental": incremental
+        }
+        if "corpus" in mailbox:
+            base["corpus"] = os.path.abspath(mailbox["corpus"])
+            parts = [{"part": index, "parts": count} for index in range(count)]
+        else:
+            base["token"] = os.path.abspath(mailbox.get("token", auth.TOKEN_PATH))
+            if incremental or "after" not in mailbox:
+                if count > 1:
+                    print(f"{name} : un seul shard ({'mode incrémental' if incremental else 'pas de date after'}).")
+                parts = [{"query": mailbox.get("query")}]
+            else:
+                before = _epoch(mailbox["before"]) if "before" in mailbox else int(time.time()) + 86400
+                parts = [{"query": date_query(start, end, mailbox.get("query"))}
+                         for start, end in date_ranges(_epoch(mailbox["after"]), before, count)]
+        for index, part in enumerate(parts, 1):
+            shard_id = name if len(parts) == 1 else f"{name}#{index}"
+            shard = dict(base, id=shard_id, dir=os.path.abspath(os.path.join(SHARDS_DIR, f"{name}-{index}")), **part)
+            if "rate_limit" in mailbox:
+                shard["rate_limit"] = mailbox["rate_limit"] / len(parts)
+            shards.append(shard)
+
+    default_rate = emails.RATE_LIMIT_PER_SECOND if rate_limit is None else rate_limit
+    for shard in shards:
+        shard.setdefault("rate_limit", default_rate / max(1, min(workers, len(shards))))
+    return shards
+
+# -------------------------------------------------------------
+# PROCESSUS DE TRAVAIL
+# -------------------------------------------------------------
+def _init_worker(progress, ground_truth_path, llm_url=None, llm_key=None):
+    """Initialise un processus de travail (chemins absolus : chaque shard change de répertoire)."""
+    global _progress
+    _progress = progress
+    prefilter.GROUND_TRUTH_PATH = ground_truth_path
+    if llm_url:
+        emails.MISTRAL_URL = llm_url
+        emails.MISTRAL_KEY = llm_key
+
+
+def run_shard(shard, resume=False, options=None):
+    """Traite un shard dans son répertoire ; sa sortie va dans son journal.
+
+    Ne lève pas d'exception : renvoie le bilan du shard (statut "ok" ou
+    "échec" et message d'erreur, emails enregistrés, durée).
+    """
+    started = time.perf_counter()
+    count = 0
+
+    def on_result(record):
+        nonlocal count
+        count += 1
+        _progress.put((shard["id"], count))
+
+    previous_dir = os.getcwd()
+    os.makedirs(shard["dir"], exist_ok=True)
+    try:
+        with open(os.path.join(shard["dir"], SHARD_LOG), "a", encoding="utf-8") as log, \
+                contextlib.redirect_stdout(log):
+            print(f"=== Shard {shard['id']} ({'reprise' if resume else 'nouveau run'})")
+            emails.rate_limiter = TokenBucket(shard["rate_limit"])
+            gmail_service = source = None
+            if "corpus" in shard:
+                source = itertools.islice(iter_corpus(shard["corpus"]), shard["part"], None, shard["parts"])
+            else:
+                # Identifiants de la boîte du shard, pas ceux du shard précédent de ce processus
+                auth.reset()
+                gmail_service = auth.get_service("gmail", "v1", token_path=shard["token"])
+            os.chdir(shard["dir"])
+            emails.process_all_emails(incremental=shard["incremental"], resume=resume, gmail_service=gmail_service,
+                                      source=source, gmail_query=shard.get("query"),
+                                      max_results=shard["max_results"], on_result=on_result, **(options or {}))
+    except Exception as e:
+        status, error = "échec", f"{type(e).__name__}: {e}"
+    else:
+        status, error = "ok", None
+    finally:
+        os.chdir(previous_dir)
+    return {"id": shard["id"], "status": status, "error": error, "emails": count,
+            "seconds": time.perf_counter() - started}
+
+# -------------------------------------------------------------
+# COORDINATION
+# -------------------------------------------------------------
+class Progress:
+    """Emails enregistrés par shard, lus dans la file des processus de travail
+    et affichés toutes les PROGRESS_SECONDS."""
+
+    def __init__(self, progress_queue, interval=PROGRESS_SECONDS):
+        self.queue = progress_queue
+        self.interval = interval
+        self.counts = {}
+        self.started = time.perf_counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        next_report = time.monotonic() + self.interval
+        while not self.stopping.is_set():
+            try:
+                shard_id, count = self.queue.get(timeout=0.2)
+                self.counts[shard_id] = max(count, self.counts.get(shard_id, 0))
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_report:
+                print(self)
+                next_report = time.monotonic() + self.interval
+
+    def __str__(self):
+        details = ", ".join(f"{shard_id} {count}" for shard_id, count in self.counts.items())
+        return (f"[{time.perf_counter() - self.started:6.1f} s] {sum(self.counts.values())} emails enregistrés"
+                f"{' (' + details + ')' if details else ''}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping.set()
+        self.thread.join()
+
+
+def _mp_context():
+    """Processus créés par un serveur de fork qui a déjà importé le pipeline
+    (pandas, scikit-learn : plusieurs secondes par processus), sinon "spawn"."""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    # Le serveur ne reçoit pas sys.path : sans PYTHONPATH, le préchargement échoue en silence
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = [path for path in os.environ.get("PYTHONPATH", "").split(os.pathsep) if path]
+    if package_dir not in paths:
+        os.environ["PYTHONPATH"] = os.pathsep.join([package_dir] + paths)
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["coordinator"])
+    return context
+
+
+def run_shards(shards, workers=COORDINATOR_WORKERS, resume=False, options=None, llm_url=None, llm_key=None,
+               retries=SHARD_RETRIES):
+    """Traite les shards dans un pool de processus ; renvoie leurs bilans par id.
+
+    Un shard en échec (exception, processus interrompu) n'arrête pas les
+    autres ; il est relancé `retries` fois, en reprise de son run.
+    """
+    context = _mp_context()
+    progress_queue = context.Queue()
+    initargs = (progress_queue, os.path.abspath(prefilter.GROUND_TRUTH_PATH), llm_url, llm_key)
+    results = {}
+    pending = list(shards)
+    with Progress(progress_queue):
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Nouvelle tentative pour {len(pending)} shard(s) en échec...")
+            with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending))), mp_context=context,
+                                     initializer=_init_worker, initargs=initargs) as pool:
+                futures = {pool.submit(run_shard, shard, resume or attempt > 0, options): shard for shard in pending}
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        result = {"id": shard["id"], "status": "échec", "error": f"processus interrompu ({e})",
+                                  "emails": 0, "seconds": 0.0}
+                    if shard["id"] in results:
+                        # Emails enregistrés par les tentatives précédentes (le run du shard est repris)
+                        result["emails"] += results[shard["id"]]["emails"]
+                    results[shard["id"]] = result
+                    if result["status"] == "ok":
+                        print(f"✔️ {shard['id']} : {result['emails']} emails en {result['seconds']:.1f} s")
+                    else:
+                        print(f"❌ {shard['id']} : {result['error']} "
+                              f"(journal : {os.path.join(shard['dir'], SHARD_LOG)})")
+            pending = [shard for shard in pending if results[shard["id"]]["status"] != "ok"]
+            if not pending:
+                break
+    return results
+
+
+def merge_shards(shards, full=True, path=RESULTS_DB_PATH):
+    """Fusionne les résultats des shards dans le magasin `path`, en un seul run ; renvoie leur nombre.
+
+    Chaque résultat garde la boîte de son shard. Un run complet reprend tous
+    les résultats courants des shards ; sinon, seules les lignes enregistrées
+    depuis la fusion précédente de chaque shard sont ajoutées (un shard en
+    échec n'apporte ainsi que ses emails de ce run).
+    """
+    store = ResultsStore(path)
+    try:
+        store.start_run(full=full)
+        merged = 0
+        for shard in shards:
+            shard_path = os.path.join(shard["dir"], RESULTS_DB_PATH)
+            if os.path.exists(shard_path):
+                merged += store.merge_from(shard_path, mailbox=shard["mailbox"], source=shard["dir"],
+                                           since_last=not full)
+    finally:
+        store.close()
+    return merged
+
+
+def run_coordinator(mailboxes, workers=COORDINATOR_WORKERS, incremental=False, resume=False, sheets=False,
+                    rate_limit=None, options=None, llm_url=None, llm_key=None):
+    """Traite toutes les boîtes en parallèle puis publie un seul jeu de résultats.
+
+    Les résultats des shards sont fusionnés dans le magasin de résultats,
+    exportés dans emails_classified.json et, avec `sheets`, écrits une fois
+    dans Google Sheets. Le run fusionné n'est complet (il remplace les
+    résultats précédents) que si tous les shards ont abouti. Renvoie le
+    bilan par shard, le nombre de résultats fusionnés et la durée.
+    """
+    started = time.perf_counter()
+    shards = plan_shards(mailboxes, workers, incremental, rate_limit)
+    results = {}
+    runnable = []
+    for shard in shards:
+        if "token" in shard and not os.path.exists(shard["token"]):
+            # La connexion dans le navigateur est impossible depuis un processus de travail
+            results[shard["id"]] = {"id": shard["id"], "status": "échec", "emails": 0, "seconds": 0.0,
+                                    "error": f"jeton '{shard['token']}' introuvable (lancer une fois emails.py "
+                                             f"avec GOOGLE_TOKEN_PATH={shard['token']})"}
+            print(f"❌ {shard['id']} : {results[shard['id']]['error']}")
+        else:
+            runnable.append(shard)
+
+    print(f"{len(shards)} shards, {len(mailboxes)} boîtes, {min(workers, max(1, len(runnable)))} processus.")
+    results.update(run_shards(runnable, workers, resume, options, llm_url, llm_key))
+
+    failed = [shard_id for shard_id, result in results.items() if result["status"] != "ok"]
+    merged = merge_shards(shards, full=not incremental and not failed)
+    if failed:
+        print(f"⚠️ Shards en échec : {', '.join(failed)}. Leurs résultats partiels sont fusionnés "
+              f"sans remplacer les résultats précédents.")
+    print(f"{merged} résultats fusionnés dans '{RESULTS_DB_PATH}'.")
+    if merged:
+        export_json("emails_classified.json")
+        print("Résultats courants exportés dans 'emails_classified.json'.")
+        if sheets:
+            sheet.write_results_to_sheets(incremental=True)
+    return {"shards": results, "merged": merged, "seconds": time.perf_counter() - started}
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classification de plusieurs boîtes Gmail en parallèle.")
+    parser.add_argument("--config", default=MAILBOXES_PATH, help="Boîtes à traiter (voir mailboxes.example.json).")
+    parser.add_argument("--workers", type=int, default=COORDINATOR_WORKERS, help="Processus de travail.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ne récupère que les messages arrivés depuis le dernier passage, boîte par boîte.")
+    parser.add_argument("--resume", action="store_true", help="Reprend les shards d'un run interrompu.")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Requêtes Mistral par seconde, tous shards confondus (0 = illimité).")
+    parser.add_argument("--sheets", action="store_true", help="Écrit les résultats fusionnés dans Google Sheets.")
+    parser.add_argument("--batch-size", type=int, default=emails.BATCH_SIZE)
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--no-priority", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        mailboxes = load_mailboxes(args.config)
+    except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+        print(f"Erreur: impossible de lire les boîtes de '{args.config}' ({e}).")
+        raise SystemExit(1)
+    summary = run_coordinator(mailboxes, workers=args.workers, incremental=args.incremental, resume=args.resume,
+                              sheets=args.sheets, rate_limit=args.rate_limit,
+                              options={"batch_size": args.batch_size, "prefilter": not args.no_prefilter,
+                                       "dedup": not args.no_dedup, "priority": not args.no_priority})
+    if any(result["status"] != "ok" for result in summary["shards"].values()):
+        raise SystemExit(1)
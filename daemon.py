@@ -0,0 +1,519 @@
+import argparse
+import base64
+import binascii
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import emails
+import sheet
+from cache import ClassificationCache
+from dedup import NearDuplicateIndex
+from gmail_fetch import (
+    SYNC_STATE_PATH,
+    HistoryExpiredError,
+    SyncState,
+    current_history_id,
+    get_messages_batched,
+    list_added_message_ids,
+)
+from metrics import metrics
+from prefilter import PreClassifier
+from priority import iter_by_priority
+from results_store import RESULTS_DB_PATH, ResultsStore, iter_results
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Intervalle d'interrogation de history.list : minimal après une arrivée, doublé à
+# chaque interrogation sans nouveau message jusqu'au maximum
+POLL_MIN_SECONDS = float(os.getenv("DAEMON_POLL_MIN", "2"))
+POLL_MAX_SECONDS = float(os.getenv("DAEMON_POLL_MAX", "60"))
+POLL_BACKOFF = 2
+# En mode push, l'interrogation ne sert plus qu'à rattraper une notification perdue
+PUSH_FALLBACK_SECONDS = float(os.getenv("DAEMON_PUSH_FALLBACK", "300"))
+# Emails classifiés ensemble au plus (le reste attend dans la file)
+DAEMON_MAX_BATCH = int(os.getenv("DAEMON_MAX_BATCH", "32"))
+# Un email en erreur de classification repasse dans la file (le historyId ne le dépasse
+# pas) ; au-delà de ce nombre d'essais, API joignable, le verdict d'erreur est enregistré
+DAEMON_MAX_ATTEMPTS = int(os.getenv("DAEMON_MAX_ATTEMPTS", "3"))
+# Écriture Google Sheets par micro-lots : au plus une synchronisation par intervalle,
+# avancée à SHEETS_URGENT_SECONDS après un résultat urgent
+SHEETS_FLUSH_SECONDS = float(os.getenv("DAEMON_SHEETS_FLUSH", "15"))
+SHEETS_URGENT_SECONDS = float(os.getenv("DAEMON_SHEETS_URGENT", "2"))
+# Point d'accès HTTP : GET /healthz et POST /pubsub (notifications push Gmail)
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", "8080"))
+# Au-delà de ce retard (email détecté mais pas encore enregistré), /healthz répond 503
+DAEMON_MAX_LAG = float(os.getenv("DAEMON_MAX_LAG", "120"))
+# Jeton attendu dans l'URL de l'abonnement push (?token=...), si défini
+PUBSUB_VERIFICATION_TOKEN = os.getenv("PUBSUB_VERIFICATION_TOKEN")
+# users.watch expire au bout de 7 jours : renouvellement quotidien
+WATCH_RENEW_SECONDS = 24 * 3600
+
+# -------------------------------------------------------------
+# NOTIFICATIONS PUSH (FORMAT PUB/SUB)
+# -------------------------------------------------------------
+def parse_pubsub_push(payload):
+    """historyId d'une notification Gmail reçue par un abonnement Pub/Sub push.
+
+    Le corps est {"message": {"data": base64(JSON {"emailAddress", "historyId"}), ...},
+    "subscription": ...}. Lève ValueError si le message n'a pas ce format.
+    """
+    try:
+        data = json.loads(base64.b64decode(payload["message"]["data"]))
+        return str(data["historyId"])
+    except (KeyError, TypeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f"Notification Pub/Sub invalide : {e}") from e
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """GET /healthz : état du service en JSON ; POST /pubsub : notification push Gmail."""
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/healthz":
+            self._reply(404, {"error": "not found"})
+            return
+        health = self.server.daemon.health()
+        self._reply(200 if health["status"] == "ok" else 503, health)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/pubsub":
+            self._reply(404, {"error": "not found"})
+            return
+        if PUBSUB_VERIFICATION_TOKEN and parse_qs(url.query).get("token") != [PUBSUB_VERIFICATION_TOKEN]:
+            self._reply(403, {"error": "invalid token"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            history_id = parse_pubsub_push(json.loads(self.rfile.read(length)))
+        except (ValueError, json.JSONDecodeError) as e:
+            # 400 : Pub/Sub ne renverra pas indéfiniment un message mal formé
+            self._reply(400, {"error": str(e)})
+            return
+        self.server.daemon.notify(history_id)
+        # Tout code 2xx acquitte le message auprès de Pub/Sub
+        self._reply(204)
+
+    def _reply(self, status, payload=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def llm_circuit():
+    """Motif d'ouverture du disjoncteur du client Mistral partagé, ou None s'il est fermé."""
+    client = emails.mistral_client
+    return client.breaker.open_reason() if client is not None else None
+
+# -------------------------------------------------------------
+# SERVICE DE TRI EN CONTINU
+# -------------------------------------------------------------
+class TriageDaemon:
+    """Classifie les nouveaux emails en continu.
+
+    Trois threads :
+    - synchronisation : interroge history.list (intervalle adaptatif, ou
+      réveil immédiat par une notification push) et place les nouveaux
+      emails dans une file ;
+    - classification : vide la file par lots, les plus urgents d'abord
+      (priority.py), et enregistre chaque résultat dans le magasin de
+      résultats dès qu'il est prêt ;
+    - Google Sheets : synchronise les feuilles par micro-lots.
+
+    Le historyId n'est enregistré (gmail_sync_state.json) que lorsque tous
+    les emails détectés sont classifiés : après un arrêt, rien n'est perdu.
+    """
+
+    def __init__(self, gmail_service, sheets_service=None, push=False, spreadsheet_id=sheet.SPREADSHEET_ID,
+                 state_path=SYNC_STATE_PATH, store_path=RESULTS_DB_PATH, prefilter=True, batch_size=None,
+                 poll_min=POLL_MIN_SECONDS, poll_max=POLL_MAX_SECONDS, sheets_interval=SHEETS_FLUSH_SECONDS,
+                 watch_topic=None):
+        self.gmail = gmail_service
+        self.sheets = sheets_service
+        self.push = push
+        self.spreadsheet_id = spreadsheet_id
+        self.store_path = store_path
+        self.prefilter = prefilter
+        self.batch_size = batch_size
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.sheets_interval = sheets_interval
+        self.watch_topic = watch_topic
+
+        self.state = SyncState.load(state_path)
+        self.history_id = None  # dernier historyId lu ; self.state.history_id : dernier classifié
+        # Ids lus dans l'historique mais pas encore récupérés (429, 5xx persistants) : redemandés
+        # en tête de la synchronisation suivante, le historyId n'est pas enregistré d'ici là
+        self.refetch_ids = []
+        self.queue = queue.Queue()  # (détecté à, email)
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.server = None
+        self.store = None
+        self.watched_at = None
+
+        self.poll_interval = poll_min
+        self.batch_detected_at = None  # détection du plus ancien email en cours de classification
+        self.in_flight = 0
+        self.classified = 0
+        self.notifications = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_sync_at = None
+        self.sync_failing = False
+        self.last_lag = None
+        self.unflushed = []  # détection des résultats pas encore écrits dans Sheets
+        self.urgent_pending = False
+        self.last_flush_at = None
+        self.flushes = 0
+
+    # ---- Cycle de vie ----
+    def start(self, port=DAEMON_PORT, host="127.0.0.1"):
+        """Démarre les threads (et le point d'accès HTTP si `port` n'est pas None) ;
+        renvoie l'URL du point d'accès."""
+        if self.state.history_id is None:
+            self.state.history_id = current_history_id(self.gmail)
+            self.state.save()
+            print(f"Première synchronisation : surveillance à partir du historyId {self.state.history_id}.")
+        self.history_id = self.state.history_id
+
+        self.store = ResultsStore(self.store_path)
+        self.store.start_run(full=False)
+        emails.classification_cache = ClassificationCache()
+        if self.prefilter:
+            try:
+                emails.pre_classifier = PreClassifier.from_ground_truth()
+            except FileNotFoundError:
+                print("Pré-classifieur désactivé : 'ground_truth.csv' est introuvable.")
+        if self.sheets is not None:
+            sheet.ensure_sheets_exist(self.sheets, self.spreadsheet_id, sheet.required_sheet_names())
+        if self.watch_topic:
+            self._watch()
+
+        # Rattrapage immédiat des emails arrivés depuis le dernier historyId enregistré
+        self.wake.set()
+        loops = [self._sync_loop, self._classify_loop]
+        if self.sheets is not None:
+            loops.append(self._sheets_loop)
+        for loop in loops:
+            thread = threading.Thread(target=loop, name=loop.__name__.strip("_"), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        url = None
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+            self.server.daemon = self
+            threading.Thread(target=self.server.serve_forever, name="http", daemon=True).start()
+            url = f"http://{host}:{self.server.server_address[1]}"
+        mode = "notifications push" if self.push else "interrogation de history.list"
+        print(f"Service de tri démarré ({mode})." + (f" Point d'accès : {url}" if url else ""))
+        return url
+
+    def stop(self, timeout=30):
+        """Arrête les threads après le lot en cours, écrit les derniers résultats
+        dans Sheets et enregistre le historyId."""
+        self.stopping.set()
+        self.wake.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.sheets is not None and self.unflushed:
+            self._flush_sheets()
+        self._checkpoint()
+        self.store.close()
+        print(emails.classification_cache.stats())
+        emails.classification_cache.close()
+        emails.classification_cache = None
+        emails.pre_classifier = None
+        print(f"Service de tri arrêté : {self.classified} emails classifiés.")
+
+    def notify(self, history_id=None):
+        """Notification push : réveille la synchronisation, sauf si `history_id` est déjà lu."""
+        with self.lock:
+            self.notifications += 1
+        metrics.inc("push_notifications")
+        if history_id is not None and self.history_id is not None and int(history_id) <= int(self.history_id):
+            return
+        self.wake.set()
+
+    # ---- Synchronisation Gmail ----
+    def _sync_loop(self):
+        while not self.stopping.is_set():
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+            if self.stopping.is_set():
+                break
+            if self.watch_topic and time.time() - self.watched_at >= WATCH_RENEW_SECONDS:
+                self._watch()
+            found = self.sync_once()
+            if self.refetch_ids:
+                self.poll_interval = self.poll_min
+            elif self.push:
+                self.poll_interval = PUSH_FALLBACK_SECONDS
+            elif found:
+                self.poll_interval = self.poll_min
+            else:
+                self.poll_interval = min(self.poll_interval * POLL_BACKOFF, self.poll_max)
+
+    def sync_once(self):
+        """Lit l'historique Gmail et place les nouveaux emails dans la file ; renvoie leur nombre."""
+        try:
+            with metrics.timer("history_list"):
+                msg_ids, history_id = list_added_message_ids(self.gmail, self.history_id)
+            detected_at = time.time()
+            # Les plus anciens d'abord : à priorité égale, l'ordre d'arrivée est conservé
+            retried = set(self.refetch_ids)
+            fetch_ids = self.refetch_ids + [msg_id for msg_id in msg_ids[::-1] if msg_id not in retried]
+            unfetched = []
+            for msg_data in get_messages_batched(self.gmail, fetch_ids, unfetched=unfetched):
+                self.queue.put((detected_at, emails.parse_message(msg_data)))
+        except HistoryExpiredError:
+            # Les emails de l'intervalle manquant relèvent d'un run complet
+            print("Historique Gmail expiré : surveillance reprise à partir du historyId actuel "
+                  "(lancer emails.py pour classifier les emails manqués).")
+            self.history_id = current_history_id(self.gmail)
+            return 0
+        except Exception as e:
+            self._record_error("synchronisation Gmail", e)
+            self.sync_failing = True
+            return 0
+        # Avant le historyId : _checkpoint ne doit pas voir le nouveau sans les ids manquants
+        self.refetch_ids = unfetched
+        self.history_id = history_id
+        self.last_sync_at = time.time()
+        self.sync_failing = False
+        metrics.inc("emails_detected", len(msg_ids))
+        return len(msg_ids)
+
+    def _watch(self):
+        # Abonne la boîte au sujet Pub/Sub (notifications push)
+        self.gmail.users().watch(userId="me", body={"topicName": self.watch_topic, "labelIds": ["INBOX"]}).execute()
+        self.watched_at = time.time()
+
+    # ---- Classification ----
+    def _classify_loop(self):
+        while not self.stopping.is_set():
+            try:
+                items = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                self._checkpoint()
+                continue
+            while len(items) < DAEMON_MAX_BATCH:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.classify(items)
+
+    def classify(self, items):
+        """Classifie un lot de (détecté à, email) et enregistre chaque résultat dès qu'il est prêt."""
+        detected = {id(mail): detected_at for detected_at, mail in items}
+        done = set()
+        retry = []
+        with self.lock:
+            self.in_flight = len(items)
+            self.batch_detected_at = min(detected.values())
+        # Les quasi-doublons d'une rafale (alertes répétées) ne sont classifiés qu'une fois
+        emails.dedup_index = NearDuplicateIndex()
+        try:
+            mails = iter_by_priority([mail for _, mail in items], window=len(items))
+            for mail, classification in emails.classify_emails_concurrently(mails, batch_size=self.batch_size,
+                                                                            ordered=False):
+                record = emails.make_record(mail, classification)
+                if record["categorie"] in emails.ERROR_CATEGORIES and self._retry_later(mail):
+                    done.add(id(mail))
+                    retry.append((detected[id(mail)], mail))
+                    with self.lock:
+                        self.in_flight -= 1
+                    continue
+                self.store.append(record, model=record.get("modele"), latency_ms=mail.get("latency_ms"))
+                done.add(id(mail))
+                lag = time.time() - detected[id(mail)]
+                metrics.observe("detection_to_store", lag)
+                urgent = record["urgence"] in emails.URGENT_LEVELS
+                with self.lock:
+                    self.in_flight -= 1
+                    self.classified += 1
+                    self.last_lag = lag
+                    self.unflushed.append(detected[id(mail)])
+                    self.urgent_pending = self.urgent_pending or urgent
+                if urgent:
+                    print(f"⚠️ Email {record['urgence'].lower()} enregistré : {record['subject']}")
+        except Exception as e:
+            self._record_error("classification", e)
+            # Les emails non enregistrés repassent dans la file : le historyId ne les dépasse pas
+            for item in items:
+                if id(item[1]) not in done:
+                    self.queue.put(item)
+            self.stopping.wait(self.poll_min)
+        else:
+            if retry:
+                print(f"⚠️ {len(retry)} email(s) en erreur de classification, nouvel essai dans {self.poll_min:g}s")
+                for item in retry:
+                    self.queue.put(item)
+                self.stopping.wait(self.poll_min)
+        finally:
+            emails.dedup_index = None
+            with self.lock:
+                self.in_flight = 0
+                self.batch_detected_at = None
+
+    def _retry_later(self, mail):
+        """Vrai si un email au verdict d'erreur doit repasser dans la file plutôt qu'être enregistré.
+
+        Disjoncteur ouvert (panne, clé refusée) : toujours, sans compter d'essai.
+        """
+        if llm_circuit() is not None:
+            return True
+        mail["attempts"] = mail.get("attempts", 0) + 1
+        return mail["attempts"] < DAEMON_MAX_ATTEMPTS
+
+    def _checkpoint(self):
+        # Appelé par le thread de classification, file vide et aucun lot en cours :
+        # tous les emails jusqu'à self.history_id sont enregistrés, sauf ceux à récupérer
+        history_id = self.history_id
+        if history_id != self.state.history_id and self.queue.empty() and not self.refetch_ids:
+            self.state.history_id = history_id
+            self.state.save()
+
+    # ---- Google Sheets ----
+    def _sheets_loop(self):
+        while not self.stopping.wait(0.2):
+            with self.lock:
+                if not self.unflushed:
+                    continue
+                now = time.time()
+                due = self.last_flush_at is None or now - self.last_flush_at >= self.sheets_interval
+                urgent_due = self.urgent_pending and now - self.unflushed[0] >= SHEETS_URGENT_SECONDS
+            if due or urgent_due:
+                self._flush_sheets()
+
+    def _flush_sheets(self):
+        with self.lock:
+            flushed, self.unflushed = self.unflushed, []
+            urgent, self.urgent_pending = self.urgent_pending, False
+        try:
+            with metrics.timer("sheets_sync"):
+                stats = sheet.sync_sheets(self.sheets, self.spreadsheet_id,
+                                          sheet.group_rows_by_sheet(iter_results(self.store_path)))
+        except Exception as e:
+            self._record_error("écriture Google Sheets", e)
+            with self.lock:
+                # Réessayé au prochain intervalle
+                self.unflushed = flushed + self.unflushed
+                self.urgent_pending = self.urgent_pending or urgent
+                self.last_flush_at = time.time()
+            return
+        now = time.time()
+        for detected_at in flushed:
+            metrics.observe("detection_to_sheets", now - detected_at)
+        with self.lock:
+            self.last_flush_at = now
+            self.flushes += 1
+        metrics.inc("sheets_cells", stats["cells"])
+
+    # ---- Supervision ----
+    def _record_error(self, stage, error):
+        print(f"Erreur ({stage}) : {error}")
+        metrics.inc("daemon_errors", stage=stage)
+        with self.lock:
+            self.errors += 1
+            self.last_error = f"{stage} : {error}"
+
+    def health(self):
+        """État du service (réponse de GET /healthz).
+
+        `lag_seconds` : ancienneté du plus ancien email détecté mais pas encore
+        enregistré ; `status` vaut "degraded" au-delà de DAEMON_MAX_LAG, si la
+        dernière synchronisation Gmail a échoué ou si le disjoncteur de l'API
+        Mistral est ouvert (`llm_circuit` en donne le motif).
+        """
+        now = time.time()
+        circuit = llm_circuit()
+        with self.queue.mutex:
+            oldest = self.queue.queue[0][0] if self.queue.queue else None
+            queue_depth = len(self.queue.queue)
+        with self.lock:
+            if self.batch_detected_at is not None:
+                oldest = self.batch_detected_at
+            lag = now - oldest if oldest is not None else 0.0
+            sheets_pending = now - self.unflushed[0] if self.unflushed else 0.0
+            degraded = lag > DAEMON_MAX_LAG or self.sync_failing or circuit is not None
+            return {
+                "status": "degraded" if degraded else "ok",
+                "mode": "push" if self.push else "poll",
+                "queue_depth": queue_depth,
+                "in_flight": self.in_flight,
+                "lag_seconds": round(lag, 3),
+                "last_result_lag_seconds": round(self.last_lag, 3) if self.last_lag is not None else None,
+                "sheets_pending": len(self.unflushed),
+                "sheets_pending_seconds": round(sheets_pending, 3),
+                "classified": self.classified,
+                "notifications": self.notifications,
+                "sheets_flushes": self.flushes,
+                "poll_interval_seconds": self.poll_interval,
+                "last_sync_age_seconds": round(now - self.last_sync_at, 3) if self.last_sync_at else None,
+                "history_id": self.history_id,
+                "checkpoint_history_id": self.state.history_id,
+                "refetch_pending": len(self.refetch_ids),
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "llm_circuit": circuit,
+            }
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service de tri en continu des nouveaux emails Gmail.")
+    parser.add_argument("--push", action="store_true",
+                        help="Réveil par notifications Pub/Sub push (POST /pubsub) ; interrogation de secours.")
+    parser.add_argument("--watch-topic",
+                        help="Sujet Pub/Sub (projects/…/topics/…) à abonner via users.watch au démarrage.")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="Port de /healthz et /pubsub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--poll-min", type=float, default=POLL_MIN_SECONDS)
+    parser.add_argument("--poll-max", type=float, default=POLL_MAX_SECONDS)
+    parser.add_argument("--sheets-interval", type=float, default=SHEETS_FLUSH_SECONDS)
+    parser.add_argument("--no-sheets", action="store_true", help="N'écrit pas dans Google Sheets.")
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=emails.BATCH_SIZE)
+    args = parser.parse_args()
+
+    print("Authentification Google...")
+    try:
+        gmail_service = emails.google_auth()
+        sheets_service = None if args.no_sheets else sheet.sheets_auth()
+    except Exception as e:
+        print(f"Échec de l'authentification Google: {e}")
+        raise SystemExit(1)
+
+    daemon = TriageDaemon(gmail_service, sheets_service, push=args.push or bool(args.watch_topic),
+                          prefilter=not args.no_prefilter, batch_size=args.batch_size, poll_min=args.poll_min,
+                          poll_max=args.poll_max, sheets_interval=args.sheets_interval,
+                          watch_topic=args.watch_topic)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stopping.set())
+    daemon.start(port=args.port, host=args.host)
+    try:
+        while not daemon.stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    daemon.stop()
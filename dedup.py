@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Distance de Hamming maximale (sur 64 bits) entre deux empreintes d'un même groupe.
+# Au-delà de 2, des emails distincts écrits sur un même gabarit commencent à être fusionnés.
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "2"))
+# Caractères du corps pris en compte dans l'empreinte
+DEDUP_BODY_CHARS = 2000
+FINGERPRINT_BITS = 64
+
+REPLY_PREFIX = re.compile(r"^\s*((re|tr|fw|fwd|réf)\s*:\s*)+", re.IGNORECASE)
+# Parties variables d'une alerte : identifiants hexadécimaux, nombres, horodatages
+HEX_TOKEN = re.compile(r"\b(?=[0-9a-f]*\d)[0-9a-f]{8,}\b")
+NUMBER = re.compile(r"\d+")
+WORD = re.compile(r"\w+")
+# Numéros qui désignent un objet (#123, n° 42, facture 2024-0042, SUP-4521...) : souvent la
+# seule différence entre deux emails écrits sur un même gabarit, ils doivent être identiques
+# au sein d'un groupe
+IDENTIFIER = re.compile(
+    r"(?:#\s?|\b[A-Z]{2,}-|(?i:\bn[°o]\.?\s?|\b(?:numero|ticket|facture|commande|dossier|devis)\s?:?\s?))"
+    r"(\d+(?:[-/]\d+)*)\b"
+)
+
+_BIT_WEIGHTS = 1 << np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+# -------------------------------------------------------------
+# EMPREINTE SIMHASH
+# -------------------------------------------------------------
+def normalize(subject, body):
+    """Texte comparé : sujet sans préfixe de réponse, corps tronqué, en minuscules,
+    sans accents, nombres et identifiants hexadécimaux remplacés par un jeton."""
+    text = f"{REPLY_PREFIX.sub('', subject or '')}\n{(body or '')[:DEDUP_BODY_CHARS]}".lower()
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    text = HEX_TOKEN.sub(" hex ", text)
+    return NUMBER.sub("0", text)
+
+
+def identifiers(subject, body):
+    """Numéros de ticket, de facture, de commande... cités par l'email (voir IDENTIFIER)."""
+    text = f"{subject or ''}\n{(body or '')[:DEDUP_BODY_CHARS]}"
+    text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return frozenset(re.sub(r"\D", "", number) for number in IDENTIFIER.findall(text))
+
+
+def simhash(text):
+    """Empreinte SimHash 64 bits des mots et paires de mots du texte."""
+    words = WORD.findall(text)
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not features:
+        return 0
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(feature.encode(), digest_size=8).digest() for feature in features),
+        dtype="<u8"
+    )
+    # Bit i de chaque hash : +1 s'il vaut 1, -1 sinon ; l'empreinte garde le signe de la somme
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(features)
+    return int(_BIT_WEIGHTS[votes > 0].sum())
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+# -------------------------------------------------------------
+# REGROUPEMENT DES QUASI-DOUBLONS
+# -------------------------------------------------------------
+class _Cluster:
+    __slots__ = ("cluster_id", "representative", "fingerprint", "size", "future")
+
+    def __init__(self, cluster_id, representative, fingerprint):
+        self.cluster_id = cluster_id
+        # L'email lui-même, pas son id : les ids Gmail d'un corpus rejoué peuvent se répéter
+        self.representative = representative
+        self.fingerprint = fingerprint
+        self.size = 1
+        # Verdict du représentant, attendu par les autres membres
+        self.future = Future()
+
+
+class NearDuplicateIndex:
+    """Regroupe au fil de l'eau les emails quasi identiques d'un run.
+
+    Le premier email d'un groupe en est le représentant : lui seul est
+    classifié, les membres suivants attendent son verdict. L'empreinte
+    64 bits est découpée en `max_distance + 1` bandes : deux empreintes à
+    distance ≤ max_distance ont au moins une bande identique (principe des
+    tiroirs), donc seuls les représentants partageant une bande sont
+    comparés — le coût par email ne dépend pas de la taille du run.
+    Deux emails aux numéros de ticket ou de facture différents ne sont
+    jamais regroupés, même si leurs empreintes sont proches.
+    """
+
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        # (décalage, masque) de chaque bande ; la dernière absorbe les bits restants
+        self.bands = [
+            (i * width, (1 << (width if i < bands - 1 else FINGERPRINT_BITS - i * width)) - 1)
+            for i in range(bands)
+        ]
+        self.buckets = [{} for _ in self.bands]
+        self.clusters = {}
+        self.assigned = 0
+        self.lock = threading.Lock()
+
+    def assign(self, mail):
+        """Rattache l'email à un groupe existant ou en crée un ; renvoie l'id du groupe
+        (celui de son représentant, suffixé en cas d'id déjà utilisé)."""
+        with metrics.timer("dedup"):
+            fingerprint = simhash(normalize(mail.get("subject", ""), mail.get("body", "")))
+            numbers = identifiers(mail.get("subject", ""), mail.get("body", ""))
+        # Les numéros font partie de la clé : seuls les groupes aux mêmes numéros sont comparés
+        keys = [((fingerprint >> shift) & mask, numbers) for shift, mask in self.bands]
+        with self.lock:
+            best = None
+            for bucket, key in zip(self.buckets, keys):
+                for cluster in bucket.get(key, ()):
+                    distance = hamming(fingerprint, cluster.fingerprint)
+                    if distance <= self.max_distance and (best is None or distance < best[0]):
+                        best = (distance, cluster)
+            if best is not None:
+                cluster = best[1]
+                cluster.size += 1
+            else:
+                cluster_id = mail["id"]
+                if cluster_id in self.clusters:
+                    cluster_id = f"{cluster_id}#{len(self.clusters)}"
+                cluster = _Cluster(cluster_id, mail, fingerprint)
+                self.clusters[cluster_id] = cluster
+                for bucket, key in zip(self.buckets, keys):
+                    bucket.setdefault(key, []).append(cluster)
+            self.assigned += 1
+        return cluster.cluster_id
+
+    def tag(self, emails):
+        """Générateur : ajoute `cluster_id` à chaque email, dans l'ordre d'arrivée."""
+        for mail in emails:
+            mail["cluster_id"] = self.assign(mail)
+            yield mail
+
+    def is_representative(self, mail):
+        """Vrai pour le représentant de son groupe, et pour un email non regroupé."""
+        cluster = self.clusters.get(mail.get("cluster_id"))
+        return cluster is None or cluster.representative is mail
+
+    def resolve(self, mail, classification=None, error=None):
+        """Publie le verdict (ou l'échec) d'un représentant pour les membres de son groupe."""
+        cluster = self.clusters.get(mail.get("cluster_id"))
+        if cluster is None or cluster.representative is not mail or cluster.future.done():
+            return
+        if error is not None:
+            cluster.future.set_exception(error)
+        else:
+            cluster.future.set_result(classification)
+
+    def verdict(self, mail):
+        """Verdict du représentant du groupe de l'email (bloque jusqu'à sa classification)."""
+        return dict(self.clusters[mail["cluster_id"]].future.result())
+
+    def stats(self):
+        total = self.assigned
+        duplicates = total - len(self.clusters)
+        ratio = duplicates / total if total else 0.0
+        return (f"Déduplication : {total} emails en {len(self.clusters)} groupes, "
+                f"{duplicates} classifications reprises du représentant ({ratio:.0%})")
@@ -1,139 +1,218 @@
+import argparse
 import json
-import base64
 import requests
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import os
+import time
+
+import auth
+from cache import ClassificationCache, cache_key
+from cascade import ModelCascade
+from dedup import NearDuplicateIndex
+from extraction import clean_body, extract_body
+from gmail_fetch import (
+    FetchStats,
+    HistoryExpiredError,
+    SyncState,
+    current_history_id,
+    get_message,
+    get_messages_batched,
+    iter_message_id_pages,
+    list_added_message_ids,
+    list_message_ids,
+)
+from prefilter import PREFILTER_HEADERS, PreClassifier
+from priority import iter_by_priority
+from http_client import CircuitOpenError, MistralClient
+from metrics import metrics
+from rate_limit import TokenBucket
+from responses import (
+    CATEGORIES,
+    PROBLEMS,
+    URGENCY_LEVELS,
+    extract_json,
+    parse_classification,
+    validate_classification,
+)
+from results_store import ResultsStore, export_json
+from sinks import RESULTS_JSONL_PATH, JsonLinesSink, iter_jsonl, write_json_array
 
 # -------------------------------------------------------------
 # CONFIGURATION
 # -------------------------------------------------------------
-SCOPES = [
-    "https://www.googleapis.com/auth/gmail.readonly"
-]
-
 # The key should be set in your environment as MISTRAL_API_KEY
 MISTRAL_KEY = os.getenv("MISTRAL_API_KEY") 
+MISTRAL_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+MISTRAL_MODEL = "mistral-tiny"  # or "mistral-small", depending on your plan
+# Modèles appelés et règles d'escalade (models.json) ; MISTRAL_MODEL seul si le fichier est
+# absent ou invalide. Le models.json fourni commence par mistral-small-latest : c'est lui,
+# et non MISTRAL_MODEL, qui classe les emails par défaut
+MODEL_CASCADE = ModelCascade.load(default_model=MISTRAL_MODEL)
+# À incrémenter à chaque modification du prompt : invalide le cache de classification
+PROMPT_VERSION = "2"
+BATCH_PROMPT_VERSION = "batch-2"
+# Mode JSON de l'API (response_format json_object) pour les requêtes unitaires ;
+# les lots attendent un tableau, que ce mode ne garantit pas
+MISTRAL_JSON_MODE = os.getenv("MISTRAL_JSON_MODE", "1") != "0"
+# Relance ciblée d'une réponse inexploitable : extrait du corps et de la réponse repris
+REPAIR_BODY_CHARS = 1000
+REPAIR_ANSWER_CHARS = 1000
+
+# Nombre maximal d'appels Mistral simultanés
+MAX_IN_FLIGHT = int(os.getenv("MISTRAL_MAX_IN_FLIGHT", "8"))
+# Débit maximal (requêtes/seconde) partagé par tous les threads
+RATE_LIMIT_PER_SECOND = float(os.getenv("MISTRAL_RATE_LIMIT", "5"))
+
+# Catégories renvoyées quand la classification a échoué
+ERROR_CATEGORIES = {"ERREUR API", "ERREUR DÉCODAGE", "Non classifié"}
+# Urgences signalées dès leur enregistrement
+URGENT_LEVELS = {"Critique", "Élevée"}
+
+# Nombre d'emails regroupés dans une même requête Mistral (1 = un email par requête)
+BATCH_SIZE = int(os.getenv("MISTRAL_BATCH_SIZE", "1"))
+# Budget de tokens (estimé) du prompt d'un lot
+BATCH_TOKEN_BUDGET = int(os.getenv("MISTRAL_BATCH_TOKEN_BUDGET", "6000"))
+
+# Nombre d'emails récupérés par passage (au-delà de 500, la liste est paginée)
+GMAIL_MAX_EMAILS = int(os.getenv("GMAIL_MAX_EMAILS", "500"))
+
+rate_limiter = TokenBucket(RATE_LIMIT_PER_SECOND)
+# Client HTTP Mistral partagé (pool de connexions), créé au premier appel
+mistral_client = None
+# Cache des classifications, ouvert par process_all_emails (None = désactivé)
+classification_cache = None
+# Pré-classifieur local (newsletters, réponses automatiques), None = désactivé
+pre_classifier = None
+# Regroupement des quasi-doublons du run (alertes en rafale, fils de réponses), None = désactivé
+dedup_index = None
 
 # -------------------------------------------------------------
 # AUTHENTIFICATION GOOGLE
 # -------------------------------------------------------------
 def google_auth():
     """Authentifie Gmail via OAuth (mode Test).
-    Doit lire le fichier config.json
+    La connexion dans le navigateur n'a lieu qu'au premier lancement : le jeton
+    est ensuite lu depuis token.json et actualisé silencieusement (voir auth.py).
     """
-    # Correction: Use the conventional config.json name 
-    # and load its content for from_client_config
-    try:
-        with open("config.json") as f:
-            config = json.load(f)
-    except FileNotFoundError:
-        print("Erreur: Le fichier 'config.json' est introuvable.")
-        print("Veuillez le télécharger depuis Google Cloud Console.")
-        raise
-
-    flow = InstalledAppFlow.from_client_config(config, SCOPES)
-    creds = flow.run_local_server(port=0)
-    gmail_service = build("gmail", "v1", credentials=creds)
-    return gmail_service
-
-# -------------------------------------------------------------
-# FONCTION RÉCURSIVE POUR LE CORPS DE L'EMAIL
-# -------------------------------------------------------------
-def get_email_body_recursive(part):
-    """Parcourt récursivement les parties de l'email pour trouver le texte brut."""
-    
-    # 1. Cas simple: C'est le corps de l'email en text/plain
-    if part["mimeType"] == "text/plain":
-        data = part["body"].get("data")
-        if data:
-            return base64.urlsafe_b64decode(data).decode("utf-8")
-        return ""
-
-    # 2. Cas des parties imbriquées (multipart)
-    if "parts" in part:
-        for sub_part in part["parts"]:
-            body = get_email_body_recursive(sub_part)
-            # On retourne la première partie text/plain trouvée
-            if body:
-                return body
-    
-    return ""
+    return auth.get_service("gmail", "v1")
 
 # -------------------------------------------------------------
 # RÉCUPÉRER LES EMAILS
 # -------------------------------------------------------------
-def get_emails(service, max_results=20):
-    """Récupère les emails Gmail (sujet + texte brut)."""
-    # maxResults cannot exceed 500. We cap it here to 500.
-    max_results = min(max_results, 500) 
+def parse_message(msg_data):
+    """Extrait l'id, le sujet, le texte brut, les libellés et les en-têtes
+    utiles au pré-classifieur d'un message Gmail complet."""
+    with metrics.timer("mime_decode"):
+        return _parse_message(msg_data)
+
+
+def _parse_message(msg_data):
+    payload = msg_data["payload"]
     
-    results = service.users().messages().list(
-        userId="me",
-        maxResults=max_results
-    ).execute()
-    messages = results.get("messages", [])
-    emails = []
+    # ---- SUJET ET EN-TÊTES ----
+    subject = ""
+    headers = {}
+    for header in payload["headers"]:
+        if header["name"] == "Subject":
+            subject = header["value"]
+        elif header["name"] in PREFILTER_HEADERS:
+            headers[header["name"]] = header["value"]
     
-    for msg in messages:
-        # Request full message data
-        msg_data = service.users().messages().get(
-            userId="me",
-            id=msg["id"],
-            format="full"
-        ).execute()
-        
-        payload = msg_data["payload"]
-        
-        # ---- SUJET ----
-        subject = ""
-        for header in payload["headers"]:
-            if header["name"] == "Subject":
-                subject = header["value"]
-                break # Subject found, no need to check other headers
-        
-        # ---- CORPS ----
-        # Correction: Use the recursive function to handle complex message structures
-        if "parts" in payload:
-            # Multi-part message
-            body = get_email_body_recursive(payload)
+    # ---- CORPS ----
+    # text/plain (ou HTML converti) selon le charset déclaré, sans historique cité ni signature
+    body = clean_body(extract_body(payload))
+
+    return {
+        "id": msg_data["id"],
+        "subject": subject,
+        "body": body,
+        "labels": msg_data.get("labelIds", []),
+        "headers": headers
+    }
+
+
+def iter_emails(service, max_results=500, known_ids=(), stats=None, query=None):
+    """Générateur : récupère et décode les emails page par page.
+
+    Chaque page d'ids est téléchargée par batchs HTTP puis produite email
+    par email ; les ids présents dans `known_ids` sont ignorés. `query` :
+    filtre de recherche Gmail (plage de dates d'un shard, voir coordinator.py).
+    Chaque email porte son rang dans le listing (`position`), ids ignorés compris.
+    """
+    offset = 0
+    for page in iter_message_id_pages(service, max_results, stats=stats, query=query):
+        positions = {msg_id: offset + index for index, msg_id in enumerate(page)}
+        offset += len(page)
+        msg_ids = [msg_id for msg_id in page if msg_id not in known_ids]
+        for msg_data in get_messages_batched(service, msg_ids, stats=stats):
+            yield dict(parse_message(msg_data), position=positions[msg_data["id"]])
+
+
+def get_emails(service, max_results=20, known_ids=(), batched=True, stats=None):
+    """Récupère les emails Gmail (sujet + texte brut).
+
+    Les messages dont l'id figure dans `known_ids` ne sont pas téléchargés.
+    Par défaut, les messages sont récupérés par batchs HTTP de 100 appels ;
+    `batched=False` conserve l'ancien chemin (un aller-retour par message).
+    """
+    if batched:
+        return list(iter_emails(service, max_results, known_ids, stats=stats))
+    return [
+        parse_message(get_message(service, msg_id, stats=stats))
+        for msg_id in list_message_ids(service, max_results, stats=stats)
+        if msg_id not in known_ids
+    ]
+
+
+def iter_new_emails(service, state, max_results=500, known_ids=(), stats=None):
+    """Synchronisation incrémentale : ne produit que les messages absents de `state`.
+
+    Utilise users().history().list depuis le dernier historyId enregistré, et
+    repasse en synchronisation complète s'il n'y en a pas ou s'il a expiré.
+    Met à jour `state.history_id` (l'état n'est pas sauvegardé ici).
+    """
+    known_ids = set(known_ids) | set(state.messages)
+    if state.history_id:
+        try:
+            new_ids, history_id = list_added_message_ids(service, state.history_id)
+        except HistoryExpiredError:
+            print("Historique Gmail expiré : synchronisation complète.")
         else:
-            # Single-part message (often simple text or non-standard)
-            data = payload["body"].get("data")
-            if data:
-                # The payload body data often needs base64 decoding
-                try:
-                    body = base64.urlsafe_b64decode(data).decode("utf-8")
-                except:
-                    body = "[Erreur de décodage du corps de l'email]"
-            else:
-                body = "" # No body data found
-                
-        emails.append({"subject": subject, "body": body})
-        
-    return emails
+            state.history_id = history_id
+            positions = {msg_id: position for position, msg_id in enumerate(new_ids)}
+            msg_ids = [msg_id for msg_id in new_ids if msg_id not in known_ids]
+            for msg_data in get_messages_batched(service, msg_ids, stats=stats):
+                yield dict(parse_message(msg_data), position=positions[msg_data["id"]])
+            return
+
+    # Le historyId est relevé avant le listing pour ne manquer aucun message arrivé entre-temps
+    state.history_id = current_history_id(service)
+    yield from iter_emails(service, max_results=max_results, known_ids=known_ids, stats=stats)
 
 # -------------------------------------------------------------
 # CLASSIFICATION VIA MISTRAL (MODIFIED FOR ERROR HANDLING)
 # -------------------------------------------------------------
-def classify_email(subject, body):
-    """Retourne catégorie, urgence, résumé.
-    
-    La logique a été modifiée pour gérer les erreurs HTTP (comme l'API Key invalide)
-    avant d'essayer de décoder la réponse JSON.
-    """
-    # Check for the API key availability
-    if not MISTRAL_KEY:
-        print("Erreur: La clé API Mistral n'est pas définie (MISTRAL_API_KEY non trouvé dans les variables d'environnement).")
-        return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": "Clé API manquante pour la classification."}
+def get_mistral_client():
+    """Client HTTP partagé par tous les threads ; recréé si l'URL, la clé
+    ou le limiteur de débit ont changé."""
+    global mistral_client
+    client = mistral_client
+    if (client is None or client.url != MISTRAL_URL or client.api_key != MISTRAL_KEY
+            or client.limiter is not rate_limiter):
+        client = MistralClient(MISTRAL_URL, MISTRAL_KEY, limiter=rate_limiter)
+        mistral_client = client
+    return client
+
 
-    prompt = f"""
+PROMPT_PREAMBLE = """
 Tu es un système interne de tri des tickets email. Ton objectif est de classer les emails de manière stricte et sans biais.
 
 --- Instructions Clés ---
 1. **Distingue clairement Anodine de Faible.**
 2. Utilise 'Anodine' uniquement pour les emails qui ne nécessitent **AUCUNE intervention humaine** ou qui sont des notifications standard sans impact négatif (ex: newsletter, accusé de réception, notification de maintenance réussie, réponse automatique, spam).
 3. Utilise 'Faible' pour tout ce qui nécessite une action future, mais qui n'est pas urgent.
+4. Indique dans "confiance" ta certitude sur la catégorie et l'urgence, entre 0 (au hasard) et 1 (certain).
 ---
 
 Catégories :
@@ -148,28 +227,81 @@ Urgence :
 - Modérée
 - Faible
 - Anodine
-Réponds uniquement du JSON :
+"""
+
+SINGLE_PROMPT_TEMPLATE = PROMPT_PREAMBLE + """Réponds uniquement du JSON :
 {{
   "categorie": "",
   "urgence": "",
-  "synthese": ""
+  "synthese": "",
+  "confiance": 0.0
 }}
 Email :
 Sujet : {subject}
 Contenu : {body}
 """
-    response = requests.post(
-        "https://api.mistral.ai/v1/chat/completions",  # Mistral endpoint
-        headers={
-            "Authorization": f"Bearer {MISTRAL_KEY}",
-            "Content-Type": "application/json"
-        },
-        json={
-            "model": "mistral-tiny",  # or "mistral-small", depending on your plan
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0
+
+BATCH_PROMPT_TEMPLATE = PROMPT_PREAMBLE + """Tu reçois plusieurs emails, chacun identifié par un id.
+Réponds uniquement par un tableau JSON contenant un objet par email, dans le même ordre :
+[
+  {{"id": "", "categorie": "", "urgence": "", "synthese": "", "confiance": 0.0}}
+]
+{emails}
+"""
+
+BATCH_EMAIL_TEMPLATE = """
+### Email id={id}
+Sujet : {subject}
+Contenu : {body}
+"""
+
+REPAIR_PROMPT_TEMPLATE = """Ta réponse à la classification de l'email ci-dessous est inexploitable : {problem}
+Réponse reçue :
+{answer}
+
+Catégories autorisées : {categories}
+Urgences autorisées : {levels}
+Réponds uniquement par l'objet JSON corrigé, sans texte autour :
+{{"categorie": "", "urgence": "", "synthese": "", "confiance": 0.0}}
+Email :
+Sujet : {subject}
+Contenu : {body}
+"""
+
+
+def call_mistral(prompt, json_mode=False, model=None):
+    """Envoie le prompt à Mistral et renvoie (contenu texte, None) ou (None, classification d'erreur).
+
+    Les nouvelles tentatives, délais et la limitation de débit sont gérés par
+    le client HTTP partagé ; ici on convertit les échecs en classification d'erreur.
+    Avec `json_mode`, l'API est contrainte à répondre par un objet JSON.
+    `model` : premier modèle de la cascade par défaut.
+    """
+    model = model or MODEL_CASCADE.models[0].name
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    try:
+        with metrics.timer("llm_call"):
+            response = get_mistral_client().chat(payload)
+    except CircuitOpenError as err:
+        # Pas d'appel réseau : l'API a déjà refusé la clé ou échoue en boucle
+        return None, {
+            "categorie": "ERREUR API",
+            "urgence": "Critique",
+            "synthese": f"Appel API Mistral non envoyé (disjoncteur ouvert : {err})."
+        }
+    except requests.exceptions.RequestException as err:
+        print(f"Erreur réseau de l'API Mistral: {err}")
+        return None, {
+            "categorie": "ERREUR API",
+            "urgence": "Critique",
+            "synthese": f"Échec de l'appel API Mistral (délai dépassé ou connexion perdue). Détail: {err}"
         }
-    )
     
     # NEW: Handle HTTP errors (4xx or 5xx) before attempting JSON decoding
     try:
@@ -178,7 +310,7 @@ Contenu : {body}
         print(f"Erreur HTTP de l'API Mistral: {err}")
         # Try to extract a meaningful error from the response text
         error_message = response.text[:100] if response.text else "Aucun détail d'erreur dans la réponse."
-        return {
+        return None, {
             "categorie": "ERREUR API", 
             "urgence": "Critique", 
             "synthese": f"Échec de l'appel API Mistral (Status {response.status_code}). Vérifiez la clé ou les limites. Détail: {error_message}..."
@@ -190,87 +322,516 @@ Contenu : {body}
     except requests.exceptions.JSONDecodeError as e:
         print("Erreur de décodage JSON après un statut 200: Le corps de la réponse était inattendu.")
         print(f"Réponse brute : {response.text[:200]}...")
-        return {
+        return None, {
             "categorie": "ERREUR DÉCODAGE", 
             "urgence": "Critique", 
             "synthese": f"Erreur de décodage JSON après succès HTTP. Vérifiez la structure JSON attendue. Erreur: {e}"
         }
 
-    # Existing logic for processing the successful JSON response
     if "choices" in resp_json and len(resp_json["choices"]) > 0:
-        result = resp_json["choices"][0]["message"]["content"]
+        metrics.add_usage(resp_json.get("usage"), model=model)
+        return resp_json["choices"][0]["message"]["content"], None
+
+    # Improved error message to include API details
+    error_detail = resp_json.get("error", {}).get("message", "Détails non disponibles")
+    print(f"Réponse inattendue de l'API Mistral: {error_detail}")
+    print(json.dumps(resp_json, indent=2))
+    return None, {"categorie": "Non classifié", "urgence": "Non classée", "synthese": f"Erreur API: {error_detail}"}
+
+
+def classify_email(subject, body, first_verdict=None):
+    """Retourne catégorie, urgence, résumé, confiance et modèle décideur (`modele`).
+
+    L'email est classé par le premier modèle de MODEL_CASCADE ; le modèle
+    suivant n'est appelé que si le verdict est peu sûr, urgent ou en échec
+    (voir cascade.py). `first_verdict` : verdict du premier modèle déjà
+    obtenu (classification par lot), à confirmer si besoin.
+    """
+    # Check for the API key availability
+    if not MISTRAL_KEY and first_verdict is None:
+        print("Erreur: La clé API Mistral n'est pas définie (MISTRAL_API_KEY non trouvé dans les variables d'environnement).")
+        return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": "Clé API manquante pour la classification."}
+
+    models = MODEL_CASCADE.models
+    classification = first_verdict or _classify_with_model(models[0].name, subject, body)
+    for model in models[1:]:
+        reason = MODEL_CASCADE.escalation_reason(classification, ERROR_CATEGORIES)
+        if reason is None:
+            break
+        metrics.inc("escalations", reason=reason, model=model.name)
+        escalated = _classify_with_model(model.name, subject, body)
+        if escalated.get("categorie") in ERROR_CATEGORIES and classification.get("categorie") not in ERROR_CATEGORIES:
+            # Le modèle supérieur a échoué : le verdict précédent reste le meilleur disponible
+            break
+        classification = escalated
+    return classification
+
+
+def _classify_with_model(model, subject, body):
+    # Un email déjà classé avec le même modèle et le même prompt n'est pas renvoyé au LLM
+    key = cache_key(model, PROMPT_VERSION, subject, body)
+    if classification_cache is not None:
+        cached = classification_cache.get(key)
+        if cached is not None:
+            # Les entrées antérieures à la normalisation des libellés sont revalidées
+            cached, problem = validate_classification(cached)
+            if problem is None:
+                return dict(cached, modele=model)
+
+    result, error = call_mistral(SINGLE_PROMPT_TEMPLATE.format(subject=subject, body=body),
+                                 json_mode=MISTRAL_JSON_MODE, model=model)
+    if error is not None:
+        return dict(error, modele=model)
+
+    # JSON entouré de texte, libellés approchés : corrigés localement (voir responses.py)
+    with metrics.timer("json_parse"):
+        classification, problem = parse_classification(result)
+    if problem is not None:
+        # Relance unique, seulement si la réponse est vraiment inexploitable
+        metrics.inc("response_reasks", reason=problem)
+        retry, error = call_mistral(REPAIR_PROMPT_TEMPLATE.format(
+            problem=PROBLEMS[problem], answer=(result or "")[:REPAIR_ANSWER_CHARS],
+            categories=", ".join(CATEGORIES), levels=", ".join(URGENCY_LEVELS),
+            subject=subject, body=body[:REPAIR_BODY_CHARS]
+        ), json_mode=MISTRAL_JSON_MODE, model=model)
+        if error is None:
+            with metrics.timer("json_parse"):
+                classification, problem = parse_classification(retry)
+    if problem is not None:
+        metrics.inc("response_failures", reason=problem)
+        print(f"Réponse inexploitable ({PROBLEMS[problem]}) :", result)
+        return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": result, "modele": model}
+    if classification_cache is not None:
+        classification_cache.put(key, classification)
+    return dict(classification, modele=model)
+
+# -------------------------------------------------------------
+# CLASSIFICATION PAR LOTS (PLUSIEURS EMAILS PAR REQUÊTE)
+# -------------------------------------------------------------
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens (~4 caractères par token)."""
+    return len(text) // 4 + 1
+
+
+def iter_batches(emails, max_emails=BATCH_SIZE, token_budget=BATCH_TOKEN_BUDGET):
+    """Regroupe les emails en lots d'au plus `max_emails` emails et `token_budget` tokens.
+
+    Un email qui dépasse seul le budget forme un lot d'un email.
+    """
+    batch, batch_tokens = [], estimate_tokens(BATCH_PROMPT_TEMPLATE)
+    for mail in emails:
+        tokens = estimate_tokens(BATCH_EMAIL_TEMPLATE.format(id=mail.get("id", ""), subject=mail["subject"], body=mail["body"]))
+        if batch and (len(batch) >= max_emails or batch_tokens + tokens > token_budget):
+            yield batch
+            batch, batch_tokens = [], estimate_tokens(BATCH_PROMPT_TEMPLATE)
+        batch.append(mail)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def classify_batch(emails):
+    """Classifie plusieurs emails en un seul appel et renvoie les classifications dans l'ordre.
+
+    Les emails absents ou mal formés dans le tableau renvoyé (réponse
+    tronquée, JSON invalide) sont reclassifiés un par un via classify_email.
+    Les emails que le pré-classifieur local sait trancher ne partent pas au LLM.
+    Avec la déduplication, seuls les représentants de groupe sont classifiés :
+    les autres membres reprennent le verdict de leur représentant.
+    """
+    if dedup_index is None:
+        return _classify_batch(emails)
+
+    members = {i for i, mail in enumerate(emails) if not dedup_index.is_representative(mail)}
+    own = [i for i in range(len(emails)) if i not in members]
+    results = [None] * len(emails)
+    try:
+        for i, classification in zip(own, _classify_batch([emails[i] for i in own]) if own else []):
+            results[i] = classification
+            dedup_index.resolve(emails[i], classification)
+    except Exception as err:
+        # Les membres en attente ne doivent pas rester bloqués
+        for i in own:
+            dedup_index.resolve(emails[i], error=err)
+        raise
+
+    for i in sorted(members):
+        # Le représentant est dans ce lot ou un lot soumis avant : l'attente se termine toujours
+        classification = dedup_index.verdict(emails[i])
+        if classification.get("categorie") in ERROR_CATEGORIES:
+            # Verdict en erreur : le membre tente sa propre classification
+            classification = classify_email(emails[i]["subject"], emails[i]["body"])
+        else:
+            metrics.inc("dedup_skipped")
+        results[i] = classification
+    return results
+
+
+def _classify_batch(emails):
+    results = [None] * len(emails)
+    if pre_classifier is not None:
+        for i, mail in enumerate(emails):
+            results[i] = pre_classifier.classify(mail)
+
+    undecided = [i for i in range(len(emails)) if results[i] is None]
+    if len(undecided) == 1:
+        i = undecided[0]
+        results[i] = classify_email(emails[i]["subject"], emails[i]["body"])
+        return results
+
+    # Le lot part au premier modèle de la cascade ; l'escalade se fait ensuite email par email
+    model = MODEL_CASCADE.models[0].name
+    keys = [cache_key(model, BATCH_PROMPT_VERSION, mail["subject"], mail["body"]) for mail in emails]
+    to_send = []
+    for i in undecided:
+        cached = classification_cache.get(keys[i]) if classification_cache is not None else None
+        if cached is not None:
+            cached, _ = validate_classification(cached)
+        if cached is not None:
+            results[i] = dict(cached, modele=model)
+        else:
+            to_send.append(i)
+
+    if to_send and MISTRAL_KEY:
+        # Les ids du prompt sont des positions : plus courts et sans ambiguïté que les ids Gmail
+        blocks = "".join(
+            BATCH_EMAIL_TEMPLATE.format(id=i, subject=emails[i]["subject"], body=emails[i]["body"])
+            for i in to_send
+        )
+        content, error = call_mistral(BATCH_PROMPT_TEMPLATE.format(emails=blocks), model=model)
+        if error is None:
+            for i, classification in _parse_batch_response(content, to_send).items():
+                results[i] = dict(classification, modele=model)
+                if classification_cache is not None:
+                    classification_cache.put(keys[i], classification)
+
+    batch_verdicts = [i for i in undecided if results[i] is not None]
+    for i in batch_verdicts:
+        results[i] = classify_email(emails[i]["subject"], emails[i]["body"], first_verdict=results[i])
+    missing = [i for i in range(len(emails)) if results[i] is None]
+    if missing and to_send:
+        metrics.inc("batch_fallbacks", value=len(missing))
+        print(f"Réponse par lot incomplète : {len(missing)}/{len(to_send)} emails reclassifiés un par un.")
+    for i in missing:
+        results[i] = classify_email(emails[i]["subject"], emails[i]["body"])
+    return results
+
+
+def _parse_batch_response(content, expected_ids):
+    """Associe chaque id attendu à sa classification normalisée ; ignore les entrées
+    invalides (reclassifiées une par une par l'appelant)."""
+    with metrics.timer("json_parse"):
+        items = extract_json(content, kind=list)
+    if items is None:
+        print("Impossible de parser le tableau JSON du lot :", (content or "")[:200])
+        return {}
+
+    parsed = {}
+    expected = set(expected_ids)
+    for item in items:
+        if not isinstance(item, dict):
+            continue
         try:
-            return json.loads(result)
-        except json.JSONDecodeError:
-            print("Impossible de parser le JSON :", result)
-            return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": result}
-    else:
-        # Improved error message to include API details
-        error_detail = resp_json.get("error", {}).get("message", "Détails non disponibles")
-        print(f"Réponse inattendue de l'API Mistral: {error_detail}")
-        print(json.dumps(resp_json, indent=2))
-        return {"categorie": "Non classifié", "urgence": "Non classée", "synthese": f"Erreur API: {error_detail}"}
+            i = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if i not in expected:
+            continue
+        classification, problem = validate_classification(item)
+        if problem is None:
+            parsed[i] = classification
+        else:
+            metrics.inc("batch_rejected", reason=problem)
+    return parsed
 
 # -------------------------------------------------------------
-# SAUVEGARDE JSON (No changes needed)
+# CLASSIFICATION CONCURRENTE
+# -------------------------------------------------------------
+def _timed_classify_batch(batch):
+    # Durée de classification du lot, reportée sur chaque email (`latency_ms`)
+    start = time.perf_counter()
+    results = classify_batch(batch)
+    latency_ms = round((time.perf_counter() - start) * 1000, 1)
+    for mail in batch:
+        mail["latency_ms"] = latency_ms
+    return results
+
+
+def classify_emails_concurrently(emails, max_in_flight=MAX_IN_FLIGHT, batch_size=None, ordered=True):
+    """Classifie les emails en parallèle et renvoie (email, classification)
+    dans l'ordre d'entrée, ou dès qu'ils sont prêts avec `ordered=False`.
+
+    Au plus `max_in_flight` appels sont en cours à un instant donné ;
+    le débit global reste borné par `rate_limiter`. Avec `batch_size` > 1,
+    chaque appel classifie un lot d'emails (voir classify_batch).
+    """
+    max_in_flight = max(1, max_in_flight)
+    batch_size = max(1, batch_size or BATCH_SIZE)
+    if dedup_index is not None:
+        # Attribution des groupes dans l'ordre d'entrée : le représentant précède ses membres
+        emails = dedup_index.tag(emails)
+    if not ordered:
+        yield from _classify_as_completed(emails, max_in_flight, batch_size)
+        return
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = deque()
+        for batch in iter_batches(emails, max_emails=batch_size):
+            pending.append((batch, executor.submit(_timed_classify_batch, batch)))
+            if len(pending) >= max_in_flight:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+def _classify_as_completed(emails, max_in_flight, batch_size):
+    # Un lot terminé n'attend pas les lots soumis avant lui
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        running = {}
+        for batch in iter_batches(emails, max_emails=batch_size):
+            running[executor.submit(_timed_classify_batch, batch)] = batch
+            if len(running) >= max_in_flight:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from zip(running.pop(future), future.result())
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from zip(running.pop(future), future.result())
+
+# -------------------------------------------------------------
+# SAUVEGARDE JSON
 # -------------------------------------------------------------
 def save_to_json(filename, data):
-    """Enregistre la liste de dictionnaires dans un fichier JSON."""
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    """Enregistre les dictionnaires (liste ou générateur) dans un fichier JSON."""
+    write_json_array(filename, data)
+
+# -------------------------------------------------------------
+# RAPPORT DE RUN
+# -------------------------------------------------------------
+def write_run_report(fmt="json", output="emails_classified.json"):
+    """Écrit le rapport de métriques à côté du fichier de résultats."""
+    directory = os.path.dirname(os.path.abspath(output))
+    extension = "prom" if fmt == "prometheus" else "json"
+    return metrics.write(os.path.join(directory, f"run_report.{extension}"), fmt=fmt)
 
 # -------------------------------------------------------------
 # PIPELINE PRINCIPAL
 # -------------------------------------------------------------
-def process_all_emails():
-    """Pipeline complet : Gmail → IA → JSON"""
-    print("Authentification Google...")
+def make_record(mail, classification):
+    """Enregistrement d'un email classifié (journal JSONL, magasin de résultats, exports)."""
+    record = {
+        "id": mail["id"],
+        "categorie": classification.get("categorie", "Non classifié"),
+        "subject": mail["subject"],
+        "urgence": classification.get("urgence", "Non classée"),
+        "synthese": classification.get("synthese", "Erreur de classification")
+    }
+    if "cluster_id" in mail:
+        record["cluster_id"] = mail["cluster_id"]
+    if classification.get("modele"):
+        # Modèle qui a décidé (dernier de la cascade sollicité, ou pré-classifieur)
+        record["modele"] = classification["modele"]
+    return record
+
+
+def process_all_emails(incremental=False, resume=False, batch_size=None, prefilter=True,
+                       metrics_format=None, gmail_service=None, source=None, dedup=True, priority=True,
+                       gmail_query=None, max_results=GMAIL_MAX_EMAILS, on_result=None):
+    """Pipeline complet : Gmail → IA → JSON
+
+    Les emails sont récupérés page par page, classifiés au fil de l'eau et
+    chaque résultat est ajouté immédiatement à emails_classified.jsonl et au
+    magasin de résultats (emails_classified.sqlite3, voir results_store.py),
+    d'où est exporté emails_classified.json.
+    Avec `resume=True`, les emails déjà présents dans ce journal (run
+    interrompu) ne sont ni retéléchargés ni reclassifiés.
+
+    En mode incrémental, seuls les messages arrivés depuis le dernier passage
+    sont récupérés et classifiés ; les résultats précédents sont conservés
+    dans l'état de synchronisation (gmail_sync_state.json).
+
+    `batch_size` > 1 regroupe plusieurs emails par requête Mistral.
+    `prefilter` active le pré-classifieur local entraîné sur ground_truth.csv.
+    `metrics_format` ("json" ou "prometheus") écrit un rapport de run
+    (durées par étape, compteurs, tokens) à côté de emails_classified.json.
+
+    `source` (itérable d'emails au format de parse_message, voir replay.py)
+    remplace Gmail : le pipeline tourne alors sans authentification.
+
+    `dedup` regroupe les quasi-doublons du run (alertes en rafale, fils de
+    réponses) : un seul email par groupe est classifié et chaque résultat
+    porte l'id de son groupe (`cluster_id`).
+
+    `priority` classifie d'abord les emails au score de priorité le plus
+    élevé (mots-clés d'incident, libellé IMPORTANT, expéditeur, voir
+    priority.py) et enregistre chaque résultat dès qu'il est prêt : un
+    email critique n'attend pas les newsletters reçues avant lui.
+    emails_classified.jsonl suit alors l'ordre de traitement ; le magasin
+    garde le rang de chaque email dans Gmail et emails_classified.json
+    reste dans l'ordre de Gmail.
+
+    `gmail_query` (filtre de recherche Gmail) et `max_results` (None = toute
+    la boîte) délimitent les emails d'un run complet ; `on_result` est
+    appelé avec chaque enregistrement (progression, voir coordinator.py).
+    """
+    global classification_cache, pre_classifier, dedup_index
+    if source is not None and incremental:
+        print("Mode incrémental ignoré : les emails proviennent d'un corpus local.")
+        incremental = False
+    if gmail_service is None and source is None:
+        print("Authentification Google...")
+        try:
+            gmail_service = google_auth()
+        except Exception as e:
+            print(f"Échec de l'authentification Google: {e}")
+            return # Exit the pipeline if auth fails
+
+    if metrics_format:
+        metrics.enable()
+
+    sink = JsonLinesSink(RESULTS_JSONL_PATH, resume=resume)
+    if sink.completed_ids:
+        print(f"Reprise : {len(sink.completed_ids)} emails déjà traités (dernier : {sink.last_id}).")
+    store = ResultsStore()
+    store.start_run(full=not incremental, resume=bool(sink.completed_ids))
+
+    print(MODEL_CASCADE)
+    print("Récupération et classification des emails...\n")
+    fetch_stats = FetchStats()
+    if source is not None:
+        emails = (dict(mail, position=position) for position, mail in enumerate(source)
+                  if mail["id"] not in sink.completed_ids)
+    elif incremental:
+        state = SyncState.load()
+        emails = iter_new_emails(gmail_service, state, max_results=max_results,
+                                 known_ids=sink.completed_ids, stats=fetch_stats)
+    else:
+        emails = iter_emails(gmail_service, max_results=max_results,
+                             known_ids=sink.completed_ids, stats=fetch_stats, query=gmail_query)
+
+    classification_cache = ClassificationCache()
+    if prefilter:
+        try:
+            pre_classifier = PreClassifier.from_ground_truth()
+        except FileNotFoundError:
+            print("Pré-classifieur désactivé : 'ground_truth.csv' est introuvable.")
+    if dedup:
+        dedup_index = NearDuplicateIndex()
+    if priority:
+        emails = iter_by_priority(emails)
+    run_started = time.perf_counter()
+    first_critical = None
     try:
-        gmail_service = google_auth()
-    except Exception as e:
-        print(f"Échec de l'authentification Google: {e}")
-        return # Exit the pipeline if auth fails
-
-    print("Récupération des emails...")
-    # Correction: maxResults capped at 500 (Gmail API limit)
-    emails = get_emails(gmail_service, max_results=500) 
-    print(f"{len(emails)} emails trouvés.")
-    
-    if not emails:
+        for mail, classification in classify_emails_concurrently(emails, batch_size=batch_size, ordered=not priority):
+            subject = mail["subject"]
+            print(f"--- Email : {subject}")
+            
+            # Safely access classification results (in case of API error)
+            categorie = classification.get("categorie", "Non classifié")
+            urgence = classification.get("urgence", "Non classée")
+            synthese = classification.get("synthese", "Erreur de classification")
+            
+            print("Catégorie :", categorie)
+            print("Urgence :", urgence)
+            print("Résumé :", synthese)
+            print("→ Enregistré.\n")
+            
+            metrics.inc("emails_processed")
+            if categorie in ERROR_CATEGORIES:
+                metrics.inc("errors", category=categorie)
+            record = make_record(mail, classification)
+            with metrics.timer("sink_write"):
+                sink.write(record)
+                store.append(record, model=record.get("modele"), latency_ms=mail.get("latency_ms"),
+                             position=mail.get("position"))
+            if on_result is not None:
+                on_result(record)
+            if urgence in URGENT_LEVELS:
+                # Déjà lisible dans emails_classified.jsonl et le magasin de résultats
+                print(f"⚠️ Email {urgence.lower()} enregistré : {subject}\n")
+                if urgence == "Critique" and first_critical is None:
+                    first_critical = time.perf_counter() - run_started
+                    metrics.observe("first_critical", first_critical)
+    finally:
+        sink.close()
+        store.close()
+        print(classification_cache.stats())
+        classification_cache.close()
+        classification_cache = None
+        if pre_classifier is not None:
+            print(pre_classifier.stats())
+            pre_classifier = None
+        if dedup_index is not None:
+            print(dedup_index.stats())
+            dedup_index = None
+
+    if source is None:
+        print(fetch_stats)
+    print(f"{sink.written} emails classifiés.")
+    if metrics_format:
+        report_path = write_run_report(metrics_format)
+        print(f"Rapport de run enregistré dans '{report_path}'.")
+
+    if incremental:
+        state.add_newest(iter_jsonl(RESULTS_JSONL_PATH))
+        state.save()
+    if not sink.written and not sink.completed_ids:
         print("Aucun email à traiter. Fin du pipeline.")
         return
-
-    print("Classification en cours...\n")
-    all_emails = []
-    for mail in emails:
-        subject = mail["subject"]
-        body = mail["body"]
-        print(f"--- Email : {subject}")
-        
-        classification = classify_email(subject, body)
-        
-        # Safely access classification results (in case of API error)
-        categorie = classification.get("categorie", "Non classifié")
-        urgence = classification.get("urgence", "Non classée")
-        synthese = classification.get("synthese", "Erreur de classification")
-        
-        print("Catégorie :", categorie)
-        print("Urgence :", urgence)
-        print("Résumé :", synthese)
-        print("→ Ajout dans la liste.\n")
-        
-        all_emails.append({
-            "categorie": categorie,
-            "subject": subject,
-            "urgence": urgence,
-            "synthese": synthese
-        })
-        
-    save_to_json("emails_classified.json", all_emails)
+    # Résultats courants du magasin : ce run, plus les précédents en mode incrémental
+    export_json("emails_classified.json")
     print("✔️ Tous les emails ont été traités et enregistrés dans 'emails_classified.json' !")
 
 # -------------------------------------------------------------
 # MAIN
 # -------------------------------------------------------------
 if __name__ == "__main__":
-    process_all_emails()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Classification des emails Gmail via Mistral.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Ne récupère que les messages arrivés depuis le dernier passage (historyId Gmail)."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Nombre d'emails classifiés par requête Mistral (1 par défaut)."
+    )
+    parser.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help="Envoie tous les emails au LLM, sans pré-classifieur local."
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Classifie chaque email, même quasi identique à un autre email du run."
+    )
+    parser.add_argument(
+        "--no-priority",
+        action="store_true",
+        help="Classifie dans l'ordre de Gmail au lieu de traiter d'abord les emails les plus urgents."
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["json", "prometheus"],
+        help="Écrit un rapport de run (durées par étape, compteurs, tokens) à côté des résultats."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reprend un run interrompu à partir de emails_classified.jsonl."
+    )
+    args = parser.parse_args()
+    process_all_emails(
+        incremental=args.incremental,
+        resume=args.resume,
+        batch_size=args.batch_size,
+        prefilter=not args.no_prefilter,
+        metrics_format=args.metrics,
+        dedup=not args.no_dedup,
+        priority=not args.no_priority
+    )
@@ -0,0 +1,417 @@
+import argparse
+import csv
+import difflib
+import json
+import os
+import unicodedata
+
+import numpy as np
+
+from sinks import iter_jsonl
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+GROUND_TRUTH_PATH = "ground_truth.csv"
+PREDICTIONS_PATH = "emails_classified.json"
+# Similarité minimale (difflib) pour rapprocher deux sujets qui ne sont pas identiques
+FUZZY_CUTOFF = 0.9
+# Rééchantillonnages bootstrap et niveau des intervalles de confiance
+BOOTSTRAP_SAMPLES = 1000
+CONFIDENCE = 0.95
+# Libellé d'une prédiction sans catégorie ou sans urgence
+MISSING_LABEL = "Non classifié"
+
+# Champs évalués : (nom, colonne de ground_truth.csv, clé de la prédiction)
+FIELDS = (
+    ("urgence", "urgence", "urgence"),
+    ("categorie", "categories", "categorie"),
+)
+
+# -------------------------------------------------------------
+# CHARGEMENT ET NORMALISATION
+# -------------------------------------------------------------
+def load_ground_truth(filename=GROUND_TRUTH_PATH):
+    with open(filename, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def load_predictions(filename=PREDICTIONS_PATH):
+    """Résultats du pipeline : tableau JSON (.json) ou journal JSON Lines (.jsonl)."""
+    if filename.endswith(".jsonl"):
+        return list(iter_jsonl(filename))
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def subject_key(subject):
+    """Sujet comparable : casse, espaces, formes Unicode et apostrophes harmonisés."""
+    text = unicodedata.normalize("NFKC", subject or "").replace("’", "'")
+    return " ".join(text.casefold().split())
+
+
+def normalize_label(label):
+    # Même convention que prefilter.load_ground_truth : apostrophes typographiques
+    if not label:
+        return MISSING_LABEL
+    return " ".join(str(label).split()).replace("'", "’")
+
+# -------------------------------------------------------------
+# APPARIEMENT PRÉDICTIONS / VÉRITÉ TERRAIN
+# -------------------------------------------------------------
+class _FuzzyMatcher:
+    """Équivalent de difflib.get_close_matches(n=1) pour de nombreuses requêtes.
+
+    La borne supérieure quick_ratio (caractères communs, sans ordre) est
+    calculée d'un coup pour tous les sujets connus avec NumPy ; le ratio
+    exact de SequenceMatcher n'est calculé que pour les candidats qui
+    peuvent encore dépasser le seuil.
+    """
+
+    def __init__(self, subjects, cutoff=FUZZY_CUTOFF):
+        self.subjects = subjects
+        self.cutoff = cutoff
+        self.alphabet = {char: k for k, char in enumerate(sorted(set("".join(subjects))))}
+        self.counts = np.zeros((len(subjects), len(self.alphabet)), dtype=np.int32)
+        for i, subject in enumerate(subjects):
+            np.add.at(self.counts[i], [self.alphabet[char] for char in subject], 1)
+        self.lengths = self.counts.sum(axis=1)
+
+    def match(self, key):
+        """Index du sujet connu le plus proche de `key`, ou None sous le seuil."""
+        if not self.subjects:
+            return None
+        # Les caractères absents de tous les sujets connus ne comptent dans aucune paire
+        codes = [self.alphabet[char] for char in key if char in self.alphabet]
+        query = np.bincount(codes, minlength=len(self.alphabet))
+        bound = 2 * np.minimum(self.counts, query).sum(axis=1) / np.maximum(self.lengths + len(key), 1)
+        best, best_ratio = None, self.cutoff
+        for i in sorted(np.flatnonzero(bound >= self.cutoff), key=lambda i: -bound[i]):
+            if bound[i] < best_ratio:
+                break
+            ratio = difflib.SequenceMatcher(None, self.subjects[i], key).ratio()
+            if ratio >= best_ratio and (best is None or ratio > best_ratio):
+                best, best_ratio = i, ratio
+        return best
+
+
+class Join:
+    """Paires (ligne de vérité terrain, prédiction) et bilan de l'appariement.
+
+    Rien n'est écarté sans être compté : prédictions sans correspondance,
+    lignes de vérité terrain jamais prédites, ids en double.
+    """
+
+    def __init__(self):
+        self.gt_index = []
+        self.pred_index = []
+        self.methods = {"id": 0, "sujet": 0, "approché": 0}
+        self.unmatched = []
+        self.missing = 0
+        self.duplicate_ids = 0
+        self.subject_mismatches = 0
+
+    def __len__(self):
+        return len(self.gt_index)
+
+    def __str__(self):
+        return (f"Appariement : {len(self)} paires ({self.methods['id']} par id, "
+                f"{self.methods['sujet']} par sujet, {self.methods['approché']} par sujet approché), "
+                f"{len(self.unmatched)} prédiction(s) sans correspondance, "
+                f"{self.missing} ligne(s) de vérité terrain sans prédiction, "
+                f"{self.duplicate_ids} prédiction(s) remplacée(s) par un id en double, "
+                f"{self.subject_mismatches} paire(s) par id au sujet différent")
+
+
+def join(ground_truth, predictions, fuzzy=True):
+    """Apparie chaque prédiction à une ligne de ground_truth.csv.
+
+    Par id d'abord ; un id présent plusieurs fois dans la vérité terrain est
+    départagé par le sujet. Sans id connu, par sujet normalisé, puis par
+    sujet approché (`fuzzy`). Une prédiction répétée avec le même id
+    (plusieurs runs concaténés) ne compte qu'une fois : la dernière.
+    """
+    keys = [subject_key(row["subjects"]) for row in ground_truth]
+    by_id = {}
+    by_subject = {}
+    for i, row in enumerate(ground_truth):
+        by_id.setdefault(row["ids"], []).append(i)
+        by_subject.setdefault(keys[i], i)
+    known_subjects = list(by_subject)
+    matcher = _FuzzyMatcher(known_subjects) if fuzzy else None
+    fuzzy_matches = {}
+
+    result = Join()
+    latest = {}
+    for j, pred in enumerate(predictions):
+        pred_id = pred.get("id")
+        if pred_id is not None:
+            if pred_id in latest:
+                result.duplicate_ids += 1
+            latest[pred_id] = j
+    keep = set(latest.values())
+
+    matched = np.zeros(len(ground_truth), dtype=bool)
+    for j, pred in enumerate(predictions):
+        if pred.get("id") is not None and j not in keep:
+            continue
+        key = subject_key(pred.get("subject", ""))
+        candidates = by_id.get(pred.get("id"))
+        if candidates:
+            i = next((c for c in candidates if keys[c] == key), candidates[0])
+            if keys[i] != key:
+                result.subject_mismatches += 1
+            method = "id"
+        elif key in by_subject:
+            i, method = by_subject[key], "sujet"
+        elif fuzzy:
+            if key not in fuzzy_matches:
+                close = matcher.match(key)
+                fuzzy_matches[key] = None if close is None else by_subject[known_subjects[close]]
+            i, method = fuzzy_matches[key], "approché"
+        else:
+            i = None
+        if i is None:
+            result.unmatched.append(j)
+            continue
+        result.gt_index.append(i)
+        result.pred_index.append(j)
+        result.methods[method] += 1
+        matched[i] = True
+    result.missing = int((~matched).sum())
+    return result
+
+# -------------------------------------------------------------
+# MÉTRIQUES (NUMPY)
+# -------------------------------------------------------------
+def confusion_matrix(truth, predicted, labels=None):
+    """Matrice de confusion (lignes : vérité terrain, colonnes : prédiction) et libellés."""
+    if labels is None:
+        labels = sorted(set(truth) | set(predicted))
+    codes = {label: k for k, label in enumerate(labels)}
+    k = len(labels)
+    t = np.fromiter((codes[label] for label in truth), dtype=np.int64, count=len(truth))
+    p = np.fromiter((codes[label] for label in predicted), dtype=np.int64, count=len(predicted))
+    return np.bincount(t * k + p, minlength=k * k).reshape(k, k), labels
+
+
+def class_scores(cm):
+    """Précision, rappel, F1 et support par classe.
+
+    Accepte une matrice (k, k) ou une pile (..., k, k) : les rééchantillons
+    bootstrap sont évalués en une seule opération.
+    """
+    tp = np.diagonal(cm, axis1=-2, axis2=-1).astype(float)
+    support = cm.sum(axis=-1)
+    predicted = cm.sum(axis=-2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return precision, recall, f1, support
+
+
+def accuracy(cm):
+    total = cm.sum(axis=(-2, -1))
+    return np.trace(cm, axis1=-2, axis2=-1) / np.maximum(total, 1)
+
+
+def macro_f1(cm, classes):
+    """F1 moyen sur `classes` (masque booléen) : les classes de la vérité terrain.
+    Les libellés seulement prédits (ex: ERREUR API) pèsent via le rappel."""
+    return class_scores(cm)[2][..., classes].mean(axis=-1)
+
+
+def bootstrap(cm, samples=BOOTSTRAP_SAMPLES, seed=0):
+    """Matrices de confusion de `samples` rééchantillonnages avec remise des paires.
+
+    Tirer n paires avec remise revient à tirer les effectifs des cellules
+    selon une loi multinomiale de paramètres (n, cm / n) : le coût dépend du
+    nombre de classes, pas du nombre d'emails.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(cm.sum())
+    if total == 0:
+        return np.zeros((samples,) + cm.shape, dtype=np.int64)
+    draws = rng.multinomial(total, cm.ravel() / total, size=samples)
+    return draws.reshape((samples,) + cm.shape)
+
+
+def interval(values, confidence=CONFIDENCE):
+    """Intervalle de confiance par percentiles (sur le premier axe)."""
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail], axis=0)
+    return low, high
+
+
+def score_field(truth, predicted, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE, seed=0):
+    """Scores d'un champ (urgence ou catégorie) avec intervalles de confiance bootstrap."""
+    cm, labels = confusion_matrix(truth, predicted)
+    precision, recall, f1, support = class_scores(cm)
+    classes = support > 0
+    scores = {
+        "labels": labels,
+        "confusion": cm,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "support": support,
+        "accuracy": float(accuracy(cm)),
+        "macro_f1": float(macro_f1(cm, classes)) if classes.any() else 0.0,
+    }
+    if samples:
+        resampled = bootstrap(cm, samples, seed)
+        scores["accuracy_ci"] = tuple(float(v) for v in interval(accuracy(resampled), confidence))
+        scores["macro_f1_ci"] = tuple(float(v) for v in interval(macro_f1(resampled, classes), confidence))
+        scores["f1_ci"] = interval(class_scores(resampled)[2], confidence)
+    return scores
+
+
+def evaluate(ground_truth, predictions, fuzzy=True, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE, seed=0):
+    """Apparie puis évalue les prédictions ; renvoie (appariement, scores par champ)."""
+    pairs = join(ground_truth, predictions, fuzzy=fuzzy)
+    results = {}
+    for name, gt_column, pred_key in FIELDS:
+        truth = [normalize_label(ground_truth[i][gt_column]) for i in pairs.gt_index]
+        predicted = [normalize_label(predictions[j].get(pred_key)) for j in pairs.pred_index]
+        results[name] = score_field(truth, predicted, samples, confidence, seed)
+    return pairs, results
+
+def accuracy_by_model(ground_truth, predictions, pairs):
+    """Exactitude par modèle décideur (clé `modele` des prédictions, voir cascade.py) :
+    {modèle: {"count": paires, champ: exactitude}} ; vide sans modèle renseigné."""
+    groups = {}
+    for i, j in zip(pairs.gt_index, pairs.pred_index):
+        model = predictions[j].get("modele")
+        if model:
+            groups.setdefault(model, []).append((i, j))
+    report = {}
+    for model, members in sorted(groups.items()):
+        report[model] = {"count": len(members)}
+        for name, gt_column, pred_key in FIELDS:
+            truth = np.array([normalize_label(ground_truth[i][gt_column]) for i, _ in members])
+            predicted = np.array([normalize_label(predictions[j].get(pred_key)) for _, j in members])
+            report[model][name] = float((truth == predicted).mean())
+    return report
+
+# -------------------------------------------------------------
+# RAPPORTS
+# -------------------------------------------------------------
+def format_report(name, scores):
+    """Rapport texte d'un champ, dans l'esprit de sklearn.metrics.classification_report."""
+    width = max([len(label) for label in scores["labels"]] + [12])
+    has_ci = "f1_ci" in scores
+    lines = [f"{name.upper()}",
+             f"{'':<{width}}  précision  rappel     f1{'   IC f1' if has_ci else ''}  support"]
+    for k, label in enumerate(scores["labels"]):
+        ci = f"  [{scores['f1_ci'][0][k]:.2f}-{scores['f1_ci'][1][k]:.2f}]" if has_ci else ""
+        lines.append(f"{label:<{width}}  {scores['precision'][k]:9.3f}  {scores['recall'][k]:6.3f}  "
+                     f"{scores['f1'][k]:5.3f}{ci}  {scores['support'][k]:7d}")
+    for metric in ("accuracy", "macro_f1"):
+        ci = ""
+        if f"{metric}_ci" in scores:
+            low, high = scores[f"{metric}_ci"]
+            ci = f"  (IC {CONFIDENCE:.0%} : {low:.3f} – {high:.3f})"
+        lines.append(f"{metric:<{width}}  {scores[metric]:.3f}{ci}")
+    return "\n".join(lines)
+
+
+def to_dict(pairs, results):
+    """Rapport sérialisable en JSON (pour suivre la qualité d'un run à l'autre)."""
+    report = {
+        "pairs": len(pairs),
+        "methods": pairs.methods,
+        "unmatched_predictions": len(pairs.unmatched),
+        "missing_ground_truth": pairs.missing,
+        "duplicate_ids": pairs.duplicate_ids,
+        "subject_mismatches": pairs.subject_mismatches,
+    }
+    for name, scores in results.items():
+        report[name] = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                        for key, value in scores.items() if key != "f1_ci"}
+        if "f1_ci" in scores:
+            # (borne basse, borne haute) par classe, dans l'ordre de `labels`
+            report[name]["f1_ci"] = [list(bounds) for bounds in zip(*(b.tolist() for b in scores["f1_ci"]))]
+    return report
+
+
+def plot_confusion(scores, title, filename, cmap="Blues"):
+    """Enregistre la matrice de confusion en image (backend Agg : jamais de fenêtre)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    cm = scores["confusion"]
+    labels = scores["labels"]
+    size = max(5, 0.6 * len(labels) + 3)
+    fig, ax = plt.subplots(figsize=(size + 2, size))
+    image = ax.imshow(cm, cmap=cmap)
+    fig.colorbar(image, ax=ax)
+    threshold = cm.max() / 2 if cm.size else 0
+    for (row, col), count in np.ndenumerate(cm):
+        ax.text(col, row, str(count), ha="center", va="center",
+                color="white" if count > threshold else "black", fontsize=8)
+    ax.set_xticks(range(len(labels)), labels, rotation=45, ha="right", fontsize=8)
+    ax.set_yticks(range(len(labels)), labels, fontsize=8)
+    ax.set_xlabel("Prédiction")
+    ax.set_ylabel("Ground Truth")
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(filename, dpi=100)
+    plt.close(fig)
+
+
+def evaluate_files(predictions_path=PREDICTIONS_PATH, ground_truth_path=GROUND_TRUTH_PATH, plots_dir=None,
+                   report_path=None, fuzzy=True, samples=BOOTSTRAP_SAMPLES):
+    """Évalue un fichier de résultats, affiche le rapport et enregistre graphiques et JSON."""
+    ground_truth = load_ground_truth(ground_truth_path)
+    predictions = load_predictions(predictions_path)
+    pairs, results = evaluate(ground_truth, predictions, fuzzy=fuzzy, samples=samples)
+
+    print(f"{len(predictions)} prédictions ('{predictions_path}'), "
+          f"{len(ground_truth)} lignes de vérité terrain ('{ground_truth_path}')")
+    print(pairs)
+    for j in pairs.unmatched[:5]:
+        print(f"  sans correspondance : {predictions[j].get('subject', '')!r}")
+    for name, scores in results.items():
+        print()
+        print(format_report(name, scores))
+    by_model = accuracy_by_model(ground_truth, predictions, pairs)
+    if by_model:
+        print("\nPAR MODÈLE DÉCIDEUR")
+        for model, entry in by_model.items():
+            print(f"{model:<24} {entry['count']:6d} emails  urgence {entry['urgence']:.3f}  "
+                  f"catégorie {entry['categorie']:.3f}")
+
+    if plots_dir:
+        os.makedirs(plots_dir, exist_ok=True)
+        for (name, scores), cmap in zip(results.items(), ("Blues", "Greens")):
+            filename = os.path.join(plots_dir, f"confusion_{name}.png")
+            plot_confusion(scores, f"Matrice de confusion – {name.upper()} (GT vs Prédiction)", filename, cmap)
+            print(f"Graphique enregistré dans '{filename}'.")
+    if report_path:
+        report = to_dict(pairs, results)
+        if by_model:
+            report["by_model"] = by_model
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"Rapport enregistré dans '{report_path}'.")
+    return pairs, results
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Évalue les résultats du pipeline par rapport à ground_truth.csv.")
+    parser.add_argument("predictions", nargs="?", default=PREDICTIONS_PATH,
+                        help="emails_classified.json ou journal .jsonl")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH)
+    parser.add_argument("--plots", metavar="DIR", help="Répertoire des matrices de confusion (PNG)")
+    parser.add_argument("--report", metavar="PATH", help="Rapport JSON")
+    parser.add_argument("--bootstrap", type=int, default=BOOTSTRAP_SAMPLES,
+                        help="Rééchantillonnages des intervalles de confiance (0 = aucun)")
+    parser.add_argument("--no-fuzzy", action="store_true", help="Pas d'appariement par sujet approché")
+    args = parser.parse_args()
+
+    evaluate_files(args.predictions, args.ground_truth, plots_dir=args.plots, report_path=args.report,
+                   fuzzy=not args.no_fuzzy, samples=args.bootstrap)
@@ -0,0 +1,200 @@
+import base64
+import codecs
+import os
+import re
+from html.parser import HTMLParser
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Budget (estimé) du corps envoyé au LLM, en tokens ; 0 = pas de troncature
+BODY_TOKEN_BUDGET = int(os.getenv("EMAIL_BODY_TOKEN_BUDGET", "800"))
+# Même estimation que emails.estimate_tokens
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[…]"
+
+# Attribution d'une réponse ("Le 3 juin 2024 à 10:12, Jean <jean@exemple.fr> a écrit :"),
+# sur une ou deux lignes et suivie de lignes citées "> ". Un message transféré n'est
+# pas retiré : c'est souvent l'alerte elle-même.
+QUOTE_HEADER = re.compile(
+    r"^[ \t]*(?:Le|On)\s(?P<attribution>[^\n]{1,200}(?:\n[^\n]{1,200})?)\s(?:a écrit|wrote)\s*:[ \t]*\n"
+    r"(?:[ \t]*\n)*[ \t]*>",
+    re.IGNORECASE | re.MULTILINE
+)
+ATTRIBUTION_ADDRESS = re.compile(r"@|<[^>]+>")
+# En deçà, le texte restant ne suffit pas à classer l'email : l'historique est conservé
+MIN_REMAINING_CHARS = 40
+# Délimiteur de signature (RFC 3676) et mentions ajoutées par les clients mobiles
+SIGNATURE = re.compile(r"^(-- ?|Envoyé de mon \w+.*|Sent from my \w+.*)$", re.MULTILINE)
+BLANK_LINES = re.compile(r"\n{3,}")
+
+# -------------------------------------------------------------
+# DÉCODAGE DES PARTIES MIME
+# -------------------------------------------------------------
+def _header(part, name):
+    for header in part.get("headers", []):
+        if header["name"].lower() == name.lower():
+            return header["value"]
+    return ""
+
+
+def part_charset(part):
+    """Jeu de caractères déclaré dans le Content-Type de la partie (utf-8 par défaut)."""
+    match = re.search(r'charset\s*=\s*"?([^";\s]+)', _header(part, "Content-Type"), re.IGNORECASE)
+    charset = match.group(1) if match else "utf-8"
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return "utf-8"
+
+
+def decode_part(part):
+    """Texte d'une partie Gmail (body.data en base64url) selon son charset déclaré.
+
+    Un octet invalide pour le charset déclaré (en-tête erroné, fréquent avec
+    windows-1252 annoncé en iso-8859-1 ou en utf-8) est remplacé plutôt que
+    de faire échouer tout l'email.
+    """
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    charset = part_charset(part)
+    try:
+        return raw.decode(charset)
+    except UnicodeDecodeError:
+        if charset == "utf-8":
+            # Texte occidental non déclaré : cp1252 décode tous les octets usuels
+            return raw.decode("cp1252", errors="replace")
+        return raw.decode(charset, errors="replace")
+
+
+def _is_attachment(part):
+    return bool(part.get("filename")) or _header(part, "Content-Disposition").lower().startswith("attachment")
+
+
+def iter_parts(payload):
+    """Parcours itératif (en profondeur, dans l'ordre du message) des parties MIME."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        # Ordre inverse : la première sous-partie est dépilée en premier
+        stack.extend(reversed(part.get("parts", [])))
+
+# -------------------------------------------------------------
+# CONVERSION HTML → TEXTE
+# -------------------------------------------------------------
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "table", "h1", "h2", "h3", "h4", "h5", "h6",
+                  "blockquote", "pre", "hr", "section", "article", "header", "footer"}
+    SKIPPED_TAGS = {"script", "style", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.chunks.append(data)
+
+
+def html_to_text(html):
+    """Texte lisible d'un corps HTML : balises retirées, blocs séparés par des sauts de ligne."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.chunks).splitlines())
+    return BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+# -------------------------------------------------------------
+# EXTRACTION ET NETTOYAGE DU CORPS
+# -------------------------------------------------------------
+def extract_body(payload):
+    """Texte du message : première partie text/plain, sinon première partie
+    text/html convertie en texte. Les pièces jointes sont ignorées."""
+    html_part = None
+    for part in iter_parts(payload):
+        if _is_attachment(part):
+            continue
+        mime_type = part.get("mimeType", "")
+        if mime_type == "text/plain":
+            text = decode_part(part)
+            if text.strip():
+                return text
+        elif mime_type == "text/html" and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html_to_text(decode_part(html_part))
+    return ""
+
+
+def reply_header(text):
+    """Attribution de réponse (date et adresse, suivie de lignes "> ") ; None si aucune."""
+    for match in QUOTE_HEADER.finditer(text):
+        attribution = match.group("attribution")
+        if any(char.isdigit() for char in attribution) and ATTRIBUTION_ADDRESS.search(attribution):
+            return match
+    return None
+
+
+def strip_signature(text):
+    match = SIGNATURE.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    return text.strip()
+
+
+def strip_quoted(text):
+    """Retire l'historique cité d'une réponse (attribution et lignes "> ") et la signature.
+
+    Le corps d'un message transféré est conservé. Si le texte restant serait
+    trop court pour classer l'email ("Ok pour moi."), l'historique est gardé.
+    """
+    kept = text
+    match = reply_header(kept)
+    if match and match.start() > 0:
+        kept = kept[:match.start()]
+    kept = "\n".join(line for line in kept.splitlines() if not line.lstrip().startswith(">"))
+    kept = strip_signature(kept)
+    if len(kept) < MIN_REMAINING_CHARS and kept != text.strip():
+        return strip_signature(text)
+    return kept
+
+
+def truncate(text, token_budget=None):
+    """Tronque à `token_budget` tokens estimés, sur une fin de mot."""
+    if token_budget is None:
+        token_budget = BODY_TOKEN_BUDGET
+    limit = token_budget * CHARS_PER_TOKEN
+    if token_budget <= 0 or len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + TRUNCATION_MARKER
+
+
+def clean_body(text, token_budget=None):
+    """Corps prêt pour le prompt : historique et signature retirés, taille plafonnée.
+
+    Les caractères retirés sont comptés (`body_chars_in` / `body_chars_out`)
+    quand les métriques sont actives.
+    """
+    cleaned = truncate(strip_quoted(text), token_budget)
+    metrics.inc("body_chars_in", len(text))
+    metrics.inc("body_chars_out", len(cleaned))
+    return cleaned
@@ -0,0 +1,679 @@
+import base64
+import copy
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from collections import Counter
+
+from googleapiclient.errors import HttpError
+
+# Grille d'une feuille créée sans gridProperties
+DEFAULT_GRID_ROWS = 1000
+DEFAULT_GRID_COLUMNS = 26
+
+# -------------------------------------------------------------
+# FAUX SERVICES GOOGLE EN MÉMOIRE (BENCHMARKS)
+# -------------------------------------------------------------
+class FakeRequest:
+    """Imite un HttpRequest de googleapiclient : le travail est fait à execute().
+
+    Si `service` est fourni, chaque execute() compte un aller-retour HTTP,
+    attend `service.latency` secondes et compte les octets de la réponse
+    (après application du masque `fields`).
+    """
+
+    def __init__(self, func, service=None, fields=None):
+        self.func = func
+        self.service = service
+        self.fields = fields
+
+    def run(self):
+        response = apply_fields_mask(self.func(), self.fields)
+        if self.service is not None:
+            self.service.bytes_sent += len(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        return response
+
+    def execute(self):
+        if self.service is not None:
+            self.service.http_requests += 1
+            time.sleep(self.service.latency)
+        return self.run()
+
+
+class FakeBatch:
+    """Imite BatchHttpRequest : un seul aller-retour HTTP pour tous les appels ajoutés."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        if len(self.requests) >= 1000:
+            raise ValueError("Trop d'appels dans un batch")
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self):
+        self.service.http_requests += 1
+        time.sleep(self.service.latency)
+        for request_id, request, callback in self.requests:
+            callback = callback or self.callback
+            try:
+                response, exception = request.run(), None
+            except HttpError as err:
+                response, exception = None, err
+            callback(request_id, response, exception)
+
+# -------------------------------------------------------------
+# MASQUES DE RÉPONSE (PARAMÈTRE fields)
+# -------------------------------------------------------------
+def parse_fields_mask(fields):
+    """Convertit "a,b/c,d(e,f)" (ou "b.c", syntaxe de l'API Sheets) en arbre {"a": None, "b": {"c": None}, "d": {...}}."""
+    tree, pos = _parse_fields(fields, 0)
+    return tree
+
+
+def _parse_fields(text, pos):
+    tree = {}
+    while pos < len(text):
+        if text[pos] == ")":
+            return tree, pos + 1
+        if text[pos] == ",":
+            pos += 1
+            continue
+        # Un chemin "a/b/c" éventuellement suivi d'une sous-sélection "(...)"
+        end = pos
+        while end < len(text) and text[end] not in ",()":
+            end += 1
+        path = text[pos:end].replace(".", "/").split("/")
+        pos = end
+        subtree = None
+        if pos < len(text) and text[pos] == "(":
+            subtree, pos = _parse_fields(text, pos + 1)
+        node = tree
+        for name in path[:-1]:
+            if name in node and node[name] is None:
+                break  # le champ parent est déjà sélectionné en entier
+            node = node.setdefault(name, {})
+        else:
+            node[path[-1]] = subtree
+    return tree, pos
+
+
+def apply_fields_mask(response, fields):
+    """Ne garde de `response` que les champs sélectionnés par `fields`."""
+    if not fields:
+        return response
+    return _apply_tree(response, parse_fields_mask(fields))
+
+
+def _apply_tree(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_apply_tree(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {
+        name: _apply_tree(value[name], subtree)
+        for name, subtree in tree.items()
+        if name in value
+    }
+
+
+class FakeHttpResponse(dict):
+    """Réponse HTTP minimale attendue par HttpError."""
+
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = "Not Found" if status == 404 else "Error"
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def make_gmail_message(msg_id, subject, body, history_id, forwards=0):
+    """Construit un message tel que renvoyé par messages().get(format="full").
+
+    Reproduit une réponse enregistrée typique : en-têtes de transport,
+    alternative text/plain + text/html et une pièce jointe. Avec `forwards`,
+    l'alternative est imbriquée dans autant de multipart/mixed (transferts
+    successifs en ligne).
+    """
+    html = "<html><body><p>" + body.replace("\n", "<br>") + "</p></body></html>"
+    headers = [
+        {"name": "Delivered-To", "value": "support@example.com"},
+        {"name": "Received", "value": "by 2002:a05:6402:1234 with SMTP id abc; Mon, 1 Dec 2025 09:00:00 -0800 (PST)"},
+        {"name": "X-Google-Smtp-Source", "value": "AGHT+IF" + "x" * 80},
+        {"name": "ARC-Seal", "value": "i=1; a=rsa-sha256; t=1764608400; cv=none; d=google.com; s=arc-20240605; b=" + "y" * 180},
+        {"name": "DKIM-Signature", "value": "v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; s=s1; b=" + "z" * 180},
+        {"name": "Return-Path", "value": "<alerts@example.com>"},
+        {"name": "From", "value": "Équipe IT <alerts@example.com>"},
+        {"name": "To", "value": "support@example.com"},
+        {"name": "Subject", "value": subject},
+        {"name": "Date", "value": "Mon, 1 Dec 2025 09:00:00 +0100"},
+        {"name": "Message-ID", "value": f"<{msg_id}@mail.example.com>"},
+        {"name": "MIME-Version", "value": "1.0"},
+        {"name": "Content-Type", "value": 'multipart/mixed; boundary="000000000000abcdef"'},
+    ]
+    message = {
+        "id": msg_id,
+        "threadId": msg_id,
+        "labelIds": ["INBOX", "UNREAD"],
+        "snippet": body[:100],
+        "sizeEstimate": 4096 + len(body) * 3,
+        "historyId": str(history_id),
+        "internalDate": "1764576000000",
+        "payload": {
+            "partId": "",
+            "mimeType": "multipart/mixed",
+            "filename": "",
+            "headers": headers,
+            "body": {"size": 0},
+            "parts": [
+                {
+                    "partId": "0",
+                    "mimeType": "multipart/alternative",
+                    "filename": "",
+                    "headers": [{"name": "Content-Type", "value": 'multipart/alternative; boundary="000000000000fedcba"'}],
+                    "body": {"size": 0},
+                    "parts": [
+                        {
+                            "partId": "0.0",
+                            "mimeType": "text/plain",
+                            "filename": "",
+                            "headers": [{"name": "Content-Type", "value": 'text/plain; charset="UTF-8"'}],
+                            "body": {"size": len(body), "data": _b64(body)}
+                        },
+                        {
+                            "partId": "0.1",
+                            "mimeType": "text/html",
+                            "filename": "",
+                            "headers": [{"name": "Content-Type", "value": 'text/html; charset="UTF-8"'}],
+                            "body": {"size": len(html), "data": _b64(html)}
+                        },
+                    ]
+                },
+                {
+                    "partId": "1",
+                    "mimeType": "application/pdf",
+                    "filename": "rapport.pdf",
+                    "headers": [
+                        {"name": "Content-Type", "value": 'application/pdf; name="rapport.pdf"'},
+                        {"name": "Content-Disposition", "value": 'attachment; filename="rapport.pdf"'},
+                        {"name": "Content-Transfer-Encoding", "value": "base64"},
+                    ],
+                    "body": {"attachmentId": "ANGjdJ" + "a" * 300, "size": 48213}
+                },
+            ]
+        }
+    }
+    for level in range(forwards):
+        content = message["payload"]["parts"][0]
+        message["payload"]["parts"][0] = {
+            "partId": "0",
+            "mimeType": "multipart/mixed",
+            "filename": "",
+            "headers": [{"name": "Content-Type", "value": f'multipart/mixed; boundary="fwd{level}"'}],
+            "body": {"size": 0},
+            "parts": [content],
+        }
+    return message
+
+
+class FakeGmailService:
+    """Boîte Gmail en mémoire exposant users().messages(), users().history() et getProfile().
+
+    `calls` compte les appels exécutés par méthode (ex: calls["messages.get"]).
+    """
+
+    def __init__(self):
+        self.store = {}
+        self.order = []  # du plus ancien au plus récent
+        self.history_log = []  # (historyId, id du message ajouté)
+        self.history_id = 1000
+        self.oldest_history_id = self.history_id
+        self.calls = Counter()
+        # Allers-retours HTTP et octets des réponses, vus côté serveur
+        self.http_requests = 0
+        self.bytes_sent = 0
+        # Durée simulée d'un aller-retour HTTP, en secondes
+        self.latency = 0.0
+        # Ids dont messages.get répond 429 (quota dépassé)
+        self.throttled = set()
+
+    # ---- Alimentation de la boîte ----
+    def add_message(self, subject, body, forwards=0):
+        self.history_id += 1
+        msg_id = f"msg{len(self.order):06d}"
+        self.store[msg_id] = make_gmail_message(msg_id, subject, body, self.history_id, forwards)
+        self.order.append(msg_id)
+        self.history_log.append((self.history_id, msg_id))
+        return msg_id
+
+    def expire_history(self):
+        """Simule la purge de l'historique par Gmail."""
+        self.oldest_history_id = self.history_id
+
+    # ---- Ressources de l'API ----
+    def users(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def getProfile(self, userId):
+        def run():
+            self.calls["getProfile"] += 1
+            return {"emailAddress": "me@example.com", "historyId": str(self.history_id)}
+        return FakeRequest(run, self)
+
+    def watch(self, userId, body):
+        def run():
+            self.calls["watch"] += 1
+            return {"historyId": str(self.history_id), "expiration": str(int((time.time() + 7 * 86400) * 1000))}
+        return FakeRequest(run, self)
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def history(self):
+        return FakeHistory(self)
+
+
+class FakeMessages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, maxResults=100, pageToken=None, fields=None, **kwargs):
+        maxResults = min(maxResults, 500)
+
+        def run():
+            self.gmail.calls["messages.list"] += 1
+            newest_first = list(reversed(self.gmail.order))
+            start = int(pageToken or 0)
+            page = newest_first[start:start + maxResults]
+            response = {"messages": [{"id": msg_id, "threadId": msg_id} for msg_id in page]}
+            if start + maxResults < len(newest_first):
+                response["nextPageToken"] = str(start + maxResults)
+            response["resultSizeEstimate"] = len(newest_first)
+            return response
+        return FakeRequest(run, self.gmail, fields)
+
+    def get(self, userId, id, format="full", fields=None, **kwargs):
+        def run():
+            self.gmail.calls["messages.get"] += 1
+            if id in self.gmail.throttled:
+                raise HttpError(FakeHttpResponse(429), b'{"error": {"code": 429}}')
+            return self.gmail.store[id]
+        return FakeRequest(run, self.gmail, fields)
+
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, fields=None, **kwargs):
+        def run():
+            self.gmail.calls["history.list"] += 1
+            start = int(startHistoryId)
+            if start < self.gmail.oldest_history_id:
+                raise HttpError(FakeHttpResponse(404), b'{"error": {"code": 404}}')
+            records = [
+                {"id": str(hid), "messagesAdded": [{"message": {"id": msg_id}}]}
+                for hid, msg_id in self.gmail.history_log
+                if hid > start
+            ]
+            return {"history": records, "historyId": str(self.gmail.history_id)}
+        return FakeRequest(run, self.gmail, fields)
+
+# -------------------------------------------------------------
+# FAUX GOOGLE SHEETS
+# -------------------------------------------------------------
+def parse_a1_range(a1_range):
+    """Découpe "'Feuille'!B2:D" en (feuille, ligne0, colonne0, ligne1, colonne1).
+
+    Indices à partir de 0 ; ligne1/colonne1 sont exclusifs et valent None
+    quand la plage est ouverte (ex: "A1:D" va jusqu'à la dernière ligne).
+    """
+    sheet_name, _, cells = a1_range.rpartition("!")
+    sheet_name = sheet_name.strip("'").replace("''", "'")
+    if not sheet_name:
+        sheet_name, cells = cells.strip("'"), ""
+
+    def corner(ref):
+        letters = "".join(ch for ch in ref if ch.isalpha())
+        digits = "".join(ch for ch in ref if ch.isdigit())
+        column = None
+        if letters:
+            column = 0
+            for ch in letters.upper():
+                column = column * 26 + ord(ch) - ord("A") + 1
+            column -= 1
+        return (int(digits) - 1 if digits else None), column
+
+    if not cells:
+        return sheet_name, 0, 0, None, None
+    start, _, end = cells.partition(":")
+    row0, col0 = corner(start)
+    if not end:
+        return sheet_name, row0 or 0, col0 or 0, (row0 or 0) + 1, (col0 or 0) + 1
+    row1, col1 = corner(end)
+    return (sheet_name, row0 or 0, col0 or 0,
+            None if row1 is None else row1 + 1, None if col1 is None else col1 + 1)
+
+
+def _user_entered(value):
+    # Saisie interprétée comme dans l'interface : nombre (double précision), formule
+    text = str(value)
+    try:
+        return f"{float(text):.15g}"
+    except ValueError:
+        pass
+    return "#ERROR!" if text.startswith(("=", "+", "-")) else text
+
+
+class FakeSheetsService:
+    """Classeur Google Sheets en mémoire exposant spreadsheets() et spreadsheets().values().
+
+    `calls` compte les appels exécutés par méthode, `http_requests` les
+    allers-retours et `cells_written` les cellules écrites ou effacées.
+    Comme l'API, spreadsheets().batchUpdate est atomique : si une requête du
+    lot échoue, le classeur est laissé intact. Chaque feuille a une grille
+    (1000 x 26 à la création, comme l'API) : updateCells ne peut pas écrire
+    au-delà, alors que values().update et batchUpdate l'agrandissent.
+    """
+
+    def __init__(self, sheet_names=(), latency=0.0):
+        # titre -> {"sheetId": int, "rows": [[...], ...], "grid": {"rowCount": int, "columnCount": int}}
+        self.sheets = {}
+        self.next_sheet_id = 1
+        self.calls = Counter()
+        self.http_requests = 0
+        self.bytes_sent = 0
+        self.cells_written = 0
+        self.latency = latency
+        # Simulation de panne : la N-ième écriture ou effacement lève une erreur 503
+        self.fail_at = None
+        self.mutations = 0
+        for name in sheet_names:
+            self.add_sheet(name)
+
+    # ---- Accès direct (préparation et vérification des benchmarks) ----
+    def add_sheet(self, title, sheet_id=None, grid=None):
+        if title in self.sheets:
+            raise HttpError(FakeHttpResponse(400), f'{{"error": "Sheet {title} already exists"}}'.encode())
+        if sheet_id is None:
+            sheet_id = self.next_sheet_id
+        if any(sheet["sheetId"] == sheet_id for sheet in self.sheets.values()):
+            raise HttpError(FakeHttpResponse(400), f'{{"error": "Sheet id {sheet_id} already exists"}}'.encode())
+        self.sheets[title] = {"sheetId": sheet_id, "rows": [],
+                              "grid": dict({"rowCount": DEFAULT_GRID_ROWS, "columnCount": DEFAULT_GRID_COLUMNS},
+                                           **(grid or {}))}
+        self.next_sheet_id = max(self.next_sheet_id, sheet_id) + 1
+        return sheet_id
+
+    def title_for_id(self, sheet_id):
+        for title, sheet in self.sheets.items():
+            if sheet["sheetId"] == sheet_id:
+                return title
+        raise HttpError(FakeHttpResponse(400), f'{{"error": "No grid with id: {sheet_id}"}}'.encode())
+
+    def rows(self, title):
+        """Contenu de la feuille, sans les lignes et cellules vides de fin (comme l'API)."""
+        rows = [list(row) for row in self.sheets[title]["rows"]]
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def check_grid(self, title, row_end, col_end):
+        """Erreur 400 de l'API si la plage dépasse la grille de la feuille."""
+        grid = self.sheets[title]["grid"]
+        if row_end > grid["rowCount"] or col_end > grid["columnCount"]:
+            raise HttpError(FakeHttpResponse(400), (
+                f'{{"error": "Range ({title}!R{row_end}C{col_end}) exceeds grid limits. '
+                f'Max rows: {grid["rowCount"]}, max columns: {grid["columnCount"]}"}}').encode())
+
+    def _sheet(self, title):
+        if title not in self.sheets:
+            raise HttpError(FakeHttpResponse(400), f'{{"error": "Unable to parse range: {title}"}}'.encode())
+        return self.sheets[title]["rows"]
+
+    def read_range(self, a1_range):
+        title, row0, col0, row1, col1 = parse_a1_range(a1_range)
+        self._sheet(title)
+        values = [row[col0:col1] for row in self.rows(title)[row0:row1]]
+        while values and not values[-1]:
+            values.pop()
+        return {"range": a1_range, "majorDimension": "ROWS", "values": values} if values else {"range": a1_range}
+
+    def _mutate(self):
+        self.mutations += 1
+        if self.mutations == self.fail_at:
+            raise HttpError(FakeHttpResponse(503), b'{"error": {"code": 503}}')
+
+    def write_range(self, a1_range, values, user_entered=False):
+        """Écrit `values` à partir du coin de `a1_range` ; avec `user_entered`, les valeurs
+        sont interprétées comme une saisie (valueInputOption="USER_ENTERED")."""
+        if user_entered:
+            values = [[_user_entered(value) for value in row] for row in values]
+        title, row0, col0, _, _ = parse_a1_range(a1_range)
+        rows = self._sheet(title)
+        self._mutate()
+        # L'API des valeurs agrandit la grille si nécessaire
+        grid = self.sheets[title]["grid"]
+        grid["rowCount"] = max(grid["rowCount"], row0 + len(values))
+        grid["columnCount"] = max(grid["columnCount"], col0 + max((len(row) for row in values), default=0))
+        for offset, row_values in enumerate(values):
+            while len(rows) <= row0 + offset:
+                rows.append([])
+            row = rows[row0 + offset]
+            if len(row) < col0 + len(row_values):
+                row.extend([""] * (col0 + len(row_values) - len(row)))
+            row[col0:col0 + len(row_values)] = [str(value) for value in row_values]
+            self.cells_written += len(row_values)
+
+    def clear_range(self, a1_range):
+        title, row0, col0, row1, col1 = parse_a1_range(a1_range)
+        self.clear_cells(title, row0, col0, row1, col1)
+
+    def clear_cells(self, title, row0, col0, row1, col1):
+        rows = self._sheet(title)
+        self._mutate()
+        for row in rows[row0:row1]:
+            end = len(row) if col1 is None else min(col1, len(row))
+            for column in range(col0, end):
+                if row[column] != "":
+                    row[column] = ""
+                    self.cells_written += 1
+
+    # ---- Ressources de l'API ----
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+
+class FakeSpreadsheets:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        def run():
+            self.sheets.calls["spreadsheets.get"] += 1
+            return {"spreadsheetId": spreadsheetId, "sheets": [
+                {"properties": {"sheetId": sheet["sheetId"], "title": title, "gridProperties": dict(sheet["grid"])}}
+                for title, sheet in self.sheets.sheets.items()
+            ]}
+        return FakeRequest(run, self.sheets, fields)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            self.sheets.calls["spreadsheets.batchUpdate"] += 1
+            # Atomicité : les requêtes sont appliquées sur une copie, conservée seulement si tout réussit
+            state = ("sheets", "next_sheet_id", "cells_written")
+            snapshot = copy.deepcopy([getattr(self.sheets, name) for name in state])
+            try:
+                replies = [self._apply(request) for request in body.get("requests", [])]
+            except Exception:
+                for name, value in zip(state, snapshot):
+                    setattr(self.sheets, name, value)
+                raise
+            return {"spreadsheetId": spreadsheetId, "replies": replies}
+        return FakeRequest(run, self.sheets)
+
+    def _apply(self, request):
+        if "addSheet" in request:
+            properties = request["addSheet"]["properties"]
+            sheet_id = self.sheets.add_sheet(properties["title"], properties.get("sheetId"),
+                                             properties.get("gridProperties"))
+            return {"addSheet": {"properties": {"sheetId": sheet_id, "title": properties["title"],
+                                                "gridProperties": dict(self.sheets.sheets[properties["title"]]["grid"])}}}
+        if "appendDimension" in request:
+            append = request["appendDimension"]
+            grid = self.sheets.sheets[self.sheets.title_for_id(append["sheetId"])]["grid"]
+            grid["rowCount" if append["dimension"] == "ROWS" else "columnCount"] += append["length"]
+            return {}
+        if "updateCells" in request:
+            update = request["updateCells"]
+            if update.get("fields") != "userEnteredValue":
+                raise ValueError(f"Champs non pris en charge par le faux service : {update.get('fields')}")
+            if "range" in update:
+                grid = update["range"]
+                title = self.sheets.title_for_id(grid["sheetId"])
+                row0, col0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+                self.sheets.check_grid(title, grid.get("endRowIndex", 0), grid.get("endColumnIndex", 0))
+                # Les cellules de la plage non couvertes par `rows` sont effacées
+                self.sheets.clear_cells(title, row0, col0, grid.get("endRowIndex"), grid.get("endColumnIndex"))
+            else:
+                start = update["start"]
+                title = self.sheets.title_for_id(start["sheetId"])
+                row0, col0 = start.get("rowIndex", 0), start.get("columnIndex", 0)
+            values = [
+                [cell.get("userEnteredValue", {}).get("stringValue", "") for cell in row.get("values", [])]
+                for row in update.get("rows", [])
+            ]
+            self.sheets.check_grid(title, row0 + len(values), col0 + max((len(row) for row in values), default=0))
+            column = chr(ord("A") + col0)
+            for offset, row in enumerate(values):
+                if row:
+                    self.sheets.write_range(f"'{title}'!{column}{row0 + offset + 1}", [row])
+            return {}
+        raise ValueError(f"Requête non prise en charge par le faux service : {list(request)}")
+
+    def values(self):
+        return FakeValues(self.sheets)
+
+
+class FakeValues:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def run():
+            self.sheets.calls["values.get"] += 1
+            return self.sheets.read_range(range)
+        return FakeRequest(run, self.sheets)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        def run():
+            self.sheets.calls["values.batchGet"] += 1
+            return {"spreadsheetId": spreadsheetId,
+                    "valueRanges": [self.sheets.read_range(a1_range) for a1_range in ranges]}
+        return FakeRequest(run, self.sheets)
+
+    def clear(self, spreadsheetId, range, body=None, **kwargs):
+        def run():
+            self.sheets.calls["values.clear"] += 1
+            self.sheets.clear_range(range)
+            return {"spreadsheetId": spreadsheetId, "clearedRange": range}
+        return FakeRequest(run, self.sheets)
+
+    def update(self, spreadsheetId, range, body, valueInputOption=None, **kwargs):
+        def run():
+            self.sheets.calls["values.update"] += 1
+            self.sheets.write_range(range, body["values"], user_entered=valueInputOption == "USER_ENTERED")
+            return {"spreadsheetId": spreadsheetId, "updatedRange": range}
+        return FakeRequest(run, self.sheets)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            self.sheets.calls["values.batchUpdate"] += 1
+            user_entered = body.get("valueInputOption") == "USER_ENTERED"
+            for value_range in body["data"]:
+                self.sheets.write_range(value_range["range"], value_range["values"], user_entered)
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedRanges": len(body["data"])}
+        return FakeRequest(run, self.sheets)
+
+
+# -------------------------------------------------------------
+# FAUSSES NOTIFICATIONS PUSH (PUB/SUB)
+# -------------------------------------------------------------
+def make_pubsub_push(history_id, email_address="me@example.com", message_id="1"):
+    """Corps d'une notification Gmail envoyée par un abonnement Pub/Sub push."""
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {"data": base64.b64encode(data.encode()).decode(), "messageId": str(message_id),
+                    "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        "subscription": "projects/fake/subscriptions/gmail-push"
+    }
+
+
+def send_pubsub_push(endpoint, history_id, message_id="1"):
+    """POST d'une notification sur `endpoint`, comme Pub/Sub ; renvoie le code HTTP."""
+    body = json.dumps(make_pubsub_push(history_id, message_id=message_id)).encode()
+    request = urllib.request.Request(endpoint, data=body, headers={"Content-Type": "application/json"},
+                                     method="POST")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+# -------------------------------------------------------------
+# FAUX POINT D'ACCÈS OAUTH (ACTUALISATION DU JETON)
+# -------------------------------------------------------------
+class FakeTokenHandler(BaseHTTPRequestHandler):
+    """Répond aux requêtes grant_type=refresh_token comme oauth2.googleapis.com/token."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        with self.server.lock:
+            self.server.refresh_count += 1
+        if form.get("grant_type") != "refresh_token" or form.get("refresh_token") in self.server.revoked:
+            status, payload = 400, {"error": "invalid_grant", "error_description": "Token has been expired or revoked."}
+        else:
+            status, payload = 200, {
+                "access_token": f"fake-access-{self.server.refresh_count}",
+                "expires_in": 3599,
+                "scope": form.get("scope", ""),
+                "token_type": "Bearer"
+            }
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_token_server(revoked=()):
+    """Démarre le faux point d'accès OAuth dans un thread et renvoie (server, token_uri).
+
+    Les jetons d'actualisation de `revoked` sont refusés (invalid_grant).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTokenHandler)
+    server.revoked = set(revoked)
+    server.refresh_count = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/token"
@@ -0,0 +1,296 @@
+import csv
+import json
+import random
+import re
+import socket
+import threading
+import time
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from responses import CATEGORIES, URGENCY_LEVELS
+
+# -------------------------------------------------------------
+# FAUX SERVEUR CHAT-COMPLETIONS (COMPATIBLE MISTRAL)
+# -------------------------------------------------------------
+# Réponse renvoyée par défaut pour chaque email
+DEFAULT_ANSWER = {
+    "categorie": "Demande de support utilisateur",
+    "urgence": "Faible",
+    "synthese": "Réponse simulée par le faux serveur.",
+    "confiance": 0.9
+}
+# Confiance déclarée des réponses enregistrées
+CANNED_CONFIDENCE = 0.95
+
+
+# Marqueur des emails dans les prompts par lot (voir emails.BATCH_EMAIL_TEMPLATE)
+BATCH_EMAIL_PATTERN = re.compile(r"^### Email id=(\S+)$", re.MULTILINE)
+# Sujet d'un email du prompt : la ligne qui suit le marqueur (lot) ou "Email :" (unitaire)
+BATCH_SUBJECT_PATTERN = re.compile(r"^### Email id=\S+\nSujet : (.*)$", re.MULTILINE)
+SUBJECT_PATTERN = re.compile(r"^Email :\nSujet : (.*)$", re.MULTILINE)
+
+
+# Écarts de forme d'un vrai modèle (noise_rate) : libellés approchés ou hors liste...
+LABEL_NOISE = ("apostrophe", "casse", "faute", "hors_liste")
+# ... et texte autour du JSON ou réponse coupée, que le mode JSON de l'API évite
+FORMAT_NOISE = ("bloc", "texte", "tronquee")
+
+
+def _strip_accents(text):
+    return "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+
+
+def add_label_noise(answer, style):
+    """Copie de la réponse avec un libellé déformé selon `style` (voir LABEL_NOISE)."""
+    answer = dict(answer)
+    if style == "apostrophe":
+        answer["categorie"] = answer["categorie"].replace("’", "'")
+        answer["urgence"] = answer["urgence"].upper()
+    elif style == "casse":
+        answer["categorie"] = _strip_accents(answer["categorie"]).lower()
+        answer["urgence"] = _strip_accents(answer["urgence"]).lower()
+    elif style == "faute":
+        middle = len(answer["categorie"]) // 2
+        answer["categorie"] = answer["categorie"][:middle] + answer["categorie"][middle + 1:]
+    elif style == "hors_liste":
+        answer["categorie"] = "Question générale"
+    return answer
+
+
+def add_format_noise(text, style):
+    """Réponse texte déformée selon `style` (voir FORMAT_NOISE)."""
+    if style == "bloc":
+        return f"```json\n{text}\n```"
+    if style == "texte":
+        return f"Voici la classification demandée :\n{text}\nN'hésitez pas si besoin."
+    if style == "tronquee":
+        return text[:len(text) // 2]
+    return text
+
+
+def normalize_subject(subject):
+    # Espaces normalisés : le repliage des en-têtes longs (mbox, .eml) peut les modifier
+    return " ".join(subject.split())
+
+
+def load_canned_answers(filename="ground_truth.csv"):
+    """Réponses enregistrées par sujet, tirées de la vérité terrain."""
+    answers = {}
+    with open(filename, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # Premier libellé rencontré pour un sujet en double
+            answers.setdefault(normalize_subject(row["subjects"]), {
+                "categorie": row["categories"].replace("'", "’"),
+                "urgence": row["urgence"],
+                "synthese": "Réponse enregistrée (ground_truth.csv).",
+                "confiance": CANNED_CONFIDENCE
+            })
+    return answers
+
+
+class FakeChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # File d'attente TCP assez longue pour les benchmarks très concurrents
+    request_queue_size = 128
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """Simule POST /v1/chat/completions avec latence, limitation de débit et pannes."""
+
+    # Connexions persistantes, comme l'API réelle
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # En-têtes et corps sont écrits séparément : sans TCP_NODELAY, Nagle et
+        # l'ACK retardé ajoutent ~40 ms à chaque réponse sur une connexion persistante
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = json.loads(self.rfile.read(length) or b"{}")
+
+        with server.lock:
+            server.request_count += 1
+
+        if server.auth_fail:
+            self._send_json(401, {"message": "Unauthorized"})
+            return
+
+        if server.stall_rate and random.random() < server.stall_rate:
+            # Connexion bloquée : le client doit abandonner par délai dépassé
+            with server.lock:
+                server.stalled_count += 1
+            time.sleep(server.stall_seconds)
+        model = request_body.get("model")
+        profile = server.model_profiles.get(model)
+        time.sleep(profile["latency"] if profile else server.latency)
+        if profile:
+            with server.lock:
+                server.model_requests[model] = server.model_requests.get(model, 0) + 1
+
+        if server.error_rate and random.random() < server.error_rate:
+            with server.lock:
+                server.error_count += 1
+            self._send_json(503, {"message": "Service unavailable"})
+            return
+
+        if server.throttle_rate and random.random() < server.throttle_rate:
+            with server.lock:
+                server.throttled_count += 1
+            self._send_json(429, {"message": "Requests rate limit exceeded"},
+                            {"Retry-After": str(server.retry_after)})
+            return
+
+        prompt = "".join(message.get("content", "") for message in request_body.get("messages", []))
+        json_mode = request_body.get("response_format", {}).get("type") == "json_object"
+        batch_ids = BATCH_EMAIL_PATTERN.findall(prompt)
+        if batch_ids:
+            subjects = BATCH_SUBJECT_PATTERN.findall(prompt)
+            items = [dict(self._noisy(self._answer(subject, model)), id=email_id)
+                     for email_id, subject in zip(batch_ids, subjects)]
+            if server.truncate_rate and random.random() < server.truncate_rate:
+                # Simule une réponse tronquée : le dernier email manque
+                items = items[:-1]
+            answer = json.dumps(items, ensure_ascii=False)
+        else:
+            subject = SUBJECT_PATTERN.search(prompt)
+            answer = json.dumps(self._noisy(self._answer(subject.group(1) if subject else "", model)),
+                                ensure_ascii=False)
+        if server.noise_rate and not json_mode and random.random() < server.noise_rate:
+            with server.lock:
+                server.noisy_count += 1
+            answer = add_format_noise(answer, random.choice(FORMAT_NOISE))
+
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(answer) // 4 + 1
+        with server.lock:
+            server.prompt_tokens += prompt_tokens
+        self._send_json(200, {
+            "id": "fake-completion",
+            "object": "chat.completion",
+            "model": request_body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def _answer(self, subject, model=None):
+        answer = self.server.answers.get(normalize_subject(subject), DEFAULT_ANSWER)
+        profile = self.server.model_profiles.get(model)
+        if profile is None:
+            return answer
+        # Profil de modèle : erreurs et confiance tirées de façon reproductible par (modèle, sujet)
+        rng = random.Random(f"{model}|{normalize_subject(subject)}")
+        if rng.random() < profile["accuracy"]:
+            return dict(answer, confiance=round(rng.uniform(*profile.get("right_confidence", (0.6, 1.0))), 2))
+        wrong = dict(answer, confiance=round(rng.uniform(*profile.get("wrong_confidence", (0.3, 0.85))), 2))
+        field, labels = rng.choice((("categorie", CATEGORIES), ("urgence", URGENCY_LEVELS)))
+        wrong[field] = rng.choice([label for label in labels if label != answer[field]])
+        return wrong
+
+    def _noisy(self, answer):
+        server = self.server
+        if not server.noise_rate or random.random() >= server.noise_rate:
+            return answer
+        with server.lock:
+            server.noisy_count += 1
+        return add_label_noise(answer, random.choice(LABEL_NOISE))
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Pas de log par requête : on pollue sinon la sortie des benchmarks
+        pass
+
+
+def start_fake_server(latency=0.05, throttle_rate=0.0, retry_after=0.1, truncate_rate=0.0,
+                      error_rate=0.0, stall_rate=0.0, stall_seconds=5.0, auth_fail=False, port=0,
+                      answers=None, noise_rate=0.0, model_profiles=None):
+    """Démarre le faux serveur dans un thread et renvoie (server, url).
+
+    - `throttle_rate` / `error_rate` : proportion de réponses 429 / 503 ;
+    - `stall_rate` : proportion de requêtes bloquées `stall_seconds` secondes ;
+    - `auth_fail` : toutes les requêtes sont refusées (401, clé invalide) ;
+    - `truncate_rate` : proportion de réponses par lot renvoyées avec un email en moins ;
+    - `answers` : réponses par sujet (voir load_canned_answers), DEFAULT_ANSWER sinon ;
+    - `noise_rate` : proportion de libellés déformés et, hors mode JSON
+      (response_format), de réponses entourées de texte ou coupées ;
+    - `model_profiles` : par nom de modèle, {"latency", "accuracy"} et les
+      intervalles de confiance déclarée des bonnes et mauvaises réponses
+      ("right_confidence", "wrong_confidence") ; `model_requests` compte
+      les requêtes de ces modèles.
+    """
+    server = FakeChatServer(("127.0.0.1", port), FakeChatHandler)
+    server.latency = latency
+    server.throttle_rate = throttle_rate
+    server.retry_after = retry_after
+    server.truncate_rate = truncate_rate
+    server.error_rate = error_rate
+    server.stall_rate = stall_rate
+    server.stall_seconds = stall_seconds
+    server.auth_fail = auth_fail
+    server.answers = answers or {}
+    server.noise_rate = noise_rate
+    server.model_profiles = model_profiles or {}
+    server.model_requests = {}
+    server.noisy_count = 0
+    server.error_count = 0
+    server.stalled_count = 0
+    server.request_count = 0
+    server.prompt_tokens = 0
+    server.throttled_count = 0
+    server.lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Faux serveur chat-completions pour les runs hors ligne.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latence par requête (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de réponses 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Proportion de réponses 429")
+    parser.add_argument("--noise-rate", type=float, default=0.0,
+                        help="Proportion de réponses mal formées (libellés approchés, texte autour du JSON)")
+    parser.add_argument("--answers", default="ground_truth.csv",
+                        help="CSV de vérité terrain fournissant les réponses par sujet ('' pour la réponse par défaut)")
+    args = parser.parse_args()
+    server, url = start_fake_server(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        noise_rate=args.noise_rate,
+        port=args.port,
+        answers=load_canned_answers(args.answers) if args.answers else None
+    )
+    print(f"Faux serveur prêt : MISTRAL_API_URL={url} (Ctrl+C pour arrêter)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,273 @@
+import json
+import os
+import time
+
+from googleapiclient.errors import HttpError
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Dernier historyId vu + emails déjà classifiés (synchronisation incrémentale)
+SYNC_STATE_PATH = os.getenv("GMAIL_SYNC_STATE_PATH", "gmail_sync_state.json")
+
+# Gmail accepte au plus 100 appels par requête batch (50 recommandés pour éviter les 429)
+BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "100"))
+# Taille de page maximale de messages().list
+LIST_PAGE_SIZE = 500
+# Nombre de passes pour les messages rejetés (429) à l'intérieur d'un batch
+MAX_BATCH_RETRIES = 3
+
+# Masques de réponse : seuls l'id, le sujet et le texte des parties sont utilisés.
+# Les métadonnées des pièces jointes (attachmentId, size, partId) ne sont pas
+# téléchargées ; filename et les en-têtes des sous-parties (charset,
+# Content-Disposition) servent à l'extraction du corps. `metadataHeaders` ne
+# s'applique qu'au format "metadata", sans corps : on garde donc les en-têtes
+# de premier niveau en format "full". Le paramètre fields n'a pas de forme
+# récursive : le masque est déroulé sur MAX_PART_DEPTH niveaux de parties, de
+# quoi couvrir les transferts imbriqués (les parties plus profondes sont coupées).
+LIST_FIELDS = "messages/id,nextPageToken"
+MAX_PART_DEPTH = 12
+_PART_FIELDS = "mimeType,filename,headers,body/data"
+
+
+def _parts_mask(depth):
+    return f"{_PART_FIELDS},parts({_parts_mask(depth - 1)})" if depth else _PART_FIELDS
+
+
+MESSAGE_FIELDS = f"id,historyId,labelIds,payload({_parts_mask(MAX_PART_DEPTH)})"
+
+
+class HistoryExpiredError(Exception):
+    """Le historyId enregistré est trop ancien : une synchronisation complète est nécessaire."""
+
+# -------------------------------------------------------------
+# ÉTAT DE SYNCHRONISATION
+# -------------------------------------------------------------
+class SyncState:
+    """historyId Gmail du dernier passage et magasin local des emails traités.
+
+    `messages` associe l'id Gmail à l'email classifié, du plus récent au plus ancien.
+    """
+
+    def __init__(self, path=SYNC_STATE_PATH, history_id=None, messages=None):
+        self.path = path
+        self.history_id = history_id
+        self.messages = messages or {}
+
+    @classmethod
+    def load(cls, path=SYNC_STATE_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        except json.JSONDecodeError:
+            print(f"Erreur: Le fichier '{path}' n'est pas un JSON valide. Synchronisation complète.")
+            return cls(path)
+        return cls(path, data.get("history_id"), data.get("messages", {}))
+
+    def add_newest(self, records):
+        """Place les emails nouvellement classifiés en tête du magasin."""
+        merged = {record["id"]: record for record in records}
+        for msg_id, record in self.messages.items():
+            merged.setdefault(msg_id, record)
+        self.messages = merged
+
+    def save(self):
+        # Écriture atomique : un arrêt brutal ne corrompt pas l'état précédent
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"history_id": self.history_id, "messages": self.messages}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+# -------------------------------------------------------------
+# STATISTIQUES DE TÉLÉCHARGEMENT
+# -------------------------------------------------------------
+class FetchStats:
+    """Compte les allers-retours HTTP et la taille des réponses Gmail.
+
+    googleapiclient ne transmet que le JSON décodé (pas la réponse HTTP, ni
+    celle d'un batch) : `json_bytes` est la taille de ce JSON réencodé, sans
+    en-têtes ni compression, et non le volume transféré.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.messages = 0
+        self.json_bytes = 0
+
+    def record(self, response, requests=0):
+        self.requests += requests
+        self.json_bytes += len(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+    def __str__(self):
+        return (f"Gmail : {self.requests} requêtes HTTP, {self.messages} messages, "
+                f"{self.json_bytes / 1024:.1f} Kio de JSON décodé")
+
+# -------------------------------------------------------------
+# APPELS GMAIL
+# -------------------------------------------------------------
+def current_history_id(service):
+    """historyId actuel de la boîte, à enregistrer avant de lister les messages."""
+    profile = service.users().getProfile(userId="me").execute()
+    return profile["historyId"]
+
+
+def iter_message_id_pages(service, max_results=500, stats=None, query=None):
+    """Produit les ids des derniers messages page par page, en suivant nextPageToken.
+
+    `max_results=None` parcourt toute la boîte. `query` : filtre de recherche
+    Gmail (ex: "after:1704067200 before:1706745600" pour une plage de dates).
+    """
+    listed = 0
+    page_token = None
+    while max_results is None or listed < max_results:
+        page_size = LIST_PAGE_SIZE if max_results is None else min(max_results - listed, LIST_PAGE_SIZE)
+        with metrics.timer("gmail_list"):
+            results = service.users().messages().list(
+                userId="me",
+                maxResults=page_size,
+                pageToken=page_token,
+                q=query,
+                fields=LIST_FIELDS
+            ).execute()
+        if stats is not None:
+            stats.record(results, requests=1)
+        page = [msg["id"] for msg in results.get("messages", [])]
+        listed += len(page)
+        if page:
+            yield page
+
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+
+def list_message_ids(service, max_results=500, stats=None, query=None):
+    """Liste les ids des derniers messages, au-delà de 500 en suivant nextPageToken."""
+    return [msg_id for page in iter_message_id_pages(service, max_results, stats, query) for msg_id in page]
+
+
+def get_message(service, msg_id, stats=None):
+    """Récupère un message complet (un aller-retour HTTP)."""
+    with metrics.timer("gmail_get"):
+        msg_data = service.users().messages().get(
+            userId="me",
+            id=msg_id,
+            format="full",
+            fields=MESSAGE_FIELDS
+        ).execute()
+    if stats is not None:
+        stats.record(msg_data, requests=1)
+        stats.messages += 1
+    return msg_data
+
+
+def get_messages_batched(service, msg_ids, batch_size=BATCH_SIZE, stats=None, unfetched=None):
+    """Récupère les messages par requêtes batch HTTP de `batch_size` appels.
+
+    Générateur : les messages sont produits dans l'ordre de `msg_ids`, batch
+    par batch. Les appels rejetés à l'intérieur d'un batch (429, 5xx) sont
+    rejoués dans un batch suivant après une courte attente ; si `unfetched`
+    est une liste, les ids encore rejetés après MAX_BATCH_RETRIES passes y
+    sont ajoutés (à récupérer plus tard).
+    """
+    msg_ids = list(msg_ids)
+    for start in range(0, len(msg_ids), batch_size):
+        chunk = msg_ids[start:start + batch_size]
+        fetched = {}
+        remaining = chunk
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            failed = []
+
+            def on_response(request_id, response, exception):
+                if exception is not None:
+                    failed.append((request_id, exception))
+                    return
+                fetched[request_id] = response
+                if stats is not None:
+                    stats.record(response)
+                    stats.messages += 1
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for msg_id in remaining:
+                batch.add(
+                    service.users().messages().get(
+                        userId="me",
+                        id=msg_id,
+                        format="full",
+                        fields=MESSAGE_FIELDS
+                    ),
+                    request_id=msg_id
+                )
+            with metrics.timer("gmail_batch"):
+                batch.execute()
+            if stats is not None:
+                stats.requests += 1
+
+            remaining = []
+            for msg_id, err in failed:
+                if _is_retryable(err) and attempt < MAX_BATCH_RETRIES:
+                    metrics.inc("gmail_retries")
+                    remaining.append(msg_id)
+                elif _is_retryable(err) and unfetched is not None:
+                    metrics.inc("errors", category="gmail_get")
+                    print(f"Message {msg_id} toujours indisponible ({err}) : nouvel essai plus tard.")
+                    unfetched.append(msg_id)
+                else:
+                    metrics.inc("errors", category="gmail_get")
+                    # Erreur définitive (ex: message supprimé entre le listing et le get) : on ignore le message
+                    print(f"Impossible de récupérer le message {msg_id} : {err}")
+            if not remaining:
+                break
+            time.sleep(2 ** attempt)
+
+        for msg_id in chunk:
+            if msg_id in fetched:
+                yield fetched[msg_id]
+
+
+def _is_retryable(err):
+    status = getattr(getattr(err, "resp", None), "status", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def list_added_message_ids(service, start_history_id):
+    """Renvoie (ids des messages ajoutés depuis `start_history_id`, nouveau historyId).
+
+    Lève HistoryExpiredError si Gmail ne conserve plus cet historique (HTTP 404).
+    """
+    added_ids = []
+    seen = set()
+    history_id = start_history_id
+    page_token = None
+    while True:
+        try:
+            response = service.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                pageToken=page_token
+            ).execute()
+        except HttpError as err:
+            if err.resp.status == 404:
+                raise HistoryExpiredError(start_history_id) from err
+            raise
+
+        for record in response.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added["message"]["id"]
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    added_ids.append(msg_id)
+        history_id = response.get("historyId", history_id)
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    # L'historique est chronologique : on renvoie les plus récents d'abord, comme messages().list
+    added_ids.reverse()
+    return added_ids, history_id
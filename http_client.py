@@ -0,0 +1,234 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from rate_limit import parse_retry_after
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Délais (secondes) : établissement de connexion, lecture d'une réponse,
+# et durée totale d'un appel, nouvelles tentatives comprises
+CONNECT_TIMEOUT = float(os.getenv("MISTRAL_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("MISTRAL_READ_TIMEOUT", "60"))
+TOTAL_TIMEOUT = float(os.getenv("MISTRAL_TOTAL_TIMEOUT", "180"))
+# Connexions persistantes conservées dans le pool (au moins le nombre de threads)
+POOL_SIZE = int(os.getenv("MISTRAL_POOL_SIZE", "32"))
+# Nouvelles tentatives sur 429, 5xx, délai dépassé ou connexion perdue
+MAX_RETRIES = int(os.getenv("MISTRAL_MAX_RETRIES", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Disjoncteur : nombre d'échecs consécutifs avant ouverture, et durée d'ouverture
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("MISTRAL_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("MISTRAL_CIRCUIT_RESET", "30"))
+# Après une clé refusée, un appel d'essai est tenté au bout de ce délai (clé renouvelée,
+# refus temporaire) : utile aux processus de longue durée (daemon.py)
+CIRCUIT_FATAL_RESET_TIMEOUT = float(os.getenv("MISTRAL_CIRCUIT_FATAL_RESET", "600"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Erreurs de transport retentées (délai, connexion perdue, réponse interrompue ou illisible) ;
+# les autres erreurs requests (redirections en boucle, URL invalide...) comptent comme un échec
+RETRYABLE_ERRORS = (
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+# Clé refusée : inutile de retenter tant que la configuration n'a pas changé
+FATAL_STATUS = {401, 403}
+
+
+class CircuitOpenError(Exception):
+    """Le disjoncteur est ouvert : l'appel n'est pas envoyé."""
+
+# -------------------------------------------------------------
+# DISJONCTEUR
+# -------------------------------------------------------------
+class CircuitBreaker:
+    """Coupe les appels après des échecs répétés ou une clé API refusée.
+
+    - Après `failure_threshold` échecs consécutifs (5xx, délais), les appels
+      sont refusés pendant `reset_timeout` secondes, puis un appel d'essai
+      est autorisé.
+    - Un refus d'authentification (401/403) ouvre le disjoncteur pendant
+      `fatal_reset_timeout` secondes (de quoi couvrir un run : chaque email
+      restant échouerait de la même façon), puis un appel d'essai est autorisé.
+      Si cet essai échoue sans refus de la clé (5xx, délai), le disjoncteur
+      reste ouvert `reset_timeout` secondes, comme après des échecs répétés.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 fatal_reset_timeout=CIRCUIT_FATAL_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fatal_reset_timeout = fatal_reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.fatal_reason = None
+        self.fatal_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Lève CircuitOpenError si l'appel est refusé ; renvoie True pour l'appel d'essai
+        (à conclure par record_success, record_failure ou end_probe)."""
+        with self.lock:
+            if self.fatal_reason:
+                if time.monotonic() - self.fatal_at < self.fatal_reset_timeout or self.probing:
+                    raise CircuitOpenError(self.fatal_reason)
+            elif self.opened_at is None:
+                return False
+            elif time.monotonic() - self.opened_at < self.reset_timeout or self.probing:
+                raise CircuitOpenError(f"{self.failures} échecs consécutifs de l'API Mistral")
+            # Demi-ouvert : un seul appel d'essai
+            self.probing = True
+            return True
+
+    def end_probe(self):
+        """Libère l'appel d'essai s'il s'est terminé sans succès ni échec enregistré."""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.fatal_reason = None
+            self.probing = False
+
+    def record_failure(self, fatal_reason=None):
+        with self.lock:
+            self.probing = False
+            if fatal_reason:
+                self.fatal_reason = fatal_reason
+                self.fatal_at = time.monotonic()
+                return
+            self.failures += 1
+            if self.fatal_reason:
+                # Essai après une clé refusée, échoué sans nouveau refus : l'API est en panne,
+                # ouverture ordinaire (nouvel essai dans reset_timeout secondes)
+                self.fatal_reason = None
+                self.opened_at = time.monotonic()
+            elif self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def open_reason(self):
+        """Motif d'ouverture du disjoncteur (ouvert ou en attente d'un appel d'essai réussi), ou None."""
+        with self.lock:
+            if self.fatal_reason:
+                return self.fatal_reason
+            if self.opened_at is not None:
+                return f"{self.failures} échecs consécutifs de l'API Mistral"
+            return None
+
+# -------------------------------------------------------------
+# CLIENT HTTP MISTRAL
+# -------------------------------------------------------------
+class MistralClient:
+    """Client chat-completions réutilisable : connexions persistantes (keep-alive),
+    délais par requête et total, nouvelles tentatives avec attente exponentielle
+    aléatoire, limitation de débit partagée et disjoncteur.
+    """
+
+    def __init__(self, url, api_key, limiter=None, pool_size=None, connect_timeout=None,
+                 read_timeout=None, total_timeout=None, max_retries=None, breaker=None):
+        # Valeurs par défaut lues à la création : la configuration du module peut être ajustée avant
+        self.url = url
+        self.api_key = api_key
+        self.limiter = limiter
+        self.connect_timeout = CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = READ_TIMEOUT if read_timeout is None else read_timeout
+        self.total_timeout = TOTAL_TIMEOUT if total_timeout is None else total_timeout
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size or POOL_SIZE))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def chat(self, payload):
+        """POST du payload ; renvoie la dernière réponse HTTP reçue.
+
+        Lève CircuitOpenError si le disjoncteur est ouvert, ou l'exception
+        requests si toutes les tentatives ont échoué sans réponse.
+        """
+        try:
+            probe = self.breaker.before_call()
+        except CircuitOpenError:
+            metrics.inc("circuit_open_rejections")
+            raise
+        try:
+            return self._send(payload)
+        finally:
+            if probe:
+                # Appel d'essai interrompu sans bilan (exception imprévue) : le disjoncteur
+                # ne doit pas rester ouvert pour le reste du processus
+                self.breaker.end_probe()
+
+    def _send(self, payload):
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            remaining = deadline - time.monotonic()
+            try:
+                with metrics.timer("llm_http"):
+                    response = self.session.post(
+                        self.url,
+                        json=payload,
+                        timeout=(self.connect_timeout, max(0.1, min(self.read_timeout, remaining)))
+                    )
+            except RETRYABLE_ERRORS as err:
+                response, error = None, err
+            except requests.exceptions.RequestException:
+                self.breaker.record_failure()
+                raise
+            else:
+                error = None
+                if response.status_code in FATAL_STATUS:
+                    self.breaker.record_failure(fatal_reason=f"clé API refusée (HTTP {response.status_code})")
+                    return response
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+
+            delay = self._backoff(attempt, response)
+            if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                break
+            with self.lock:
+                self.retries += 1
+            metrics.inc("llm_retries", reason=type(error).__name__ if response is None else response.status_code)
+            if response is not None and response.status_code == 429:
+                print(f"Limite de débit Mistral atteinte (429), nouvelle tentative dans {delay:.1f}s.")
+                if self.limiter is not None:
+                    # Tous les threads attendent, pas seulement celui qui a reçu le 429
+                    self.limiter.pause(delay)
+                    continue
+            time.sleep(delay)
+
+        self.breaker.record_failure()
+        if response is None:
+            raise error
+        return response
+
+    def _backoff(self, attempt, response):
+        """Délai avant la tentative suivante : Retry-After s'il est fourni,
+        sinon attente exponentielle avec gigue complète."""
+        if response is not None and response.headers.get("Retry-After"):
+            return parse_retry_after(response.headers["Retry-After"])
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def close(self):
+        self.session.close()
@@ -1,29 +1,16 @@
-import json
-import csv
+from results_store import JSON_RESULTS_PATH, RESULTS_DB_PATH, export_csv
 
 # ---- INPUT / OUTPUT FILES ----
-json_file = "emails_classified.json"
+# Les résultats sont lus en flux depuis le magasin SQLite (voir results_store.py) ;
+# un magasin absent ou vide est d'abord rempli depuis emails_classified.json
+db_file = RESULTS_DB_PATH
 csv_file = "emails_classified.csv"
 
-# ---- LOAD JSON ----
-with open(json_file, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
 # ---- WRITE CSV ----
-with open(csv_file, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-
-    # CSV HEADER
-    writer.writerow(["id", "categorie", "subject", "urgence", "synthese"])
-
-    # ROWS WITH AUTO-INCREMENT ID
-    for i, item in enumerate(data, start=1):
-        writer.writerow([
-            i,
-            item.get("categorie", ""),
-            item.get("subject", ""),
-            item.get("urgence", ""),
-            item.get("synthese", "")
-        ])
+# Colonnes : id (id Gmail), categorie, subject, urgence, synthese
+count = export_csv(csv_file, db_file)
 
-print("✔️ CSV file created:", csv_file)
+if count:
+    print("✔️ CSV file created:", csv_file, f"({count} emails)")
+else:
+    print(f"Aucun résultat dans '{db_file}' ni dans '{JSON_RESULTS_PATH}' : '{csv_file}' n'a pas été modifié.")
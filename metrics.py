@@ -0,0 +1,187 @@
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Active la collecte dès l'import (sinon via --metrics ou metrics.enable())
+METRICS_ENABLED = os.getenv("RUN_METRICS", "0") == "1"
+METRIC_PREFIX = "emails_pipeline"
+
+_NULL_TIMER = contextlib.nullcontext()
+
+# -------------------------------------------------------------
+# COLLECTE DES MÉTRIQUES DU RUN
+# -------------------------------------------------------------
+class Metrics:
+    """Chronomètres par étape, compteurs et consommation de tokens d'un run.
+
+    Désactivé, chaque appel se résume à un test de booléen : `timer()`
+    renvoie un gestionnaire de contexte vide partagé et `inc()` ne fait rien.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.durations = defaultdict(list)
+            self.counters = defaultdict(int)
+            self.tokens = defaultdict(int)
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    # ---- Enregistrement ----
+    def timer(self, stage):
+        """Gestionnaire de contexte mesurant la durée d'une étape."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def inc(self, name, value=1, **labels):
+        """Incrémente un compteur, éventuellement étiqueté (ex: category="ERREUR API")."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def add_usage(self, usage, model=None):
+        """Ajoute le champ `usage` d'une réponse Mistral au total de tokens."""
+        if not self.enabled or not usage:
+            return
+        with self.lock:
+            for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                self.tokens[field] += usage.get(field, 0) or 0
+            if model:
+                for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                    self.tokens[f"{field}:{model}"] += usage.get(field, 0) or 0
+
+    # ---- Rapport ----
+    def report(self):
+        """Rapport du run sous forme de dictionnaire sérialisable en JSON."""
+        with self.lock:
+            stages = {stage: _summarize(values) for stage, values in self.durations.items()}
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                if labels:
+                    counters.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = value
+                else:
+                    counters[name] = value
+            return {
+                "started_at": self.started_at,
+                "wall_seconds": round(time.time() - self.started_at, 3),
+                "stages": stages,
+                "counters": counters,
+                "tokens": dict(self.tokens),
+            }
+
+    def to_prometheus(self):
+        """Rapport au format texte d'exposition Prometheus."""
+        lines = []
+        with self.lock:
+            durations = {stage: list(values) for stage, values in self.durations.items()}
+            counters = dict(self.counters)
+            tokens = dict(self.tokens)
+
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines.append(f"# TYPE {name} summary")
+        for stage, values in sorted(durations.items()):
+            summary = _summarize(values)
+            for quantile in ("p50", "p95", "p99"):
+                q = int(quantile[1:]) / 100
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {summary[quantile]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {summary["total"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+
+        typed = set()
+        for (counter, labels), value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{counter}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+        metric = f"{METRIC_PREFIX}_llm_tokens_total"
+        lines.append(f"# TYPE {metric} counter")
+        by_model = []
+        for field, value in sorted(tokens.items()):
+            kind, _, model = field.partition(":")
+            if model:
+                by_model.append((model, kind, value))
+            else:
+                lines.append(f'{metric}{{kind="{kind.replace("_tokens", "")}"}} {value}')
+        metric = f"{METRIC_PREFIX}_llm_model_tokens_total"
+        lines.append(f"# TYPE {metric} counter")
+        for model, kind, value in by_model:
+            lines.append(f'{metric}{{model="{_escape(model)}",kind="{kind.replace("_tokens", "")}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename, fmt="json"):
+        """Écrit le rapport (json ou prometheus) et renvoie le chemin."""
+        with open(filename, "w", encoding="utf-8") as f:
+            if fmt == "prometheus":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.report(), f, ensure_ascii=False, indent=4)
+        return filename
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _percentile(sorted_values, q):
+    # Méthode du rang le plus proche
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _summarize(values):
+    ordered = sorted(values)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "total": round(total, 6),
+        "mean": round(total / len(ordered), 6) if ordered else 0.0,
+        "p50": round(_percentile(ordered, 0.50), 6) if ordered else 0.0,
+        "p95": round(_percentile(ordered, 0.95), 6) if ordered else 0.0,
+        "p99": round(_percentile(ordered, 0.99), 6) if ordered else 0.0,
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+# Instance partagée par tous les modules du pipeline
+metrics = Metrics()
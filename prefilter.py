@@ -0,0 +1,187 @@
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedGroupKFold
+from sklearn.pipeline import make_pipeline, make_union
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Probabilité "Anodine" au-delà de laquelle l'email n'est pas envoyé au LLM
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", "0.9"))
+GROUND_TRUTH_PATH = "ground_truth.csv"
+# Modèle enregistré avec les classifications décidées localement (voir results_store.py)
+PREFILTER_MODEL = "prefilter-tfidf"
+
+# En-têtes conservés par emails.parse_message pour les heuristiques
+PREFILTER_HEADERS = (
+    "From",
+    "List-Unsubscribe",
+    "List-Id",
+    "Auto-Submitted",
+    "Precedence",
+    "X-Autoreply",
+    "X-Autorespond",
+)
+# Libellés Gmail des onglets de masse
+BULK_LABELS = {"CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL"}
+AUTO_REPLY_SUBJECT = re.compile(
+    r"^\s*(réponse automatique|automatic reply|auto[- ]?reply|out of office|absence du bureau|"
+    r"accusé de réception)\b",
+    re.IGNORECASE
+)
+
+# -------------------------------------------------------------
+# HEURISTIQUES D'EN-TÊTES
+# -------------------------------------------------------------
+def header_reason(mail):
+    """Renvoie la raison pour laquelle l'email est manifestement automatique, ou None.
+
+    Les en-têtes List-Id et les expéditeurs "noreply" seuls ne suffisent pas :
+    les alertes de supervision, parfois critiques, les utilisent aussi.
+    """
+    headers = {name.lower(): value for name, value in mail.get("headers", {}).items()}
+    auto_submitted = headers.get("auto-submitted", "").strip().lower()
+    if auto_submitted and auto_submitted != "no":
+        return "réponse automatique (Auto-Submitted)"
+    if "x-autoreply" in headers or "x-autorespond" in headers:
+        return "réponse automatique"
+    if AUTO_REPLY_SUBJECT.match(mail.get("subject", "")):
+        return "réponse automatique (sujet)"
+    if "list-unsubscribe" in headers:
+        return "newsletter (List-Unsubscribe)"
+    if headers.get("precedence", "").strip().lower() in ("bulk", "junk"):
+        return "envoi de masse (Precedence)"
+    if BULK_LABELS & set(mail.get("labels", [])):
+        return "onglet Promotions / Réseaux sociaux"
+    return None
+
+# -------------------------------------------------------------
+# MODÈLE TF-IDF LOCAL
+# -------------------------------------------------------------
+def _make_model():
+    features = make_union(
+        TfidfVectorizer(analyzer="word", ngram_range=(1, 2), sublinear_tf=True),
+        TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True),
+    )
+    return make_pipeline(features, LogisticRegression(max_iter=2000, C=5.0))
+
+
+def _text(mail):
+    """Texte évalué par le modèle : le sujet seul, comme à l'entraînement (ground_truth.csv
+    ne contient pas de corps ; un corps de newsletter noierait les n-grammes du sujet)."""
+    return mail.get("subject", "")
+
+
+class PreClassifier:
+    """Pré-classifieur local exécuté avant l'appel Mistral.
+
+    Renvoie une classification "Anodine" sans appel LLM quand les en-têtes
+    trahissent un envoi automatique, ou quand le modèle TF-IDF entraîné sur
+    ground_truth.csv est suffisamment confiant. Sinon renvoie None.
+    """
+
+    def __init__(self, urgency_model, category_model, threshold=PREFILTER_THRESHOLD):
+        self.urgency_model = urgency_model
+        self.category_model = category_model
+        self.threshold = threshold
+        self.anodine_index = list(urgency_model.classes_).index("Anodine")
+        self.seen = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def train(cls, texts, urgencies, categories, threshold=PREFILTER_THRESHOLD):
+        urgency_model = _make_model().fit(texts, urgencies)
+        category_model = _make_model().fit(texts, categories)
+        return cls(urgency_model, category_model, threshold)
+
+    @classmethod
+    def from_ground_truth(cls, filename=None, threshold=PREFILTER_THRESHOLD):
+        gt = load_ground_truth(filename or GROUND_TRUTH_PATH)
+        return cls.train(gt["subjects"], gt["urgence"], gt["categories"], threshold)
+
+    def classify(self, mail):
+        """Classification locale de l'email, ou None s'il doit partir au LLM."""
+        with metrics.timer("prefilter"):
+            return self._classify(mail)
+
+    def _classify(self, mail):
+        text = _text(mail)
+        reason = header_reason(mail)
+        confidence = 1.0
+        if reason is None:
+            confidence = self.urgency_model.predict_proba([text])[0][self.anodine_index]
+            if confidence < self.threshold:
+                with self.lock:
+                    self.seen += 1
+                return None
+            reason = f"modèle local, confiance {confidence:.2f}"
+
+        with self.lock:
+            self.seen += 1
+            self.skipped += 1
+        metrics.inc("prefilter_skipped")
+        return {
+            "categorie": self.category_model.predict([text])[0],
+            "urgence": "Anodine",
+            "synthese": f"Email classé Anodine sans appel LLM ({reason}).",
+            "confiance": round(float(confidence), 3),
+            "modele": PREFILTER_MODEL
+        }
+
+    def stats(self):
+        ratio = self.skipped / self.seen if self.seen else 0.0
+        return f"Pré-classifieur local : {self.skipped}/{self.seen} appels LLM évités ({ratio:.0%})"
+
+# -------------------------------------------------------------
+# ÉVALUATION SUR LA VÉRITÉ TERRAIN
+# -------------------------------------------------------------
+def load_ground_truth(filename=GROUND_TRUTH_PATH):
+    gt = pd.read_csv(filename)
+    # Harmonise les apostrophes droites / typographiques des catégories
+    gt["categories"] = gt["categories"].str.replace("'", "’", regex=False)
+    return gt
+
+
+def evaluate(filename=GROUND_TRUTH_PATH, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9), folds=5):
+    """Validation croisée : part des appels évités et exactitude des décisions locales."""
+    gt = load_ground_truth(filename)
+    # Même texte qu'à l'inférence (voir _text)
+    texts = np.array([_text({"subject": subject}) for subject in gt["subjects"]], dtype=object)
+    urgencies = gt["urgence"].to_numpy()
+    categories = gt["categories"].to_numpy()
+
+    # Probabilité "Anodine" et catégorie prédites hors échantillon
+    anodine_proba = np.zeros(len(gt))
+    predicted_category = np.empty(len(gt), dtype=object)
+    # Les sujets en double restent dans le même pli : sinon l'exactitude est surestimée
+    groups = gt["subjects"].str.strip().str.lower().to_numpy()
+    splitter = StratifiedGroupKFold(n_splits=folds, shuffle=True, random_state=0)
+    for train_idx, test_idx in splitter.split(texts, urgencies, groups):
+        model = PreClassifier.train(texts[train_idx], urgencies[train_idx], categories[train_idx])
+        anodine_proba[test_idx] = model.urgency_model.predict_proba(texts[test_idx])[:, model.anodine_index]
+        predicted_category[test_idx] = model.category_model.predict(texts[test_idx])
+
+    print(f"{len(gt)} emails, validation croisée à {folds} plis (groupés par sujet)")
+    print("seuil  appels évités  exactitude urgence  exactitude catégorie")
+    for threshold in thresholds:
+        skipped = anodine_proba >= threshold
+        count = int(skipped.sum())
+        if count:
+            urgency_acc = float((urgencies[skipped] == "Anodine").mean())
+            category_acc = float((categories[skipped] == predicted_category[skipped]).mean())
+            print(f"{threshold:5.2f}  {count:4d} ({count / len(gt):5.1%})  {urgency_acc:18.1%}  {category_acc:20.1%}")
+        else:
+            print(f"{threshold:5.2f}     0 ( 0.0%)                   -                     -")
+
+
+if __name__ == "__main__":
+    evaluate()
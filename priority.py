@@ -0,0 +1,84 @@
+import heapq
+import os
+import re
+import unicodedata
+
+from prefilter import BULK_LABELS, header_reason
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Nombre d'emails lus d'avance et réordonnés par priorité (un batch Gmail par défaut :
+# au-delà, la classification attendrait le listing de toute la boîte)
+PRIORITY_WINDOW = int(os.getenv("PRIORITY_WINDOW", "100"))
+# Expéditeurs prioritaires : adresses ou domaines ("@exemple.fr"), séparés par des virgules
+PRIORITY_SENDERS = [sender.strip().lower() for sender in os.getenv("PRIORITY_SENDERS", "").split(",")
+                    if sender.strip()]
+# Caractères du corps examinés (le sujet l'est toujours en entier)
+PRIORITY_BODY_CHARS = 1000
+
+# Mots-clés d'incident et poids (comparés sans accents ni majuscules)
+KEYWORD_WEIGHTS = {
+    "urgent": 3, "urgence": 3, "critique": 3, "immédiat": 2, "asap": 2,
+    "incident": 3, "panne": 3, "arrêt": 2, "interruption": 2, "indisponible": 2, "indisponibilité": 2,
+    "hors service": 3, "bloqué": 2, "bloquant": 2, "perte de données": 4, "down": 2, "outage": 3,
+    "sécurité": 2, "fuite": 4, "faille": 4, "attaque": 4, "piratage": 4, "intrusion": 4, "compromis": 3,
+    "phishing": 3, "hameçonnage": 3, "rançongiciel": 4, "ransomware": 4, "virus": 3,
+}
+# Un mot-clé du sujet pèse plus qu'un mot-clé du corps
+SUBJECT_FACTOR = 2
+LABEL_WEIGHTS = {"IMPORTANT": 3, "STARRED": 2, "CATEGORY_UPDATES": -1, "CATEGORY_FORUMS": -2}
+LABEL_WEIGHTS.update({label: -4 for label in BULK_LABELS})
+SENDER_WEIGHT = 3
+# Réponse automatique, newsletter, envoi de masse (voir prefilter.header_reason)
+AUTOMATED_WEIGHT = -5
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+_FOLDED_WEIGHTS = {_fold(keyword): weight for keyword, weight in KEYWORD_WEIGHTS.items()}
+KEYWORD_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(keyword) for keyword in sorted(_FOLDED_WEIGHTS, key=len, reverse=True)) + r")\b"
+)
+
+# -------------------------------------------------------------
+# SCORE DE PRIORITÉ
+# -------------------------------------------------------------
+def priority_score(mail):
+    """Score de priorité d'un email avant classification (plus élevé = plus urgent).
+
+    Calcul local et immédiat : mots-clés d'incident du sujet et du début du
+    corps (chacun compté une fois), libellés Gmail (IMPORTANT, onglets),
+    expéditeurs de PRIORITY_SENDERS et en-têtes d'envoi automatique.
+    """
+    subject_keywords = set(KEYWORD_PATTERN.findall(_fold(mail.get("subject", ""))))
+    body_keywords = set(KEYWORD_PATTERN.findall(_fold(mail.get("body", "")[:PRIORITY_BODY_CHARS])))
+    score = SUBJECT_FACTOR * sum(_FOLDED_WEIGHTS[keyword] for keyword in subject_keywords)
+    score += sum(_FOLDED_WEIGHTS[keyword] for keyword in body_keywords - subject_keywords)
+    score += sum(LABEL_WEIGHTS.get(label, 0) for label in mail.get("labels", []))
+    sender = mail.get("headers", {}).get("From", "").lower()
+    if any(priority_sender in sender for priority_sender in PRIORITY_SENDERS):
+        score += SENDER_WEIGHT
+    if header_reason(mail) is not None:
+        score += AUTOMATED_WEIGHT
+    return score
+
+
+def iter_by_priority(emails, window=PRIORITY_WINDOW):
+    """Générateur : réordonne les emails par score décroissant.
+
+    Les `window` premiers emails sont lus d'avance ; ensuite, chaque email lu
+    fait sortir le plus prioritaire de la fenêtre. À score égal, l'ordre
+    d'arrivée est conservé. Le score est ajouté à l'email (`priority`).
+    """
+    heap = []
+    for position, mail in enumerate(emails):
+        mail["priority"] = priority_score(mail)
+        heapq.heappush(heap, (-mail["priority"], position, mail))
+        if len(heap) >= max(1, window):
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
@@ -0,0 +1,66 @@
+import threading
+import time
+
+# -------------------------------------------------------------
+# LIMITEUR DE DÉBIT PARTAGÉ (TOKEN BUCKET)
+# -------------------------------------------------------------
+class TokenBucket:
+    """Limiteur de débit à jetons, partagé entre tous les threads de classification.
+
+    `rate` jetons sont ajoutés chaque seconde, jusqu'à `capacity`.
+    Quand l'API répond 429, `pause()` suspend tous les appelants
+    pendant la durée indiquée par l'en-tête Retry-After.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """Bloque jusqu'à ce qu'un jeton soit disponible, puis le consomme.
+
+        Avec `rate` <= 0 (débit illimité), seule une pause (429) fait attendre.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Suspend toutes les acquisitions pendant `seconds` (réponse 429)."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # Le seau repart vide pour ne pas relancer une rafale à la reprise
+            self.tokens = 0.0
+            self.updated_at = max(now, self.paused_until)
+
+
+def parse_retry_after(value, default=1.0):
+    """Convertit un en-tête Retry-After (en secondes) en délai d'attente."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # Format date HTTP : on ne le parse pas, on applique le délai par défaut
+        return default
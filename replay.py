@@ -0,0 +1,205 @@
+import argparse
+import csv
+import json
+import mailbox
+import os
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+
+from emails import parse_message
+from extraction import clean_body, html_to_text
+from fake_google import make_gmail_message
+from prefilter import PREFILTER_HEADERS
+from sinks import iter_jsonl
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+GROUND_TRUTH_PATH = "ground_truth.csv"
+# Libellés Gmail exportés par Google Takeout dans les fichiers mbox
+GMAIL_LABELS_HEADER = "X-Gmail-Labels"
+
+# -------------------------------------------------------------
+# LECTURE D'UN CORPUS LOCAL (MBOX, .EML, DUMP GMAIL)
+# -------------------------------------------------------------
+def message_to_email(msg, fallback_id):
+    """Convertit un message `email` au format de emails.parse_message."""
+    msg_id = (msg.get("Message-ID") or "").strip().strip("<>") or fallback_id
+    headers = {name: str(msg[name]) for name in PREFILTER_HEADERS if msg[name] is not None}
+    labels = [label.strip() for label in str(msg.get(GMAIL_LABELS_HEADER, "")).split(",") if label.strip()]
+
+    body = ""
+    part = msg.get_body(preferencelist=("plain", "html"))
+    if part is not None:
+        try:
+            body = part.get_content()
+        except (LookupError, UnicodeDecodeError):
+            # Jeu de caractères inconnu ou mal déclaré
+            body = part.get_payload(decode=True).decode("utf-8", errors="replace")
+        if part.get_content_subtype() == "html":
+            body = html_to_text(body)
+    return {
+        "id": msg_id,
+        "subject": str(msg.get("Subject", "")),
+        "body": clean_body(body),
+        "labels": labels,
+        "headers": headers
+    }
+
+
+def iter_mbox(path):
+    """Emails d'un fichier mbox (ex: export Google Takeout)."""
+    box = mailbox.mbox(path, factory=lambda f: BytesParser(policy=policy.default).parse(f), create=False)
+    try:
+        for index, msg in enumerate(box):
+            yield message_to_email(msg, f"mbox-{index}")
+    finally:
+        box.close()
+
+
+def iter_eml_dir(path):
+    """Emails d'un répertoire de fichiers .eml, par ordre de nom de fichier."""
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".eml"):
+            continue
+        with open(os.path.join(path, name), "rb") as f:
+            msg = BytesParser(policy=policy.default).parse(f)
+        yield message_to_email(msg, os.path.splitext(name)[0])
+
+
+def iter_gmail_dump(path):
+    """Emails d'un dump de réponses messages.get(format="full") de l'API Gmail :
+    tableau JSON (.json) ou une réponse par ligne (.jsonl)."""
+    if path.endswith(".jsonl"):
+        records = iter_jsonl(path)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    for msg_data in records:
+        yield parse_message(msg_data)
+
+
+def iter_corpus(path):
+    """Emails d'un corpus local, au format déduit du chemin."""
+    if os.path.isdir(path):
+        return iter_eml_dir(path)
+    if path.endswith((".json", ".jsonl")):
+        return iter_gmail_dump(path)
+    return iter_mbox(path)
+
+# -------------------------------------------------------------
+# CONSTRUCTION D'UN CORPUS À PARTIR DE LA VÉRITÉ TERRAIN
+# -------------------------------------------------------------
+def iter_ground_truth_emails(filename=GROUND_TRUTH_PATH, repeat=1):
+    """(id, sujet, corps) des emails de ground_truth.csv, répétés `repeat` fois."""
+    with open(filename, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    for copy_index in range(repeat):
+        for row in rows:
+            msg_id = row["ids"] if copy_index == 0 else f"{row['ids']}_r{copy_index}"
+            body = f"Bonjour,\n\n{row['subjects']}.\nMerci de revenir vers moi rapidement.\n\nCordialement,\n"
+            yield msg_id, row["subjects"], body
+
+
+def build_corpus(path, filename=GROUND_TRUTH_PATH, repeat=1):
+    """Écrit un corpus rejouable : mbox, répertoire .eml ou dump Gmail (.json/.jsonl)
+    selon `path`. Renvoie le nombre d'emails écrits."""
+    count = 0
+    if path.endswith((".json", ".jsonl")):
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                f.write("[\n")
+            for msg_id, subject, body in iter_ground_truth_emails(filename, repeat):
+                record = json.dumps(make_gmail_message(msg_id, subject, body, 1000 + count), ensure_ascii=False)
+                if path.endswith(".json"):
+                    record = (",\n" if count else "") + record
+                else:
+                    record += "\n"
+                f.write(record)
+                count += 1
+            if path.endswith(".json"):
+                f.write("\n]\n")
+        return count
+
+    is_mbox = not path.endswith(os.sep) and os.path.splitext(path)[1] == ".mbox"
+    if is_mbox:
+        box = mailbox.mbox(path)
+        box.lock()
+    else:
+        os.makedirs(path, exist_ok=True)
+    try:
+        for msg_id, subject, body in iter_ground_truth_emails(filename, repeat):
+            msg = EmailMessage()
+            msg["From"] = "utilisateur@example.com"
+            msg["To"] = "support@example.com"
+            msg["Subject"] = subject
+            msg["Message-ID"] = f"<{msg_id}>"
+            msg.set_content(body)
+            if is_mbox:
+                box.add(msg)
+            else:
+                # Préfixe de position : ground_truth.csv contient quelques ids en double
+                with open(os.path.join(path, f"{count:06d}-{msg_id}.eml"), "wb") as f:
+                    f.write(msg.as_bytes(policy=policy.SMTP))
+            count += 1
+    finally:
+        if is_mbox:
+            box.flush()
+            box.unlock()
+            box.close()
+    return count
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rejoue le pipeline sur un corpus local, sans Gmail.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Construit un corpus à partir de ground_truth.csv")
+    build.add_argument("path", help="fichier .mbox, .json/.jsonl (dump Gmail) ou répertoire .eml")
+    build.add_argument("--repeat", type=int, default=1, help="Nombre de copies de la vérité terrain")
+
+    run = subparsers.add_parser("run", help="Classifie un corpus local (résultats dans emails_classified.json)")
+    run.add_argument("path", help="fichier .mbox, .json/.jsonl (dump Gmail) ou répertoire .eml")
+    run.add_argument("--batch-size", type=int, default=None)
+    run.add_argument("--no-prefilter", action="store_true")
+    run.add_argument("--no-dedup", action="store_true")
+    run.add_argument("--no-priority", action="store_true")
+    run.add_argument("--metrics", choices=["json", "prometheus"])
+    run.add_argument("--stub-llm", action="store_true",
+                     help="Démarre le faux serveur LLM (réponses de ground_truth.csv) au lieu de l'API Mistral")
+    run.add_argument("--latency", type=float, default=0.05, help="Latence du faux serveur (s)")
+    run.add_argument("--error-rate", type=float, default=0.0, help="Proportion de 503 du faux serveur")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        count = build_corpus(args.path, repeat=args.repeat)
+        print(f"{count} emails écrits dans '{args.path}'.")
+    else:
+        import emails
+        from fake_llm import load_canned_answers, start_fake_server
+        from rate_limit import TokenBucket
+
+        server = None
+        if args.stub_llm:
+            server, emails.MISTRAL_URL = start_fake_server(
+                latency=args.latency,
+                error_rate=args.error_rate,
+                answers=load_canned_answers(GROUND_TRUTH_PATH)
+            )
+            emails.MISTRAL_KEY = "stub-key"
+            emails.rate_limiter = TokenBucket(rate=0)
+        try:
+            emails.process_all_emails(
+                batch_size=args.batch_size,
+                prefilter=not args.no_prefilter,
+                metrics_format=args.metrics,
+                source=iter_corpus(args.path),
+                dedup=not args.no_dedup,
+                priority=not args.no_priority
+            )
+        finally:
+            if server is not None:
+                server.shutdown()
@@ -0,0 +1,147 @@
+import difflib
+import json
+import re
+import unicodedata
+
+from metrics import metrics
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Valeurs autorisées (celles du prompt, voir emails.PROMPT_PREAMBLE, et de sheet.CATEGORY_SHEET_MAP)
+CATEGORIES = (
+    "Problème technique informatique",
+    "Demande administrative",
+    "Problème d’accès / authentification",
+    "Demande de support utilisateur",
+    "Bug ou dysfonctionnement d’un service",
+)
+URGENCY_LEVELS = ("Critique", "Élevée", "Modérée", "Faible", "Anodine")
+# Similarité minimale (difflib) entre un libellé renvoyé et une valeur autorisée.
+# Prudent : un libellé attribué à tort coûte plus cher qu'une relance.
+LABEL_CUTOFF = 0.8
+
+# Motifs d'échec (réponse inexploitable), repris dans la relance ciblée
+PROBLEMS = {
+    "json": "elle ne contient aucun objet JSON valide.",
+    "categorie": "la catégorie n'est pas l'une des catégories autorisées.",
+    "urgence": "l'urgence n'est pas l'un des niveaux autorisés.",
+}
+
+FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+NON_WORD = re.compile(r"[\W_]+")
+_DECODER = json.JSONDecoder()
+
+# -------------------------------------------------------------
+# EXTRACTION DU JSON
+# -------------------------------------------------------------
+def extract_json(text, kind=dict):
+    """Premier objet (`kind=dict`) ou tableau (`kind=list`) JSON de la réponse ; None si aucun.
+
+    Accepte le JSON entouré de texte ou d'un bloc ```json, et les virgules
+    finales. Un tableau enveloppé dans un objet ({"emails": [...]}) est
+    trouvé avec `kind=list`.
+    """
+    if not isinstance(text, str):
+        return None
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    else:
+        if isinstance(value, kind):
+            return value
+
+    opener = "{" if kind is dict else "["
+    candidates = [match.group(1) for match in FENCE.finditer(text)] + [text]
+    for candidate in candidates:
+        for attempt in (candidate, TRAILING_COMMA.sub(r"\1", candidate)):
+            start = attempt.find(opener)
+            while start != -1:
+                try:
+                    value, _ = _DECODER.raw_decode(attempt, start)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    if isinstance(value, kind):
+                        metrics.inc("response_repairs", kind="json")
+                        return value
+                start = attempt.find(opener, start + 1)
+    return None
+
+# -------------------------------------------------------------
+# NORMALISATION DES LIBELLÉS
+# -------------------------------------------------------------
+def fold(label):
+    """Libellé comparable : minuscules, sans accents, apostrophes et ponctuation ignorées."""
+    text = unicodedata.normalize("NFKD", label.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(NON_WORD.sub(" ", text).split())
+
+
+class LabelSet:
+    """Ramène un libellé renvoyé par le modèle à l'une des valeurs autorisées."""
+
+    def __init__(self, labels, cutoff=LABEL_CUTOFF):
+        self.labels = set(labels)
+        self.folded = {fold(label): label for label in labels}
+        self.cutoff = cutoff
+
+    def match(self, value):
+        """Valeur autorisée correspondant à `value` (casse, accents, apostrophe ’ ou ',
+        ponctuation, fautes de frappe) ; None si aucune n'est assez proche."""
+        if not isinstance(value, str):
+            return None
+        if value in self.labels:
+            return value
+        folded = fold(value)
+        if folded in self.folded:
+            return self.folded[folded]
+        close = difflib.get_close_matches(folded, self.folded, n=1, cutoff=self.cutoff)
+        return self.folded[close[0]] if close else None
+
+
+CATEGORY_LABELS = LabelSet(CATEGORIES)
+URGENCY_LABELS = LabelSet(URGENCY_LEVELS)
+
+# -------------------------------------------------------------
+# VALIDATION DES CLASSIFICATIONS
+# -------------------------------------------------------------
+def validate_classification(data):
+    """(classification normalisée, None) ou (None, motif d'échec, clé de PROBLEMS).
+
+    Les clés sont comparées sans accents ni majuscules ("catégorie" vaut "categorie").
+    Une confiance absente ou non numérique est omise.
+    """
+    if not isinstance(data, dict):
+        return None, "json"
+    fields = {fold(str(key)): value for key, value in data.items()}
+    categorie = CATEGORY_LABELS.match(fields.get("categorie"))
+    if categorie is None:
+        return None, "categorie"
+    urgence = URGENCY_LABELS.match(fields.get("urgence"))
+    if urgence is None:
+        return None, "urgence"
+    if categorie != fields.get("categorie") or urgence != fields.get("urgence"):
+        metrics.inc("response_repairs", kind="libellé")
+    synthese = fields.get("synthese")
+    classification = {
+        "categorie": categorie,
+        "urgence": urgence,
+        "synthese": synthese if isinstance(synthese, str) else ("" if synthese is None else str(synthese))
+    }
+    # Confiance déclarée par le modèle (0 à 1), utilisée par la cascade de modèles
+    try:
+        classification["confiance"] = min(1.0, max(0.0, float(fields["confiance"])))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return classification, None
+
+
+def parse_classification(content):
+    """Classification d'une réponse unitaire : (classification, None) ou (None, motif)."""
+    data = extract_json(content)
+    if data is None:
+        return None, "json"
+    return validate_classification(data)
@@ -0,0 +1,397 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sinks import write_json_array
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", "emails_classified.sqlite3")
+# Résultats antérieurs au magasin, importés une fois dans un magasin absent ou vide (voir open_results)
+JSON_RESULTS_PATH = "emails_classified.json"
+# En-tête du CSV exporté (colonnes de l'ancien jsontocsv.py ; id = id Gmail), puis la boîte
+# d'origine des runs multi-boîtes (coordinator.py)
+CSV_COLUMNS = ["id", "categorie", "subject", "urgence", "synthese", "mailbox"]
+
+# Une ligne par classification : une reclassification ajoute une ligne, rien n'est réécrit
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS runs (
+           run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           started_at REAL NOT NULL,
+           full INTEGER NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS results (
+           seq INTEGER PRIMARY KEY AUTOINCREMENT,
+           run_id INTEGER NOT NULL REFERENCES runs (run_id),
+           message_id TEXT NOT NULL,
+           categorie TEXT NOT NULL,
+           urgence TEXT NOT NULL,
+           subject TEXT NOT NULL,
+           synthese TEXT NOT NULL,
+           cluster_id TEXT,
+           model TEXT,
+           classified_at REAL NOT NULL,
+           latency_ms REAL,
+           position INTEGER,
+           mailbox TEXT
+       )""",
+    # Dernière ligne fusionnée de chaque shard (voir ResultsStore.merge_from)
+    """CREATE TABLE IF NOT EXISTS merges (
+           source TEXT PRIMARY KEY,
+           last_seq INTEGER NOT NULL
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_results_message ON results (message_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_results_categorie ON results (categorie, urgence)",
+    "CREATE INDEX IF NOT EXISTS idx_results_urgence ON results (urgence)",
+)
+# Colonnes ajoutées depuis la création du schéma (ALTER TABLE sur une base existante)
+ADDED_COLUMNS = (("position", "INTEGER"), ("mailbox", "TEXT"))
+
+# Résultats courants : dernière classification de chaque email (id Gmail dans sa boîte),
+# depuis le dernier run complet (un run incrémental complète les résultats précédents,
+# un run complet les remplace)
+COLUMNS = ("run_id", "seq", "message_id", "categorie", "subject", "urgence", "synthese", "cluster_id", "model",
+           "classified_at", "latency_ms", "position", "mailbox")
+CURRENT_RESULTS_IN = """
+    SELECT * FROM {schema}.results AS r
+    WHERE run_id >= (SELECT COALESCE(MAX(run_id), 0) FROM {schema}.runs WHERE full = 1)
+      AND seq = (SELECT MAX(seq) FROM {schema}.results WHERE message_id = r.message_id AND mailbox IS r.mailbox)
+"""
+CURRENT_RESULTS = CURRENT_RESULTS_IN.format(schema="main")
+# Colonnes recopiées telles quelles lors d'une fusion (voir ResultsStore.merge_from)
+MERGED_COLUMNS = ("message_id", "categorie", "urgence", "subject", "synthese", "cluster_id", "model",
+                  "classified_at", "latency_ms")
+
+INSERT_RESULT = (
+    "INSERT INTO results (run_id, message_id, categorie, urgence, subject, synthese, "
+    "cluster_id, model, classified_at, latency_ms, position, mailbox) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# -------------------------------------------------------------
+# MAGASIN DES RÉSULTATS (SQLITE)
+# -------------------------------------------------------------
+class ResultsStore:
+    """Résultats de classification dans une base SQLite indexée, en ajout seul.
+
+    Chaque run enregistre ses classifications au fil de l'eau ; les exports
+    (JSON, CSV, Google Sheets) parcourent les résultats courants avec un
+    curseur, sans charger toute la base en mémoire.
+    """
+
+    def __init__(self, path=RESULTS_DB_PATH):
+        self.path = path
+        self.run_id = None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL : une validation par résultat ne force pas d'écriture disque synchrone,
+        # et un export peut lire pendant qu'un run écrit
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(results)")}
+        for column, column_type in ADDED_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+        self.conn.commit()
+
+    # ---- Écriture ----
+    def start_run(self, full=True, resume=False):
+        """Ouvre un run (complet ou incrémental) ; avec `resume`, poursuit le dernier run."""
+        with self.lock:
+            if resume:
+                row = self.conn.execute("SELECT MAX(run_id) FROM runs").fetchone()
+                if row[0] is not None:
+                    self.run_id = row[0]
+                    return self.run_id
+            cursor = self.conn.execute(
+                "INSERT INTO runs (started_at, full) VALUES (?, ?)", (time.time(), int(full))
+            )
+            self.conn.commit()
+            self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def _row(self, record, model=None, latency_ms=None, position=None):
+        return (self.run_id, record["id"], record.get("categorie", ""), record.get("urgence", ""),
+                record.get("subject", ""), record.get("synthese", ""), record.get("cluster_id"),
+                model, time.time(), latency_ms, position, record.get("mailbox"))
+
+    def append(self, record, model=None, latency_ms=None, position=None):
+        """Ajoute la classification d'un email (format des enregistrements de emails.py).
+
+        `position` : rang de l'email dans la récupération Gmail ; les exports
+        suivent cet ordre, quel que soit l'ordre de classification.
+        """
+        if self.run_id is None:
+            self.start_run()
+        with self.lock:
+            self.conn.execute(INSERT_RESULT, self._row(record, model, latency_ms, position))
+            self.conn.commit()
+
+    def import_records(self, records):
+        """Enregistre des résultats existants (emails_classified.json) dans un nouveau
+        run complet, en une transaction ; renvoie leur nombre.
+
+        Un enregistrement sans id reçoit sa position (1, 2, ...), comme dans
+        l'ancien emails_classified.csv.
+        """
+        self.start_run(full=True)
+        rows = [
+            self._row(dict(record, id=str(record.get("id") or position)), record.get("modele"), position=position)
+            for position, record in enumerate(records, 1)
+        ]
+        with self.lock:
+            self.conn.executemany(INSERT_RESULT, rows)
+            self.conn.commit()
+        return len(rows)
+
+    def merge_from(self, path, mailbox=None, source=None, since_last=False):
+        """Ajoute au run courant les résultats courants d'un autre magasin (shard
+        de coordinator.py), dans leur ordre de traitement ; renvoie leur nombre.
+
+        Date de classification, modèle et latence d'origine sont conservés ;
+        les lignes reçoivent la boîte `mailbox`, et les positions du shard
+        sont décalées à la suite de celles du run, de sorte que les exports
+        listent les shards l'un après l'autre.
+        `source` identifie le shard : sa dernière ligne fusionnée est retenue
+        et, avec `since_last`, seules les lignes plus récentes sont fusionnées
+        (run incrémental : l'historique du shard n'est pas refusionné).
+        """
+        if self.run_id is None:
+            self.start_run()
+        columns = ", ".join(MERGED_COLUMNS)
+        with self.lock:
+            offset = self.conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM results WHERE run_id = ?", (self.run_id,)
+            ).fetchone()[0]
+            row = self.conn.execute("SELECT last_seq FROM merges WHERE source = ?", (source,)).fetchone()
+            last_seq = row[0] if row is not None and since_last else 0
+            self.conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                shard_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM shard.results").fetchone()[0]
+                if shard_seq < last_seq:
+                    # Magasin du shard recréé depuis la dernière fusion : tout est nouveau
+                    last_seq = 0
+                cursor = self.conn.execute(
+                    f"INSERT INTO results (run_id, {columns}, position, mailbox) "
+                    f"SELECT ?, {columns}, ? + COALESCE(position, seq), ? "
+                    f"FROM ({CURRENT_RESULTS_IN.format(schema='shard')}) WHERE seq > ? "
+                    f"ORDER BY run_id, position, seq",
+                    (self.run_id, offset, mailbox, last_seq)
+                )
+                if source is not None:
+                    self.conn.execute("INSERT OR REPLACE INTO merges (source, last_seq) VALUES (?, ?)",
+                                      (source, shard_seq))
+                self.conn.commit()
+            finally:
+                self.conn.execute("DETACH DATABASE shard")
+        return cursor.rowcount
+
+    # ---- Lecture ----
+    @staticmethod
+    def _current(categorie=None, urgence=None):
+        query, params = CURRENT_RESULTS, []
+        if categorie is not None:
+            query += " AND categorie = ?"
+            params.append(categorie)
+        if urgence is not None:
+            query += " AND urgence = ?"
+            params.append(urgence)
+        return query, params
+
+    def iter_columns(self, columns, categorie=None, urgence=None):
+        """Tuples `columns` des résultats courants, filtrés par catégorie et/ou urgence.
+
+        Du run le plus récent au plus ancien, dans l'ordre de récupération
+        (`position`) à l'intérieur d'un run, stable d'un run à l'autre même si
+        les emails ont été classifiés par priorité ; à défaut de position
+        (service de tri, anciens résultats), dans l'ordre de traitement.
+        Le curseur lit les lignes au fur et à mesure.
+        """
+        query, params = self._current(categorie, urgence)
+        return self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM ({query}) ORDER BY run_id DESC, position, seq", params
+        )
+
+    def iter_rows(self, categorie=None, urgence=None):
+        """Résultats courants (toutes les colonnes), sous forme de dictionnaires."""
+        for row in self.iter_columns(COLUMNS, categorie, urgence):
+            yield dict(zip(COLUMNS, row))
+
+    def iter_records(self, categorie=None, urgence=None):
+        """Résultats courants au format de emails_classified.json."""
+        columns = ("message_id", "categorie", "subject", "urgence", "synthese", "cluster_id", "model", "mailbox")
+        for msg_id, categorie, subject, urgence, synthese, cluster_id, model, mailbox in self.iter_columns(
+                columns, categorie, urgence):
+            record = {"id": msg_id, "categorie": categorie, "subject": subject, "urgence": urgence, "synthese": synthese}
+            if cluster_id is not None:
+                record["cluster_id"] = cluster_id
+            if model is not None:
+                record["modele"] = model
+            if mailbox is not None:
+                record["mailbox"] = mailbox
+            yield record
+
+    def count(self, categorie=None, urgence=None):
+        query, params = self._current(categorie, urgence)
+        return self.conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+
+    def counts_by(self, column):
+        """Nombre de résultats courants par catégorie ou par urgence."""
+        if column not in ("categorie", "urgence", "model"):
+            raise ValueError(f"Colonne de regroupement inconnue : {column}")
+        rows = self.conn.execute(
+            f"SELECT {column}, COUNT(*) FROM ({CURRENT_RESULTS}) GROUP BY {column} ORDER BY COUNT(*) DESC"
+        ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# -------------------------------------------------------------
+# EXPORTS
+# -------------------------------------------------------------
+def load_json_results(filename=JSON_RESULTS_PATH):
+    """Enregistrements d'un fichier emails_classified.json ; None s'il est absent ou illisible."""
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        print(f"Erreur: '{filename}' n'est pas un JSON valide ({e}).")
+        return None
+    return [record for record in records if isinstance(record, dict)] if isinstance(records, list) else None
+
+
+def open_results(path=RESULTS_DB_PATH, json_path=JSON_RESULTS_PATH):
+    """Magasin contenant des résultats courants, ou None s'il n'y en a aucun.
+
+    Un magasin absent ou vide est d'abord rempli une fois depuis `json_path`
+    (résultats produits avant le magasin). Sans résultats à importer, aucune
+    base n'est créée : un export ne laisse jamais de magasin vide derrière lui.
+    """
+    if os.path.exists(path):
+        store = ResultsStore(path)
+        if store.count():
+            return store
+        store.close()
+    records = load_json_results(json_path)
+    if not records:
+        return None
+    store = ResultsStore(path)
+    imported = store.import_records(records)
+    print(f"{imported} résultats importés de '{json_path}' dans '{path}'.")
+    return store
+
+
+def _iter_and_close(store, categorie=None, urgence=None):
+    try:
+        yield from store.iter_records(categorie, urgence)
+    finally:
+        store.close()
+
+
+def iter_results(path=RESULTS_DB_PATH, categorie=None, urgence=None):
+    """Générateur des résultats courants (voir open_results) ; la base est fermée en fin de parcours."""
+    store = open_results(path)
+    if store is None:
+        return iter(())
+    return _iter_and_close(store, categorie, urgence)
+
+
+def export_json(filename="emails_classified.json", path=RESULTS_DB_PATH):
+    """Écrit les résultats courants au format de emails_classified.json ; renvoie leur nombre.
+
+    Sans résultat, `filename` n'est pas modifié et 0 est renvoyé.
+    """
+    store = open_results(path)
+    if store is None:
+        return 0
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    write_json_array(filename, counted(_iter_and_close(store)))
+    return count
+
+
+def export_csv(filename="emails_classified.csv", path=RESULTS_DB_PATH):
+    """Écrit les résultats courants en CSV (colonnes CSV_COLUMNS) ; renvoie leur nombre.
+
+    Sans résultat, `filename` n'est pas modifié et 0 est renvoyé.
+    """
+    tmp_path = filename + ".tmp"
+    store = open_results(path)
+    if store is None:
+        return 0
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            count = 0
+            cursor = store.iter_columns(("message_id",) + tuple(CSV_COLUMNS[1:]))
+            cursor.arraysize = 1000
+            for rows in iter(cursor.fetchmany, []):
+                writer.writerows(rows)
+                count += len(rows)
+    finally:
+        store.close()
+    os.replace(tmp_path, filename)
+    return count
+
+# -------------------------------------------------------------
+# MAIN
+# -------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulte et exporte le magasin des résultats de classification.")
+    parser.add_argument("--db", default=RESULTS_DB_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="Nombre de résultats par catégorie et par urgence")
+
+    query = subparsers.add_parser("query", help="Affiche les résultats d'une catégorie et/ou d'une urgence")
+    query.add_argument("--categorie")
+    query.add_argument("--urgence")
+
+    export = subparsers.add_parser("export", help="Exporte les résultats courants")
+    export.add_argument("format", choices=["json", "csv"])
+    export.add_argument("output", nargs="?", help="Fichier de sortie (emails_classified.json / .csv par défaut)")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        output = args.output or f"emails_classified.{args.format}"
+        exporter = export_json if args.format == "json" else export_csv
+        count = exporter(output, args.db)
+        if count:
+            print(f"{count} résultats exportés dans '{output}'.")
+        else:
+            print(f"Aucun résultat dans '{args.db}' ni dans '{JSON_RESULTS_PATH}' : '{output}' n'a pas été modifié.")
+    else:
+        store = open_results(args.db)
+        if store is None:
+            print(f"Aucun résultat dans '{args.db}' ni dans '{JSON_RESULTS_PATH}'.")
+            raise SystemExit(1)
+        try:
+            if args.command == "stats":
+                for column in ("categorie", "urgence", "model"):
+                    print(f"{column} :")
+                    for value, count in store.counts_by(column).items():
+                        print(f"  {count:6d}  {value}")
+            else:
+                for row in store.iter_rows(args.categorie, args.urgence):
+                    latency = f"{row['latency_ms']:.0f} ms" if row["latency_ms"] is not None else "-"
+                    print(f"{row['message_id']:<20} {row['urgence']:<10} {row['categorie']:<40} "
+                          f"{row['model'] or '-':<14} {latency:>8}  {row['subject']}")
+        finally:
+            store.close()
@@ -1,15 +1,11 @@
-import json
-import os
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.exceptions import DefaultCredentialsError
+import argparse
+
+import auth
+from results_store import JSON_RESULTS_PATH, RESULTS_DB_PATH, iter_results, open_results
 
 # -------------------------------------------------------------
 # CONFIGURATION
 # -------------------------------------------------------------
-# Scope requis pour lire et écrire dans Google Sheets
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
-
 # ID de votre Google Sheet
 SPREADSHEET_ID = "12U1O2_Q4I5E0ZfsN0Vc0W67zRmjZfZO7Wb8pxoo_rmg"
 
@@ -28,42 +24,40 @@ CATEGORY_SHEET_MAP = {
 # Feuille de secours pour les cas non classifiés
 FALLBACK_SHEET_NAME = "Erreurs de Classification"
 
-# En-têtes pour chaque feuille
-HEADERS = ["Sujet", "Urgence", "Synthèse"]
+# En-têtes pour chaque feuille (la boîte et l'ID Gmail servent de clé pour la synchronisation
+# incrémentale ; la boîte n'est renseignée que pour les runs multi-boîtes de coordinator.py)
+HEADERS = ["Sujet", "Urgence", "Synthèse", "ID", "Boîte"]
+ID_COLUMN = HEADERS.index("ID")
+MAILBOX_COLUMN = HEADERS.index("Boîte")
+LAST_COLUMN = chr(ord("A") + len(HEADERS) - 1)
 
 # -------------------------------------------------------------
 # AUTHENTIFICATION GOOGLE SHEETS
 # -------------------------------------------------------------
 def sheets_auth():
-    """Authentifie l'accès à Google Sheets via OAuth."""
-    
-    # Le fichier de configuration doit être présent (config.json ou client_secrets.json)
-    try:
-        with open("config.json") as f:
-            config = json.load(f)
-    except FileNotFoundError:
-        print("Erreur: Le fichier 'config.json' est introuvable. Veuillez l'utiliser pour l'authentification Sheets.")
-        raise
+    """Authentifie l'accès à Google Sheets via OAuth.
 
-    flow = InstalledAppFlow.from_client_config(config, SCOPES)
-    creds = flow.run_local_server(port=0)
-    sheets_service = build("sheets", "v4", credentials=creds)
-    return sheets_service
+    Utilise le jeton partagé avec emails.py (token.json, voir auth.py).
+    """
+    return auth.get_service("sheets", "v4")
 
 # -------------------------------------------------------------
 # LECTURE DES DONNÉES CLASSIFIÉES
 # -------------------------------------------------------------
-def load_classified_emails(filename="emails_classified.json"):
-    """Charge les emails classifiés à partir du fichier JSON."""
-    try:
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"Erreur: Le fichier '{filename}' est introuvable. Veuillez exécuter le script de classification d'abord.")
-        return None
-    except json.JSONDecodeError:
-        print(f"Erreur: Le fichier '{filename}' n'est pas un JSON valide.")
+def load_classified_emails(path=RESULTS_DB_PATH):
+    """Itère les emails classifiés du magasin de résultats (voir results_store.py),
+    sans les charger tous en mémoire ; None s'il n'y a encore aucun résultat.
+
+    Ne renvoie jamais un itérable vide : les feuilles ne sont pas effacées
+    faute de résultats.
+    """
+    store = open_results(path)
+    if store is None:
+        print(f"Erreur: aucun résultat dans '{path}' ni dans '{JSON_RESULTS_PATH}'. "
+              f"Veuillez exécuter le script de classification d'abord.")
         return None
+    store.close()
+    return iter_results(path)
 
 # -------------------------------------------------------------
 # VÉRIFICATION ET CRÉATION DES FEUILLES
@@ -115,44 +109,90 @@ def ensure_sheets_exist(service, spreadsheet_id, required_sheet_names):
 
 
 # -------------------------------------------------------------
-# ÉCRITURE DANS GOOGLE SHEETS
+# REGROUPEMENT PAR FEUILLE
 # -------------------------------------------------------------
-def write_results_to_sheets():
-    """Pipeline principal pour charger les emails et écrire les résultats
-    dans les feuilles de calcul Google Sheets correspondantes."""
+def required_sheet_names():
+    """Noms des feuilles de catégorie, dans l'ordre de CATEGORY_SHEET_MAP."""
+    return list(dict.fromkeys(CATEGORY_SHEET_MAP.values()))
 
-    print("Chargement des emails classifiés...")
-    emails = load_classified_emails()
-    if not emails:
-        return
-
-    print("Authentification Google Sheets...")
-    try:
-        sheets_service = sheets_auth()
-    except Exception as e:
-        print(f"Échec de l'authentification Google Sheets: {e}")
-        return
-        
-    required_sheets = set(CATEGORY_SHEET_MAP.values())
-    ensure_sheets_exist(sheets_service, SPREADSHEET_ID, required_sheets)
 
-    # 1. Grouper les emails par catégorie
-    grouped_emails = {sheet_name: [] for sheet_name in required_sheets}
+def group_rows_by_sheet(emails):
+    """Regroupe les emails en lignes [Sujet, Urgence, Synthèse, ID, Boîte] par feuille."""
+    grouped_emails = {sheet_name: [] for sheet_name in required_sheet_names()}
     
     for email in emails:
         category = email.get("categorie", "Non classifié")
         sheet_name = CATEGORY_SHEET_MAP.get(category, FALLBACK_SHEET_NAME)
         
-        # Créer la ligne de données [Sujet, Urgence, Synthèse]
+        # Créer la ligne de données [Sujet, Urgence, Synthèse, ID, Boîte]
         row_data = [
             email.get("subject", ""),
             email.get("urgence", ""),
-            email.get("synthese", "")
+            email.get("synthese", ""),
+            email.get("id", ""),
+            email.get("mailbox", "")
         ]
         grouped_emails[sheet_name].append(row_data)
+    return grouped_emails
+
+# -------------------------------------------------------------
+# ÉCRITURE DANS GOOGLE SHEETS
+# -------------------------------------------------------------
+def write_results_to_sheets(incremental=False, one_shot=False, sheets_service=None):
+    """Pipeline principal pour charger les emails et écrire les résultats
+    dans les feuilles de calcul Google Sheets correspondantes.
+
+    Par défaut chaque feuille est effacée puis réécrite ; avec
+    `incremental=True`, seules les différences sont envoyées (voir sync_sheets) ;
+    avec `one_shot=True`, tout le classeur est réécrit en une seule requête
+    batchUpdate (voir export_sheets_one_shot).
+    """
+
+    print("Chargement des emails classifiés...")
+    emails = load_classified_emails()
+    if emails is None:
+        return
+
+    if sheets_service is None:
+        print("Authentification Google Sheets...")
+        try:
+            sheets_service = sheets_auth()
+        except Exception as e:
+            print(f"Échec de l'authentification Google Sheets: {e}")
+            return
+
+    # 1. Grouper les emails par catégorie
+    grouped_emails = group_rows_by_sheet(emails)
 
     print(f"Début de l'écriture dans la feuille de calcul : {SPREADSHEET_ID}")
 
+    if one_shot:
+        try:
+            stats = export_sheets_one_shot(sheets_service, SPREADSHEET_ID, grouped_emails)
+        except Exception as e:
+            # batchUpdate est atomique : en cas d'échec, le classeur n'a pas été modifié
+            print(f"!!! ERREUR lors de l'export, aucune feuille n'a été modifiée : {e}")
+            return
+        created = f", feuilles créées : {', '.join(stats['created'])}" if stats["created"] else ""
+        print(f"-> Export : {stats['rows']} lignes dans {stats['sheets']} feuilles "
+              f"en {stats['api_calls']} allers-retours{created}.")
+        print("\n Processus d'écriture dans Google Sheets terminé.")
+        return
+
+    required_sheets = required_sheet_names()
+    ensure_sheets_exist(sheets_service, SPREADSHEET_ID, required_sheets)
+
+    if incremental:
+        try:
+            stats = sync_sheets(sheets_service, SPREADSHEET_ID, grouped_emails)
+        except Exception as e:
+            print(f"!!! ERREUR lors de la synchronisation incrémentale : {e}")
+            return
+        print(f"-> Synchronisation : {stats['appended']} lignes ajoutées, {stats['updated']} lignes modifiées, "
+              f"{stats['blanked']} lignes vidées, {stats['cells']} cellules écrites en {stats['api_calls']} appels.")
+        print("\n Processus d'écriture dans Google Sheets terminé.")
+        return
+
     for sheet_name, data_rows in grouped_emails.items():
         if not data_rows:
             print(f"-> Aucune donnée pour la feuille '{sheet_name}'. Ignoré.")
@@ -165,8 +205,8 @@ def write_results_to_sheets():
         range_name = f"'{sheet_name}'!A1"
 
         # 4. Nettoyer la feuille avant d'écrire pour éviter les doublons/données obsolètes
-        # Nous allons effacer toute la colonne A à C, y compris les en-têtes
-        clear_range = f"'{sheet_name}'!A1:C" 
+        # Nous allons effacer toutes les colonnes de A à D, y compris les en-têtes
+        clear_range = f"'{sheet_name}'!A1:{LAST_COLUMN}" 
 
         try:
             # Effacement
@@ -194,8 +234,201 @@ def write_results_to_sheets():
 
     print("\n Processus d'écriture dans Google Sheets terminé.")
 
+# -------------------------------------------------------------
+# SYNCHRONISATION INCRÉMENTALE (DIFF PAR LIGNE)
+# -------------------------------------------------------------
+def _pad(row):
+    # L'API omet les cellules vides en fin de ligne
+    row = [str(value) for value in row[:len(HEADERS)]]
+    return row + [""] * (len(HEADERS) - len(row))
+
+
+def diff_sheet(sheet_name, existing_rows, desired_rows):
+    """Calcule les plages à écrire pour passer de `existing_rows` à `desired_rows`.
+
+    Les lignes sont appariées sur (boîte, ID Gmail) : une ligne connue n'est réécrite
+    que dans ses cellules modifiées, une ligne nouvelle est ajoutée en fin de
+    feuille et une ligne dont l'email a quitté la feuille est vidée. Une
+    feuille sans en-tête à jour, ou contenant des lignes sans ID (ancien
+    format), est réécrite entièrement.
+    Renvoie (liste de ValueRange, statistiques).
+    """
+    stats = {"appended": 0, "updated": 0, "blanked": 0, "cells": 0}
+    existing = [_pad(row) for row in existing_rows]
+    desired = [_pad(row) for row in desired_rows]
+    data = []
+
+    def write(row_number, column, values):
+        start = chr(ord("A") + column)
+        end = chr(ord("A") + column + len(values[0]) - 1)
+        data.append({
+            "range": f"'{sheet_name}'!{start}{row_number}:{end}{row_number + len(values) - 1}",
+            "values": values
+        })
+        stats["cells"] += sum(len(row) for row in values)
+
+    body = existing[1:]
+    if not existing or existing[0] != HEADERS or any(not row[ID_COLUMN] for row in body if any(row)):
+        # Réécriture complète : en-tête + données, lignes excédentaires vidées
+        rows = [HEADERS] + desired
+        rows += [[""] * len(HEADERS)] * max(0, len(existing) - len(rows))
+        write(1, 0, rows)
+        stats["appended"] = len(desired)
+        return data, stats
+
+    # Ligne (numérotée à partir de 1, en-tête compris) de chaque (boîte, ID) déjà présent
+    positions = {(row[MAILBOX_COLUMN], row[ID_COLUMN]): index + 2 for index, row in enumerate(body) if row[ID_COLUMN]}
+    desired_ids = set()
+    appended = []
+    for row in desired:
+        row_id = (row[MAILBOX_COLUMN], row[ID_COLUMN])
+        desired_ids.add(row_id)
+        if row_id not in positions:
+            appended.append(row)
+            continue
+        current = existing[positions[row_id] - 1]
+        changed = [column for column in range(len(HEADERS)) if current[column] != row[column]]
+        if changed:
+            stats["updated"] += 1
+            # Une seule plage couvrant les cellules modifiées de la ligne
+            first, last = changed[0], changed[-1]
+            write(positions[row_id], first, [row[first:last + 1]])
+
+    for row_id, row_number in positions.items():
+        if row_id not in desired_ids:
+            stats["blanked"] += 1
+            write(row_number, 0, [[""] * len(HEADERS)])
+
+    if appended:
+        stats["appended"] = len(appended)
+        write(len(existing) + 1, 0, appended)
+    return data, stats
+
+
+def sync_sheets(service, spreadsheet_id, grouped_rows):
+    """Synchronise toutes les feuilles en deux appels : une lecture
+    values().batchGet et une écriture values().batchUpdate des seules différences."""
+    sheet_names = list(grouped_rows)
+    response = service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[f"'{name}'!A1:{LAST_COLUMN}" for name in sheet_names],
+        # Valeurs telles qu'enregistrées, sans mise en forme : comparables à celles écrites
+        valueRenderOption="UNFORMATTED_VALUE"
+    ).execute()
+    api_calls = 1
+
+    totals = {"appended": 0, "updated": 0, "blanked": 0, "cells": 0}
+    data = []
+    for sheet_name, value_range in zip(sheet_names, response.get("valueRanges", [])):
+        sheet_data, stats = diff_sheet(sheet_name, value_range.get("values", []), grouped_rows[sheet_name])
+        data.extend(sheet_data)
+        for key in totals:
+            totals[key] += stats[key]
+
+    if data:
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            # Valeurs écrites telles quelles, comme l'export en une requête (stringValue) : un id
+            # numérique, un sujet en forme de date ou commençant par "=" ne sont pas réinterprétés,
+            # et la relecture de la synchronisation suivante retrouve exactement ces valeurs
+            body={"valueInputOption": "RAW", "data": data}
+        ).execute()
+        api_calls += 1
+    totals["api_calls"] = api_calls
+    return totals
+
+# -------------------------------------------------------------
+# EXPORT EN UNE SEULE REQUÊTE BATCHUPDATE
+# -------------------------------------------------------------
+def _cell_row(values):
+    # Valeurs écrites telles quelles (un sujet commençant par "=" reste du texte)
+    return {"values": [{"userEnteredValue": {"stringValue": str(value)}} for value in values]}
+
+
+def export_sheets_one_shot(service, spreadsheet_id, grouped_rows):
+    """Crée les feuilles manquantes et réécrit toutes les feuilles de catégorie
+    en deux allers-retours : une lecture des métadonnées et un seul
+    spreadsheets().batchUpdate.
+
+    Les requêtes d'un batchUpdate sont appliquées de façon atomique : si
+    l'une échoue, aucune feuille n'est créée ni modifiée.
+    updateCells n'écrit pas au-delà de la grille d'une feuille : les
+    feuilles créées sont dimensionnées pour leurs lignes, les feuilles
+    existantes trop petites sont agrandies (appendDimension) dans le même lot.
+    """
+    spreadsheet = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields="sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))"
+    ).execute()
+    sheet_ids = {}
+    grids = {}
+    for sheet in spreadsheet.get("sheets", []):
+        properties = sheet["properties"]
+        sheet_ids[properties["title"]] = properties["sheetId"]
+        grids[properties["title"]] = properties.get("gridProperties", {})
+
+    requests = []
+    created = []
+    # Les feuilles créées reçoivent un sheetId choisi ici, pour être remplies dans le même lot
+    next_id = max(sheet_ids.values(), default=0) + 1
+    for sheet_name, data_rows in grouped_rows.items():
+        # En-tête compris
+        needed = {"ROWS": len(data_rows) + 1, "COLUMNS": len(HEADERS)}
+        if sheet_name not in sheet_ids:
+            sheet_ids[sheet_name] = next_id
+            next_id += 1
+            created.append(sheet_name)
+            requests.append({"addSheet": {"properties": {
+                "sheetId": sheet_ids[sheet_name],
+                "title": sheet_name,
+                "gridProperties": {"rowCount": needed["ROWS"], "columnCount": needed["COLUMNS"]}
+            }}})
+            continue
+        grid = grids[sheet_name]
+        current = {"ROWS": grid.get("rowCount", 0), "COLUMNS": grid.get("columnCount", 0)}
+        for dimension, count in needed.items():
+            if current[dimension] < count:
+                requests.append({"appendDimension": {
+                    "sheetId": sheet_ids[sheet_name], "dimension": dimension, "length": count - current[dimension]
+                }})
+
+    for sheet_name, data_rows in grouped_rows.items():
+        # Efface les colonnes de HEADERS puis écrit en-têtes et données à partir de A1
+        requests.append({"updateCells": {
+            "range": {"sheetId": sheet_ids[sheet_name], "startColumnIndex": 0, "endColumnIndex": len(HEADERS)},
+            "fields": "userEnteredValue"
+        }})
+        requests.append({"updateCells": {
+            "start": {"sheetId": sheet_ids[sheet_name], "rowIndex": 0, "columnIndex": 0},
+            "rows": [_cell_row(row) for row in [HEADERS] + data_rows],
+            "fields": "userEnteredValue"
+        }})
+
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={"requests": requests}
+    ).execute()
+    return {
+        "api_calls": 2,
+        "sheets": len(grouped_rows),
+        "rows": sum(len(rows) for rows in grouped_rows.values()),
+        "created": created
+    }
+
 # -------------------------------------------------------------
 # MAIN
 # -------------------------------------------------------------
 if __name__ == "__main__":
-    write_results_to_sheets()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export des emails classifiés vers Google Sheets.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="N'écrit que les lignes ajoutées ou modifiées depuis le dernier export."
+    )
+    parser.add_argument(
+        "--one-shot",
+        action="store_true",
+        help="Crée les feuilles et réécrit tout le classeur en une seule requête batchUpdate."
+    )
+    args = parser.parse_args()
+    write_results_to_sheets(incremental=args.incremental, one_shot=args.one_shot)
\ No newline at end of file
@@ -0,0 +1,87 @@
+import json
+import os
+import textwrap
+
+# -------------------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------------------
+# Journal des résultats, écrit au fil de l'eau (une ligne JSON par email)
+RESULTS_JSONL_PATH = os.getenv("RESULTS_JSONL_PATH", "emails_classified.jsonl")
+
+# -------------------------------------------------------------
+# LECTURE / ÉCRITURE JSON LINES
+# -------------------------------------------------------------
+def iter_jsonl(filename):
+    """Lit un fichier JSON Lines enregistrement par enregistrement.
+
+    Une dernière ligne tronquée (arrêt brutal pendant l'écriture) est ignorée.
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ligne incomplète ignorée dans '{filename}'.")
+    except FileNotFoundError:
+        return
+
+
+class JsonLinesSink:
+    """Écrit chaque email classifié dès qu'il est prêt, une ligne JSON par email.
+
+    Avec `resume=True`, le fichier existant est conservé et les ids déjà
+    traités sont exposés dans `completed_ids` pour reprendre après une
+    interruption ; sinon il est vidé.
+    """
+
+    def __init__(self, filename=RESULTS_JSONL_PATH, resume=False):
+        self.filename = filename
+        self.completed_ids = set()
+        self.last_id = None
+        if resume:
+            for record in iter_jsonl(filename):
+                self.completed_ids.add(record.get("id"))
+                self.last_id = record.get("id")
+            self._truncate_partial_line()
+        self.file = open(filename, "a" if resume else "w", encoding="utf-8")
+        self.written = 0
+
+    def _truncate_partial_line(self):
+        # Supprime une éventuelle ligne incomplète pour que l'ajout reparte proprement
+        try:
+            with open(self.filename, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    f.truncate(end)
+        except FileNotFoundError:
+            pass
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Vidé à chaque email : un arrêt brutal ne perd que l'email en cours
+        self.file.flush()
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+# -------------------------------------------------------------
+# EXPORT JSON
+# -------------------------------------------------------------
+def write_json_array(filename, records):
+    """Écrit `records` (itérable) au même format que json.dump(..., indent=4),
+    sans construire la liste complète en mémoire."""
+    tmp_path = filename + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        first = True
+        for record in records:
+            f.write("[\n" if first else ",\n")
+            f.write(textwrap.indent(json.dumps(record, ensure_ascii=False, indent=4), "    "))
+            first = False
+        f.write("[]" if first else "\n]")
+    os.replace(tmp_path, filename)